@@ -1,104 +1,537 @@
 #!/usr/bin/python3
 import logging
-from lulu_pcol_sim import sim
+import collections # for OrderedDict
+import concurrent.futures # for ProcessPoolExecutor
+import contextlib # for contextmanager
+import copy # for deepcopy()
+import hashlib # for sha256()
+import importlib # for import_module()
+import io # for StringIO, BytesIO
+import json # for the --incremental stamp file
+import os # for path.exists()
+import re # for matching objects that result from wildcard expansion
+import struct # for pack() of the colony image
 import sys # for argv
-import time # for strftime()
-import natsort # for natural sorting of alphabet (needed because the order of objects has to be B_0, B_1, B_2, B_10, B_11 and not B_0, B_1, B_10, B_11, ...)
+import time # for strftime(), perf_counter()
+
+class LazyModule():
+    """Proxy that imports a module only when one of its attributes is used for the first time,
+    so that importing lulu_c.py (and printing the usage errors) does not wait for the import of lulu_pcol_sim and natsort"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        if (self._module == None):
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+# end class LazyModule
+
+sim = LazyModule("lulu_pcol_sim.sim")
+natsort = LazyModule("natsort") # for natural sorting of alphabet (needed because the order of objects has to be B_0, B_1, B_2, B_10, B_11 and not B_0, B_1, B_10, B_11, ...)
+
+# version of the generator, part of the hash used by --incremental
+generator_version = "1.1"
+
+# if not None, the hash of the inputs of the generator (stored in the .stamp file), the generation time is left out of the generated files
+# and files are only written if their content changed (--incremental)
+generation_stamp = None
+
+# paths of the files written by openOutputFile()
+output_files = []
+
+def getGenerationStamp():
+    """Returns the text that identifies the generation in the comments of the generated files
+
+    :returns: The generation time or, if generation_stamp is set, a constant text so that the files that are not affected
+    by a change of the input file keep their content (and are not rewritten)"""
+
+    if (generation_stamp != None):
+        return "(with --incremental, see the .stamp file)"
+    return "on %s" % time.strftime("%d %h %Y at %H:%M")
+# end getGenerationStamp()
+
+@contextlib.contextmanager
+def openOutputFile(path, binary = False):
+    """Open a generated file for writing. The content is written when the file is closed and,
+    if generation_stamp is set, only if it differs from the existing file so that its timestamp is kept
+
+    :path: The path of the file that will be written
+    :binary: If True, the file collects bytes instead of text
+    :returns: A file object that collects the content of the file"""
+
+    fout = io.BytesIO() if binary else io.StringIO()
+    yield fout
+
+    output_files.append(path)
+    content = fout.getvalue()
+    mode = "b" if binary else ""
+    if (generation_stamp != None and os.path.exists(path)):
+        with open(path, "r" + mode) as fin:
+            if (fin.read() == content):
+                logging.debug("%s is unchanged" % path)
+                return
+
+    with open(path, "w" + mode) as f:
+        f.write(content)
+# end openOutputFile()
+
+def computeGenerationHash(input_path, args):
+    """Compute the hash of all of the inputs of the generator: the Lulu input file, the command line parameters
+    that affect the generated code and the generator itself
+
+    :input_path: The path of the Lulu input file
+    :args: The command line parameters
+    :returns: Hex string of the hash"""
+
+    # parameters that do not affect the generated files
+    ignored = ("--debug", "--incremental", "--jobs=", "--depfile=")
+
+    h = hashlib.sha256()
+    h.update(generator_version.encode())
+    with open(os.path.abspath(__file__), "rb") as fin:
+        h.update(fin.read())
+    with open(input_path, "rb") as fin:
+        h.update(fin.read())
+    for arg in args:
+        if (not arg.startswith(ignored)):
+            h.update(b"\0" + arg.encode())
+
+    return h.hexdigest()[:16]
+# end computeGenerationHash()
+
+def readGenerationStampFile(path, stamp):
+    """Check whether the files recorded in a stamp file were generated from inputs with the given hash and still exist
+
+    :path: The path of the stamp file
+    :stamp: The hash of the current inputs, computed by computeGenerationHash()
+    :returns: The list of generated files if they are up to date, None otherwise"""
 
-def createInstanceHeader(pcol, path, originalFilename, nr_robots):
-    """Create an instance of the passed P colony that is written as a header in C at the given path
+    try:
+        with open(path, "r") as fin:
+            saved = json.load(fin)
+    except (OSError, ValueError):
+        return None
 
-    :pcol: The pcolony object that was read by lulu_pcol_sim
-    :path: The path to the instance.h that will be written"""
+    if (saved.get("hash") != stamp or not all(os.path.exists(output) for output in saved.get("outputs", []))):
+        return None
+    return saved["outputs"]
+# end readGenerationStampFile()
 
-    needsWildcardExpansion = False
+def writeDepfile(path, outputs, input_path):
+    """Write a Make/Ninja depfile that lists the generated files as targets that depend on the Lulu input file and on the generator
 
+    :path: The path of the depfile
+    :outputs: The generated files
+    :input_path: The path of the Lulu input file"""
+
+    escape = lambda p: p.replace(" ", "\\ ")
     with open(path, "w") as fout:
+        fout.write("%s: %s %s\n" % (" ".join(escape(output) for output in outputs), escape(input_path), escape(os.path.abspath(__file__))))
+# end writeDepfile()
+
+def getExpandedAlphabet(objects, nr_robots):
+    """Extend a set of objects with the objects that result from wildcard expansion and sort them naturally
+
+    :objects: The objects (with wildcarded marks already replaced)
+    :nr_robots: The number of robots that make up the swarm
+    :returns: (sorted list of objects, True if there are wildcarded objects) tuple"""
+
+    alphabet = set(objects)
+
+    # both $ and $id wildcards need extended objects and B_W_ID and B_W_ALL both extend to B_0, B_1, ...
+    # so each distinct extension pattern is generated only once
+    extension_patterns = set()
+    for a in alphabet:
+        if ("_W_ALL" in a or "_W_ID" in a):
+            logging.debug("Extending %s wildcarded object" % a)
+            extension_patterns.add(a.replace("%", "%%").replace("W_ID", "%d").replace("W_ALL", "%d"))
+
+    # extend wildcard objects to _0, _1, ... _n where n = nr_robots
+    for pattern in extension_patterns:
+        alphabet.update([pattern % ((i,) * pattern.count("%d")) for i in range(nr_robots)])
+
+    # sort objects naturally (only once, after all of the extensions were added)
+    return (natsort.natsorted(alphabet, key=lambda x: x.replace('_W_ID', '/').replace('_W_ALL', '.')), len(extension_patterns) > 0)
+# end getExpandedAlphabet()
+
+def expandAlphabet(pcol, nr_robots):
+    """Extend the alphabet of the P colony with the objects that result from wildcard expansion and sort it naturally
+
+    :pcol: The pcolony object that was read by lulu_pcol_sim
+    :nr_robots: The number of robots that make up the swarm
+    :returns: True if the alphabet contains wildcarded objects"""
+
+    pcol.A, has_wildcards = getExpandedAlphabet(pcol.A, nr_robots)
+
+    return has_wildcards
+# end expandAlphabet()
+
+def getSwarmAlphabet(pswarm, nr_robots):
+    """Compute the alphabet shared by all of the colonies of a Pswarm (see --swarm-objects), so that each object has the same id
+    in all of the colonies and objects can be exchanged through the global environments by copying their ids
+
+    :pswarm: The Pswarm that was read by lulu_pcol_sim (it is not modified)
+    :nr_robots: The number of robots that make up the swarm
+    :returns: The extended and naturally sorted union of the alphabets of the colonies and of the objects of the global environments"""
+
+    objects = set(['e', 'f'])
+    for pcol in pswarm.colonies.values():
+        objects.update(pcol.A)
+    for env in [pswarm.global_env, pswarm.in_global_env, pswarm.out_global_env]:
+        objects.update(env)
+
+    return getExpandedAlphabet([replaceObjectWildcardMarks(obj) for obj in objects], nr_robots)[0]
+# end getSwarmAlphabet()
+
+def expandPcolonyForRobot(pcol, nr_robots, my_symbolic_id):
+    """Create a copy of the passed P colony in which all wildcarded objects are expanded for a single robot.
+    This is the ahead-of-time equivalent of the expand_pcolony() function that is generated for the robot:
+        * objects that contain _W_ID are replaced with _i where i = my_symbolic_id
+        * programs that contain _W_ALL objects are replaced by nr_robots - 1 programs, one for each i != my_symbolic_id
+    Wildcarded objects are removed from the alphabet of the copy so all of the expanded instances share the same object ids,
+    except for the _W_ALL objects of the multisets, that are kept as they are (like expand_pcolony() does) and are the same for all of the robots
+
+    :pcol: The pcolony object whose alphabet was already extended by expandAlphabet()
+    :nr_robots: The number of robots that make up the swarm
+    :my_symbolic_id: The symbolic id of the robot (kilo_uid - smallest_robot_uid)
+    :returns: The expanded copy of the pcolony"""
+
+    robot_pcol = copy.deepcopy(pcol)
+    replaceID = lambda obj: obj.replace("_W_ID", "_%d" % my_symbolic_id)
+
+    multisets = [robot_pcol.env] + [agent.obj for agent in robot_pcol.agents.values()]
+    if (robot_pcol.parentSwarm != None):
+        multisets.extend([robot_pcol.parentSwarm.global_env, robot_pcol.parentSwarm.in_global_env, robot_pcol.parentSwarm.out_global_env])
+    # wild_ANY objects that remain in the multisets and thus stay in the alphabet
+    kept_objects = set()
+    for multiset in multisets:
+        for key in list(multiset):
+            if ("_W_ALL" in key):
+                logging.warning("wild_ANY object %s from a multiset is not expanded" % key)
+                kept_objects.add(key)
+            if ("_W_ID" in key):
+                nr = multiset.pop(key)
+                multiset[replaceID(key)] = multiset.get(replaceID(key), 0) + nr
+
+    for agent in robot_pcol.agents.values():
+        programs = []
+        for prg in agent.programs:
+            has_wild_any = False
+            for rule in prg:
+                rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs = [replaceID(obj) for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs)]
+                if ("_W_ALL" in rule.lhs or "_W_ALL" in rule.rhs or "_W_ALL" in rule.alt_lhs or "_W_ALL" in rule.alt_rhs):
+                    has_wild_any = True
+
+            if (not has_wild_any):
+                programs.append(prg)
+                continue
+
+            # replace the program with one copy for each of the other robots
+            for i in range(nr_robots):
+                if (i == my_symbolic_id):
+                    continue
+                expanded_prg = copy.deepcopy(prg)
+                for rule in expanded_prg:
+                    rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs = [obj.replace("_W_ALL", "_%d" % i) for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs)]
+                programs.append(expanded_prg)
+        agent.programs = programs
+
+    robot_pcol.A = [obj for obj in robot_pcol.A if (obj in kept_objects or ("_W_ALL" not in obj and "_W_ID" not in obj))]
+
+    return robot_pcol
+# end expandPcolonyForRobot()
+
+# C macros defined in the instance header for the agents whose code is optional in Lulu_kilobot
+optional_agents = ["motion", "led_rgb", "msg_distance", "timer"]
+
+# label of each environment of the parent Pswarm, used in the comments of lulu_init()
+global_env_labels = collections.OrderedDict([("global_env", "global pswarm environment"), ("in_global_env", "INPUT global pswarm environment"),
+    ("out_global_env", "OUTPUT global pswarm environment")])
+
+def compilePcolony(pcol, nr_robots, swarm_alphabet = None, swarm_remap = False):
+    """Compile the P colony into the intermediate representation (IR) that is rendered by createInstanceHeader() and createInstanceSource().
+    The alphabet is extended (see expandAlphabet()), objects are interned to their integer ids and everything that the generators need
+    (C identifiers, rules without repetitions, wildcard flags, number of programs after expansion, used features)
+    is computed in a single pass over the P colony
+
+    :pcol: The pcolony object (with wildcarded marks already replaced) that will be compiled
+    :nr_robots: The number of robots that make up the swarm
+    :swarm_alphabet: If not None, the object ids are assigned from this alphabet, shared by all of the colonies of the Pswarm (see getSwarmAlphabet())
+    :swarm_remap: If True (and swarm_alphabet), the constant tables use compact colony local object ids (see 'local_objects')
+    :returns: Dictionary with the following keys:
+        'alphabet': the (extended) alphabet, in the order of pcol.A (or the swarm alphabet)
+        'object_ids': dictionary object -> id, knowing that NO_OBJECT = 0, OBJECT_ID_E = 1, OBJECT_ID_F = 2 and the rest of the alphabet starts from 3
+        'object_names': list of objects, indexed by their id
+        'object_c_names': list of the C identifiers of the objects, indexed by their id
+        'max_object_id': the largest object id
+        'local_objects': None or, if swarm_remap, the ids of the objects used by this colony, indexed by their local id
+        'env': list of (object id, multiplicity) pairs of the environment
+        'global_envs': list of (env_name, list of (object id, multiplicity) pairs) for the environments of the parent Pswarm
+        'agents': list of dictionaries with the 'name', 'c_name', 'obj' ((object id, multiplicity) pairs), 'nr_programs' (after wildcard expansion)
+            and 'programs' of each agent. Each program has a 'text', a 'has_wild_any' flag, a 'key' (identical for identical programs)
+            and 'rules' (rules without repetitions). Each rule has its 'nr' within the program, 'text', 'conditional' flag, C 'type'
+            and 4 'operands' (lhs, rhs, alt_lhs, alt_rhs object ids)
+        'n', 'nr_robots': the capacity of the agents and the number of robots that make up the swarm
+        'has_wildcards', 'obj_with_id', 'obj_with_any', 'is_obj_with_any_followed_by_id': wildcarded objects expanded by expand_pcolony()
+        'used_agents', 'using_d_all', 'using_d_next', 'using_in_out_exteroceptive_rules': features of Lulu_kilobot used by the P colony
+        'sorted_multisets', 'dense_envs': the layout of the multisets, set by sortMultisets()"""
+
+    has_wildcards = expandAlphabet(pcol, nr_robots)
+    # prevent alphabet related bugs by including e and f objects in alphabet
+    alphabet = set(pcol.A)
+    if ("e" not in alphabet):
+        pcol.A.append("e")
+    if ("f" not in alphabet):
+        pcol.A.append("f")
+    # objects of this colony, the ids can also be assigned to objects of the other colonies of the Pswarm
+    colony_objects = set(pcol.A)
+    if (swarm_alphabet != None):
+        pcol.A = list(swarm_alphabet)
+
+    ir = {"alphabet": list(pcol.A), "n": pcol.n, "nr_robots": nr_robots, "has_wildcards": has_wildcards}
+
+    object_ids = {"": 0, "e": 1, "f": 2}
+    object_names = ["no_object", "e", "f"]
+    for obj in pcol.A:
+        if (obj not in object_ids):
+            object_ids[obj] = len(object_names)
+            object_names.append(obj)
+    ir["object_ids"] = object_ids
+    ir["object_names"] = object_names
+    ir["object_c_names"] = ["NO_OBJECT"] + ["OBJECT_ID_%s" % obj.upper() for obj in object_names[1:]]
+    ir["max_object_id"] = len(object_names) - 1
+
+    used_objects = set(object_ids[obj] for obj in colony_objects)
+    def intern(obj):
+        if (obj not in object_ids):
+            raise ValueError("Object %s is used by the P colony but it is not part of the alphabet" % obj)
+        used_objects.add(object_ids[obj])
+        return object_ids[obj]
+
+    ir["env"] = [(intern(obj), nr) for obj, nr in pcol.env.items()]
+    ir["global_envs"] = [(env_name, [(intern(obj), nr) for obj, nr in getGlobalEnvItems(pcol, env_name)]) for env_name in global_env_labels]
+
+    exteroceptive_types = (sim.RuleType.in_exteroceptive, sim.RuleType.out_exteroceptive)
+    ir["using_in_out_exteroceptive_rules"] = False
+    ir["agents"] = []
+    for ag_name in pcol.B:
+        agent = {"name": ag_name, "c_name": "AGENT_%s" % ag_name.upper(), "programs": []}
+        agent["obj"] = [(intern(obj), nr) for obj, nr in pcol.agents[ag_name].obj.items()]
+
+        for prg in pcol.agents[ag_name].programs:
+            program = {"text": prg.print(), "has_wild_any": False, "rules": []}
+            for rule_nr, rule in enumerate(prg):
+                if (rule.type in exteroceptive_types or rule.alt_type in exteroceptive_types):
+                    ir["using_in_out_exteroceptive_rules"] = True
+                if ("_W_ALL" in rule.lhs or "_W_ALL" in rule.rhs or "_W_ALL" in rule.alt_lhs or "_W_ALL" in rule.alt_rhs):
+                    program["has_wild_any"] = True
+                # skip rules that contain identical operands and thus have no effect
+                if (isNoOpRule(rule)):
+                    continue
+
+                if (rule.main_type != sim.RuleType.conditional):
+                    rule_type = "RULE_TYPE_%s" % rule.type.name.upper()
+                    operands = (intern(rule.lhs), intern(rule.rhs), 0, 0)
+                else:
+                    rule_type = "RULE_TYPE_CONDITIONAL_%s_%s" % (rule.type.name.upper(), rule.alt_type.name.upper())
+                    operands = (intern(rule.lhs), intern(rule.rhs), intern(rule.alt_lhs), intern(rule.alt_rhs))
+                program["rules"].append({"nr": rule_nr, "text": rule.print(toString=True), "conditional": rule.main_type == sim.RuleType.conditional,
+                    "type": rule_type, "operands": operands})
+
+            if (program["has_wild_any"]):
+                logging.debug("wild_ANY objects exist in program %s" % program["text"])
+            program["key"] = tuple((rule["type"],) + rule["operands"] for rule in program["rules"])
+            agent["programs"].append(program)
+
+        # each program with * wildcard objects is replaced by nr_robots - 1 programs at runtime
+        agent["nr_programs"] = len(agent["programs"]) + (nr_robots - 1) * len([prg for prg in agent["programs"] if prg["has_wild_any"]])
+        ir["agents"].append(agent)
+
+    # only the wildcarded objects of this colony are expanded but the order of the objects (B_W_ALL, B_W_ID, B_0, B_1, ...) is given by the alphabet
+    ir["obj_with_id"] = [object_ids[obj] for obj in pcol.A if ("_W_ID" in obj and obj in colony_objects)]
+    ir["obj_with_any"] = []
+    ir["is_obj_with_any_followed_by_id"] = []
+    for i, obj in enumerate(pcol.A):
+        if (obj.endswith("_W_ALL") and obj in colony_objects):
+            ir["obj_with_any"].append(object_ids[obj])
+            # check if this _$ wildcarded object is followed by a _$id object
+            ir["is_obj_with_any_followed_by_id"].append(1 if (i < len(pcol.A) - 1 and "_W_ID" in pcol.A[i + 1]) else 0)
+
+    ir["used_agents"] = [ag_name for ag_name in optional_agents if ag_name in pcol.B]
+    ir["using_d_all"] = "d_all" in alphabet
+    ir["using_d_next"] = "d_next" in alphabet
+    ir["local_objects"] = sorted(used_objects | set([0, 1, 2])) if (swarm_alphabet != None and swarm_remap) else None
+    ir["sorted_multisets"] = False
+    ir["dense_envs"] = False
+
+    return ir
+# end compilePcolony()
+
+def sortMultisets(ir, dense_env_limit):
+    """Sort the multisets of the compiled P colony by object id, so that the runtime can use a binary search instead of a linear one.
+    If the alphabet has at most dense_env_limit objects, the environments are made dense instead: they contain every object of the alphabet
+    (with multiplicity 0 if it is not present), in the order of the object ids, so that object id is always found at env.items[id - 1]
+
+    :ir: The P colony compiled by compilePcolony(), that is modified in place
+    :dense_env_limit: The largest alphabet for which the environments are dense"""
+
+    ir["sorted_multisets"] = True
+    # the runtime allocates the environments for the whole alphabet, so each object id has a slot
+    ir["dense_envs"] = ir["max_object_id"] <= min(dense_env_limit, len(ir["alphabet"]))
+
+    def sortEnv(items):
+        if (ir["dense_envs"]):
+            counts = dict(items)
+            return [(obj_id, counts.get(obj_id, 0)) for obj_id in range(1, ir["max_object_id"] + 1)]
+        return sorted(items)
+
+    ir["env"] = sortEnv(ir["env"])
+    ir["global_envs"] = [(env_name, sortEnv(items)) for env_name, items in ir["global_envs"]]
+    for agent in ir["agents"]:
+        agent["obj"] = sorted(agent["obj"])
+
+    if (ir["dense_envs"]):
+        logging.info("Sorted multisets: the environments are dense arrays of %d objects" % ir["max_object_id"])
+    else:
+        logging.info("Sorted multisets: the environments are sorted by object id because the alphabet has more than %d objects" % dense_env_limit)
+# end sortMultisets()
+
+def getIdTypes(ir):
+    """Select the smallest integer type for object ids, agent ids, program counts and rule counts of the P colony
+
+    :ir: The P colony compiled by compilePcolony()
+    :returns: Dictionary name -> (C type, largest value, description of the largest value)"""
+
+    max_programs = max([agent["nr_programs"] for agent in ir["agents"]] + [0])
+    max_rules = max([len(prg["rules"]) for agent in ir["agents"] for prg in agent["programs"]] + [0])
+    max_agent_id = max(len(ir["agents"]) - 1, 0)
+
+    id_types = collections.OrderedDict()
+    id_types["object_id"] = (getSmallestUnsignedType(ir["max_object_id"]), ir["max_object_id"], "largest object id")
+    id_types["agent_id"] = (getSmallestUnsignedType(max_agent_id), max_agent_id, "largest agent id")
+    id_types["program_nr"] = (getSmallestUnsignedType(max_programs), max_programs, "largest number of programs of an agent")
+    id_types["rule_nr"] = (getSmallestUnsignedType(max_rules), max_rules, "largest number of rules of a program")
+
+    return id_types
+# end getIdTypes()
+
+def createInstanceHeader(ir, path, originalFilename, robot_symbolic_id = None, use_tables = False, program_index = False, packed_rules = False,
+        swarm_objects_header = None, compact_names = False, profile = False, image = False):
+    """Create an instance of the passed P colony that is written as a header in C at the given path
+
+    :ir: The P colony compiled by compilePcolony()
+    :path: The path to the instance.h that will be written
+    :robot_symbolic_id: If not None, the pcol was already expanded for the robot with this symbolic id by expandPcolonyForRobot()
+    :use_tables: If True, the instance source uses constant tables (see createInstanceSource())
+    :program_index: If True, the program applicability index is declared (see createInstanceSource())
+    :packed_rules: If True, the macros that decode bit-packed rules are written (see writePackedRuleMacros())
+    :swarm_objects_header: If not None, the name of the header that defines the object ids shared by all of the colonies of the Pswarm
+    (see createSwarmObjectsHeader()), that is included instead of defining the objects of this colony
+    :compact_names: If True, the names of objects and agents are accessed through lulu_object_name() and lulu_agent_name() (see writeCompactNames())
+    :profile: If True, the execution counters of programs and rules are declared (see writeProfileDeclarations())
+    :image: If True, the colony image loader is declared (see writeImageLoaderDeclarations())"""
+
+    with openOutputFile(path) as fout:
         fout.write("""// vim:filetype=c
 /**
  * @file lulu_instance.h
  * @brief Lulu P colony simulator internal structure corresponding to the P colony defined in '%s'.
  * In this header we define the structure of the Pcolony that will power the simulated robot
- * This file was generated automatically by lulu_c.py on %s
+ * This file was generated automatically by lulu_c.py %s
  * @author Andrei G. Florea
  * @author Catalin Buiu
  * @date 2016-02-29
  */
 #ifndef LULU_INSTANCE_H
 #define LULU_INSTANCE_H
+""" % (originalFilename, getGenerationStamp()))
 
-#include "lulu.h" """ % (originalFilename, time.strftime("%d %h %Y at %H:%M")))
-
-        fout.write("\nenum objects {")
-        # extend wildcard objects to _0, _1, ... _n where n = nr_robots
-        for a in pcol.A[:]:
-            # both $ and $id wildcards need extended objects
-            if ("_W_ALL" in a or "_W_ID" in a):
-                needsWildcardExpansion = True
-                logging.debug("Extending %s wildcarded object" % a)
-                # construct extended object list
-                extension = [a.replace("W_ID", "%d" % i).replace("W_ALL", "%d" % i) for i in range(nr_robots)]
-                # if this extension has not been previously added
-                if (not set(extension).issubset(set(pcol.A))):
-                    #add the extetendet object list to the alphabet
-                    pcol.A.extend(extension)
-
-        # sort objects naturally
-        pcol.A = natsort.natsorted(pcol.A, key=lambda x: x.replace('_W_ID', '/').replace('_W_ALL', '.'))
-        for i, obj in enumerate(pcol.A):
-            if (obj in ['e', 'f']):
-                continue; # they are already defined in lulu.h
-            if (i == 0):
-                # NO_OBJECT = 0, OBJECT_ID_E = 1, OBJECT_ID_F = 2
-                fout.write("\n    OBJECT_ID_%s = 3," % obj.upper());
-            else:
-                fout.write("\n    OBJECT_ID_%s," % obj.upper());
+        # the types are defined before lulu.h so that the runtime structures can be sized accordingly
+        id_types = getIdTypes(ir)
+        if (id_types["object_id"][0] != "uint8_t"):
+            logging.warning("The alphabet has %d objects so object ids need the %s type. The Lulu runtime must be built with LULU_OBJECT_ID_TYPE" % (
+                len(ir["object_names"]) - 1, id_types["object_id"][0]))
 
-        fout.write("\n};")
+        fout.write("""\n//smallest integer types that can hold the ids and counts of this P colony (selected by lulu_c.py)""")
+        for name, (c_type, max_value, description) in id_types.items():
+            fout.write("""\n#define LULU_%s_TYPE %s //%s = %d""" % (name.upper(), c_type, description, max_value))
+        fout.write("""\n#define LULU_NR_OBJECTS %d""" % (ir["max_object_id"] + 1))
+        fout.write("""\n#define LULU_NR_AGENTS %d""" % len(ir["agents"]))
+
+        fout.write("""\n\n#include "lulu.h"
+""")
+        for name in id_types:
+            fout.write("""\ntypedef LULU_%s_TYPE lulu_%s_t;""" % (name.upper(), name))
+        fout.write("\n")
+
+        if (swarm_objects_header != None):
+            fout.write("""\n//the object ids are shared by all of the colonies of the Pswarm
+#include "%s"
+""" % swarm_objects_header)
+        else:
+            writeObjectsEnum(fout, ir["object_c_names"])
 
         fout.write("\n\nenum agents {")
-        for i, agent_name in enumerate(pcol.B):
-            fout.write("\n    AGENT_%s," % agent_name.upper());
+        for agent in ir["agents"]:
+            fout.write("\n    %s," % agent["c_name"]);
 
         fout.write("\n};")
 
-        if (needsWildcardExpansion):
+        if (ir["has_wildcards"]):
             fout.write("""\n#define NEEDING_WILDCARD_EXPANSION //this ensures that the wildcard expansion code is included""")
+        if (robot_symbolic_id != None):
+            fout.write("""\n#define EXPANDED_FOR_SYMBOLIC_ID %d //this instance was expanded ahead-of-time by lulu_c.py and can only be used by this robot""" % robot_symbolic_id)
 
-        if ("motion" in pcol.B):
-            fout.write("\n#define USING_AGENT_MOTION //this ensures that the code associated with the MOTION agent is included in Lulu_kilobot")
-        if ("led_rgb" in pcol.B):
-            fout.write("\n#define USING_AGENT_LED_RGB //this ensures that the code associated with the LED_RGB agent is included in Lulu_kilobot")
-        if ("msg_distance" in pcol.B):
-            fout.write("\n#define USING_AGENT_MSG_DISTANCE //this ensures that the code associated with the MSG_DISTANCE agent is included in Lulu_kilobot")
-        if ("timer" in pcol.B):
-            fout.write("\n#define USING_AGENT_TIMER //this ensures that the code associated with the TIMER agent is included in Lulu_kilobot")
+        for ag_name in ir["used_agents"]:
+            fout.write("\n#define USING_AGENT_%s //this ensures that the code associated with the %s agent is included in Lulu_kilobot" % (ag_name.upper(), ag_name.upper()))
 
         fout.write("\n")
-        if ("d_all" in pcol.A):
+        if (ir["using_d_all"]):
             fout.write("""\n#define USING_OBJECT_D_ALL //this ensures that the code associated with processing D_ALL objects is included in Lulu_kilobot""")
-        if ("d_next" in pcol.A):
+        if (ir["using_d_next"]):
             fout.write("""\n#define USING_OBJECT_D_NEXT //this ensures that the code associated with processing D_NEXT objects is included in Lulu_kilobot""")
 
-        # check if using {IN,OUT}_EXTEROCEPTIVE rules (<I=> or <=O>)
-        using_in_out_exteroceptive_rules = False
-        for agent in pcol.agents.values():
-            for program in agent.programs:
-                for rule in program:
-                    if (rule.type == sim.RuleType.in_exteroceptive or rule.type == sim.RuleType.out_exteroceptive or
-                            rule.alt_type == sim.RuleType.in_exteroceptive or rule.alt_type == sim.RuleType.out_exteroceptive):
-                        using_in_out_exteroceptive_rules = True
-                        break;
-        if (using_in_out_exteroceptive_rules):
+        # {IN,OUT}_EXTEROCEPTIVE rules (<I=> or <=O>)
+        if (ir["using_in_out_exteroceptive_rules"]):
             fout.write("""\n#define USING_IN_OUT_EXTEROCEPTIVE_RULES //this ensures that the code associated with processing IN_EXTEROCEPTIVE (<I=>) or OUT_EXTEROCEPTIVE (<=O>) rules is included in Lulu_kilobot""")
 
-        fout.write("""\n\n//if building Pcolony simulator for PC
+        if (ir["sorted_multisets"]):
+            fout.write("""\n\n#define USING_SORTED_MULTISETS //the obj multiset of each agent and the environments are initialized sorted by object id""")
+        if (ir["dense_envs"]):
+            fout.write("""\n#define USING_DENSE_ENVS //the environments hold every object of the alphabet, with nr = 0 if the object is not present
+#define LULU_ENV_SLOT(id) ((id) - 1) //index of an object in env.items[] (and in the global environments)""")
+
+        if (use_tables or program_index or profile):
+            writeTableMacros(fout)
+        if (program_index):
+            writeProgramIndexDeclarations(fout, ir)
+        if (packed_rules):
+            writePackedRuleMacros(fout, ir)
+        if (profile):
+            writeProfileDeclarations(fout, ir)
+        if (image):
+            writeImageLoaderDeclarations(fout)
+
+        if (compact_names):
+            fout.write("""\n\n//if building Pcolony simulator for PC
+#ifdef PCOL_SIM
+    #define USING_COMPACT_NAMES //the names of objects and agents are accessed through functions instead of objectNames[] and agentNames[]
+    //returns the name of an object or agent for debug
+    const char* lulu_object_name(lulu_object_id_t id);
+    const char* lulu_agent_name(lulu_agent_id_t id);
+#endif
+""")
+        else:
+            fout.write("""\n\n//if building Pcolony simulator for PC
 #ifdef PCOL_SIM
     //define array of names for objects and agents for debug
     extern char* objectNames[];
     extern char* agentNames[];
 #endif
-
+""")
+        fout.write("""
 /**
  * @brief The smallest kilo_uid from the swarm (is set in instance.c by lulu_c.py)
  */
@@ -137,19 +570,136 @@ void lulu_destroy(Pcolony_t *pcol);
 #endif""")
 # end createInstanceHeader()
 
-def createInstanceSource(pcol, path, nr_robots, smallest_robot_id):
-    """Create an instance of the passed P colony that is written as a source file in C at the given path
+def writeObjectsEnum(fout, object_c_names):
+    """Write the enum that defines the object ids
 
-    :pcol: The pcolony object that was read by lulu_pcol_sim
-    :path: The path to the instance.c that will be written"""
+    :fout: The file object of the header that is being written
+    :object_c_names: List of the C identifiers of the objects, indexed by their id"""
 
-    # prevent alphabet related bugs by including e and f objects in alphabet
-    if ("e" not in pcol.A):
-        pcol.A.append("e")
-    if ("f" not in pcol.A):
-        pcol.A.append("f")
+    fout.write("\nenum objects {")
+    # NO_OBJECT = 0, OBJECT_ID_E = 1, OBJECT_ID_F = 2 are already defined in lulu.h
+    for obj_id in range(3, len(object_c_names)):
+        if (obj_id == 3):
+            fout.write("\n    %s = 3," % object_c_names[obj_id]);
+        else:
+            fout.write("\n    %s," % object_c_names[obj_id]);
+
+    fout.write("\n};")
+# end writeObjectsEnum()
+
+def getNameBlob(strings):
+    """Place NUL terminated strings in a single blob. Identical strings and strings that are the end of another string
+    (such as 'all' and 'd_all') are stored only once
+
+    :strings: The strings that will be placed in the blob
+    :returns: (list of the strings that make up the blob, in order, dictionary string -> offset in the blob) tuple"""
+
+    parts = []
+    offsets = {}
+    size = 0
+    # the longest strings are placed first so that the shorter ones can reuse their ends
+    for string in sorted(set(strings), key=lambda string: (-len(string), string)):
+        if (string in offsets):
+            continue
+        parts.append(string)
+        for i in range(len(string) + 1):
+            offsets.setdefault(string[i:], size + i)
+        size += len(string) + 1
+
+    return (parts, offsets)
+# end getNameBlob()
+
+def splitNamePrefix(name):
+    """Split the name of an object such as B_10 (that results from wildcard expansion) into a prefix that is shared
+    with the other objects of the same wildcard (B_) and a suffix (10)
+
+    :name: The name of the object
+    :returns: (prefix, suffix) tuple, the prefix is empty if the name does not end with _number"""
+
+    prefix, separator, suffix = name.rpartition("_")
+    if (separator == "" or not suffix.isdigit()):
+        return ("", name)
+    return (prefix + separator, suffix)
+# end splitNamePrefix()
+
+def writeCompactNames(fout, ir, share_prefixes = False):
+    """Write the names of objects and agents (used for debugging in PCOL_SIM builds) as a single string blob with offset tables
+    and the lulu_object_name() / lulu_agent_name() accessors, instead of the objectNames[] and agentNames[] arrays of pointers
+
+    :fout: The file object of the instance.c that is being written
+    :ir: The P colony compiled by compilePcolony()
+    :share_prefixes: If True, the names of objects such as B_0, B_1, ... are stored as a shared prefix (B_) and a suffix, that are
+    concatenated by lulu_object_name() in a static buffer"""
+
+    object_names = ir["object_names"]
+    agent_names = [agent["name"] for agent in ir["agents"]]
+    if (share_prefixes):
+        object_parts = [splitNamePrefix(name) for name in object_names]
+        parts, offsets = getNameBlob([part for name_parts in object_parts for part in name_parts] + agent_names)
+    else:
+        parts, offsets = getNameBlob(object_names + agent_names)
+    blob_size = sum(len(part) + 1 for part in parts)
+    offset_type = getSmallestUnsignedType(blob_size)
+
+    fout.write("""\n    //names of objects and agents for debug, concatenated in one blob (see USING_COMPACT_NAMES)
+    static const char lulu_name_blob[] = {""")
+    for part in parts:
+        fout.write("""\n        "%s\\0\"""" % part)
+    fout.write("""\n    };""")
+
+    offset_bytes = 0
+    if (share_prefixes):
+        fout.write("""\n    static const %s lulu_object_name_prefix[] = {%s};""" % (offset_type, ", ".join("%d" % offsets[prefix] for prefix, suffix in object_parts)))
+        fout.write("""\n    static const %s lulu_object_name_suffix[] = {%s};""" % (offset_type, ", ".join("%d" % offsets[suffix] for prefix, suffix in object_parts)))
+        offset_bytes += 2 * len(object_names) * c_type_size[offset_type]
+    else:
+        fout.write("""\n    static const %s lulu_object_name_offset[] = {%s};""" % (offset_type, ", ".join("%d" % offsets[name] for name in object_names)))
+        offset_bytes += len(object_names) * c_type_size[offset_type]
+    fout.write("""\n    static const %s lulu_agent_name_offset[] = {%s};""" % (offset_type, ", ".join("%d" % offsets[name] for name in agent_names)))
+    offset_bytes += len(agent_names) * c_type_size[offset_type]
 
-    with open(path + ".c", "w") as fout:
+    if (share_prefixes):
+        fout.write("""\n
+    const char* lulu_object_name(lulu_object_id_t id) {
+        //the name is rebuilt from its prefix and suffix in a buffer that is overwritten by the next call
+        static char name[%d];
+
+        strcpy(name, &lulu_name_blob[lulu_object_name_prefix[id]]);
+        strcat(name, &lulu_name_blob[lulu_object_name_suffix[id]]);
+        return name;
+    }""" % (max(len(name) for name in object_names) + 1))
+    else:
+        fout.write("""\n
+    const char* lulu_object_name(lulu_object_id_t id) {
+        return &lulu_name_blob[lulu_object_name_offset[id]];
+    }""")
+    fout.write("""\n
+    const char* lulu_agent_name(lulu_agent_id_t id) {
+        return &lulu_name_blob[lulu_agent_name_offset[id]];
+    }""")
+
+    # arrays of pointers to string literals, with 8 byte pointers on PC
+    pointer_bytes = 8 * (len(object_names) + len(agent_names)) + sum(len(name) + 1 for name in object_names + agent_names)
+    logging.info("Compact names: %d bytes (%d bytes of string blob and %d bytes of %s offsets) instead of %d bytes for objectNames[] and agentNames[]" % (
+        blob_size + offset_bytes, blob_size, offset_bytes, offset_type, pointer_bytes))
+# end writeCompactNames()
+
+def createInstanceSource(ir, path, smallest_robot_id, use_tables = False, program_index = False, dedup = False, packed_rules = False,
+        compact_names = False, name_prefixes = False, profile = False, image = False):
+    """Create an instance of the passed P colony that is written as a source file in C at the given path
+
+    :ir: The P colony compiled by compilePcolony()
+    :path: The path to the instance.c that will be written
+    :use_tables: If True, lulu_init() loops over static const tables instead of using one statement per item
+    :program_index: If True, a per-agent program applicability index is written as constant tables
+    :dedup: If True (and use_tables), identical programs are stored only once (see writeInitTables())
+    :packed_rules: If True (and use_tables), the rules are stored bit-packed (see getPackedRuleLayout())
+    :compact_names: If True, the names of objects and agents are written as a string blob (see writeCompactNames())
+    :name_prefixes: If True (and compact_names), the objects share the prefixes of their names
+    :profile: If True, the execution counters of programs and rules are written (see writeProfileCounters())
+    :image: If True, the colony image loader is written (see writeImageLoader())"""
+
+    with openOutputFile(path + ".c") as fout:
         fout.write("""#include "%s.h"
 
 #ifdef NEEDING_WILDCARD_EXPANSION
@@ -158,123 +708,50 @@ def createInstanceSource(pcol, path, nr_robots, smallest_robot_id):
 
 #ifdef PCOL_SIM""" % path.split("/")[-1]) #only filename
 
-        fout.write("""\n    char* objectNames[] = {[NO_OBJECT] = "no_object", """)
-        for obj in pcol.A:
-            fout.write("""[OBJECT_ID_%s] = "%s", """ % (obj.upper(), obj))
+        if (compact_names):
+            if (name_prefixes):
+                fout.write("""\n    #include <string.h>\n""")
+            writeCompactNames(fout, ir, name_prefixes)
+        else:
+            fout.write("""\n    char* objectNames[] = {[NO_OBJECT] = "no_object", """)
+            for obj in ir["alphabet"]:
+                fout.write("""[%s] = "%s", """ % (ir["object_c_names"][ir["object_ids"][obj]], obj))
 
-        fout.write("""};
+            fout.write("""};
     char* agentNames[] = {""")
-        for ag_name in pcol.B:
-            fout.write("""[AGENT_%s] = "%s", """ % (ag_name.upper(), ag_name))
-        fout.write("""};
+            for agent in ir["agents"]:
+                fout.write("""[%s] = "%s", """ % (agent["c_name"], agent["name"]))
+            fout.write("""};""")
+        fout.write("""
 #endif
 
 //the smallest kilo_uid from the swarm
 const uint16_t smallest_robot_uid = %d;
 //the number of robots that make up the swarm
-const uint16_t nr_swarm_robots = %d;
+const uint16_t nr_swarm_robots = %d;""" % (smallest_robot_id, ir["nr_robots"]) )
 
-void lulu_init(Pcolony_t *pcol) {""" % (smallest_robot_id, nr_robots) )
-
-        # call initPcolony()
-        fout.write("""\n    //init Pcolony with alphabet size = %d, nr of agents = %d, capacity = %d
-    initPcolony(pcol, %d, %d, %d);""" % (len(pcol.A), len(pcol.B), pcol.n,  len(pcol.A), len(pcol.B), pcol.n))
-        fout.write("""\n    //Pcolony.alphabet = %s""" % pcol.A)
-
-        # init environment
-        fout.write("""\n\n    //init environment""")
-        counter = 0;
-        for obj, nr in pcol.env.items():
-            #replace %id and * with $id and $ respectively
-
-            fout.write("""\n        pcol->env.items[%d].id = OBJECT_ID_%s;""" % (counter, obj.upper()))
-            fout.write("""\n        pcol->env.items[%d].nr = %d;\n""" % (counter, nr))
-            counter += 1
-        fout.write("""\n    //end init environment""")
-
-        fout.write("""\n\n    //init global pswarm environment""")
-        if (pcol.parentSwarm == None or len(pcol.parentSwarm.global_env) == 0):
-            fout.write("""\n        pcol->pswarm.global_env.items[0].id = OBJECT_ID_E;""")
-            fout.write("""\n        pcol->pswarm.global_env.items[0].nr = 1;""")
+        if (use_tables):
+            table_code = io.StringIO()
+            table_bytes = writeInitTables(table_code, ir, dedup, packed_rules)
+            fout.write(table_code.getvalue())
+            logInitSizeComparison(ir, table_code.getvalue(), table_bytes)
         else:
-            counter = 0
-            for obj, nr in pcol.parentSwarm.global_env.items():
-                #replace %id and * with $id and $ respectively
-
-                fout.write("""\n        pcol->pswarm.global_env.items[%d].id = OBJECT_ID_%s;""" % (counter, obj.upper()))
-                fout.write("""\n        pcol->pswarm.global_env.items[%d].nr = %d;""" % (counter, nr))
-                counter += 1
-        fout.write("""\n    //end init global pswarm environment""")
+            writeInitStatements(fout, ir)
 
-        fout.write("""\n\n    //init INPUT global pswarm environment""")
-        if (pcol.parentSwarm == None or len(pcol.parentSwarm.in_global_env) == 0):
-            fout.write("""\n        pcol->pswarm.in_global_env.items[0].id = OBJECT_ID_E;""")
-            fout.write("""\n        pcol->pswarm.in_global_env.items[0].nr = 1;""")
-        else:
-            counter = 0
-            for obj, nr in pcol.parentSwarm.in_global_env.items():
-                #replace %id and * with $id and $ respectively
+        if (program_index):
+            writeProgramIndex(fout, ir)
 
-                fout.write("""\n        pcol->pswarm.in_global_env.items[%d].id = OBJECT_ID_%s;""" % (counter, obj.upper()))
-                fout.write("""\n        pcol->pswarm.in_global_env.items[%d].nr = %d;""" % (counter, nr))
-                counter += 1
-        fout.write("""\n    //end init INPUT global pswarm environment""")
+        if (profile):
+            writeProfileCounters(fout, ir)
 
-        fout.write("""\n\n    //init OUTPUT global pswarm environment""")
-        if (pcol.parentSwarm == None or len(pcol.parentSwarm.out_global_env) == 0):
-            fout.write("""\n        pcol->pswarm.out_global_env.items[0].id = OBJECT_ID_E;""")
-            fout.write("""\n        pcol->pswarm.out_global_env.items[0].nr = 1;""")
-        else:
-            counter = 0
-            for obj, nr in pcol.parentSwarm.out_global_env.items():
-                #replace %id and * with $id and $ respectively
+        if (image):
+            writeImageLoader(fout, ir)
 
-                fout.write("""\n        pcol->pswarm.out_global_env.items[%d].id = OBJECT_ID_%s;""" % (counter, obj.upper()))
-                fout.write("""\n        pcol->pswarm.out_global_env.items[%d].nr = %d;""" % (counter, nr))
-                counter += 1
-        fout.write("""\n    //end init OUTPUT global pswarm environment""")
-
-        for ag_name in pcol.B:
-            fout.write("""\n\n    //init agent %s""" % ag_name)
-            #fout.write("""\n\n    initAgent(&pcol->agents[AGENT_%s], pcol, %d);""" % (ag_name.upper(), len(pcol.agents[ag_name].programs)))
-            fout.write("""\n\n    initAgent(&pcol->agents[AGENT_%s], pcol, %d);""" % (ag_name.upper(), getNrOfProgramsAfterExpansion(pcol.agents[ag_name], nr_robots- 1)))
-
-            fout.write("""\n        //init obj multiset""")
-            counter = 0;
-            for obj, nr in pcol.agents[ag_name].obj.items():
-                #replace %id and * with $id and $ respectively
-
-                for i in range(nr):
-                    fout.write("""\n        pcol->agents[AGENT_%s].obj.items[%d] = OBJECT_ID_%s;""" % (ag_name.upper(), counter, obj.upper()))
-                    counter += 1
-
-            fout.write("""\n\n        //init programs""")
-            for prg_nr, prg in enumerate(pcol.agents[ag_name].programs):
-                fout.write("""\n\n            initProgram(&pcol->agents[AGENT_%s].programs[%d], %d);""" % (ag_name.upper(), prg_nr, getNrOfRulesWithoutRepetitions(prg)))
-                fout.write("""\n            //init program %d: < %s >""" % (prg_nr, prg.print()))
-
-                rule_index = 0
-                for rule_nr, rule in enumerate(prg):
-                    # skip rules that contain identical operands and thus have no effect
-                    if (rule.lhs == rule.rhs and rule.lhs == 'e' and rule.main_type != sim.RuleType.conditional):
-                        continue
-
-                    fout.write("""\n                //init rule %d: %s""" % (rule_nr, rule.print(toString=True)) )
-                    if (rule.main_type != sim.RuleType.conditional):
-                        fout.write("""\n                initRule(&pcol->agents[AGENT_%s].programs[%d].rules[%d], RULE_TYPE_%s, OBJECT_ID_%s, OBJECT_ID_%s, NO_OBJECT, NO_OBJECT);""" % (ag_name.upper(), prg_nr, rule_index, rule.type.name.upper(), rule.lhs.upper(), rule.rhs.upper()))
-                    else:
-                        fout.write("""\n                initRule(&pcol->agents[AGENT_%s].programs[%d].rules[%d], RULE_TYPE_CONDITIONAL_%s_%s, OBJECT_ID_%s, OBJECT_ID_%s, OBJECT_ID_%s, OBJECT_ID_%s);""" % (ag_name.upper(), prg_nr, rule_index, rule.type.name.upper(), rule.alt_type.name.upper(), rule.lhs.upper(), rule.rhs.upper(), rule.alt_lhs.upper(), rule.alt_rhs.upper()))
-
-                    #increase rule_index
-                    rule_index += 1
-                fout.write("""\n            //end init program %d
-            pcol->agents[AGENT_%s].init_program_nr++;""" % (prg_nr, ag_name.upper()))
-            fout.write("""\n        //end init programs""")
-
-            fout.write("""\n    //end init agent %s""" % ag_name)
-
-        fout.write("""\n}""")
-        fout.write("""\n\nvoid lulu_destroy(Pcolony_t *pcol) {
+        fout.write("""\n\nvoid lulu_destroy(Pcolony_t *pcol) {""")
+        if (use_tables and dedup and not ir["has_wildcards"]):
+            fout.write("""\n    //the rules of identical programs are shared
+    release_shared_programs(pcol);""")
+        fout.write("""
     //destroys all of the subcomponents
     destroyPcolony(pcol);
 }""")
@@ -286,36 +763,19 @@ uint16_t expand_pcolony(Pcolony_t *pcol, uint16_t my_id) {
     Agent_t *agent;
 """)
 
-        fout.write("""\n    uint8_t obj_with_id[] = {""")
-        obj_with_id_size = 0
-        for obj in pcol.A:
-            if ("_W_ID" in obj):
-                fout.write("OBJECT_ID_%s, " % obj.upper())
-                obj_with_id_size += 1
+        fout.write("""\n    lulu_object_id_t obj_with_id[] = {""")
+        for obj_id in ir["obj_with_id"]:
+            fout.write("%s, " % ir["object_c_names"][obj_id])
         fout.write("""};
-    uint8_t obj_with_id_size = %d;""" % (obj_with_id_size))
-
-        fout.write("""\n    uint8_t obj_with_any[] = {""")
-        obj_with_any_size = 0
-        is_obj_with_any_followed_by_id = []
-        for i, obj in enumerate(pcol.A):
-            if (obj.endswith("_W_ALL")):
-                fout.write("OBJECT_ID_%s, " % obj.upper())
-                # if we are at least 2 objects before the end of the list
-                if (i < len(pcol.A) - 1):
-                    # check if this _$ wildcarded object is followed by a _$id object
-                    if ("_W_ID" in pcol.A[i+1]):
-                        is_obj_with_any_followed_by_id.append(1)
-                    else:
-                        is_obj_with_any_followed_by_id.append(0)
-                else:
-                    # this (_$) object is the last one in the list
-                    is_obj_with_any_followed_by_id.append(0)
-                obj_with_any_size += 1
+    %s obj_with_id_size = %d;""" % (getSmallestUnsignedType(len(ir["obj_with_id"])), len(ir["obj_with_id"])))
+
+        fout.write("""\n    lulu_object_id_t obj_with_any[] = {""")
+        for obj_id in ir["obj_with_any"]:
+            fout.write("%s, " % ir["object_c_names"][obj_id])
         fout.write("""};
-    uint8_t obj_with_any_size = %d;
-    uint8_t is_obj_with_any_followed_by_id[] = {%s};""" % (obj_with_any_size,
-        str(is_obj_with_any_followed_by_id).replace("[", "").replace("]", "")))
+    %s obj_with_any_size = %d;
+    uint8_t is_obj_with_any_followed_by_id[] = {%s};""" % (getSmallestUnsignedType(len(ir["obj_with_any"])), len(ir["obj_with_any"]),
+        ", ".join("%d" % val for val in ir["is_obj_with_any_followed_by_id"])))
 
         fout.write("""\n\n    uint16_t my_symbolic_id = my_id - smallest_robot_uid;
 
@@ -330,64 +790,1863 @@ uint16_t expand_pcolony(Pcolony_t *pcol, uint16_t my_id) {
     return my_symbolic_id;
 }
 #endif""")
+# end createInstanceSource()
 
-# end createInstanceHeader()
+def writeInitStatements(fout, ir):
+    """Write the lulu_init() function that initializes every multiset item and rule through a separate C statement
+
+    :fout: The file object of the instance.c that is being written
+    :ir: The P colony compiled by compilePcolony()"""
+
+    c_names = ir["object_c_names"]
+
+    fout.write("""\n\nvoid lulu_init(Pcolony_t *pcol) {""")
+    fout.write("""\n    //init Pcolony with alphabet size = %d, nr of agents = %d, capacity = %d
+    initPcolony(pcol, %d, %d, %d);""" % (len(ir["alphabet"]), len(ir["agents"]), ir["n"],  len(ir["alphabet"]), len(ir["agents"]), ir["n"]))
+    fout.write("""\n    //Pcolony.alphabet = %s""" % ir["alphabet"])
+
+    # init environment
+    fout.write("""\n\n    //init environment""")
+    for counter, (obj_id, nr) in enumerate(ir["env"]):
+        fout.write("""\n        pcol->env.items[%d].id = %s;""" % (counter, c_names[obj_id]))
+        fout.write("""\n        pcol->env.items[%d].nr = %d;\n""" % (counter, nr))
+    fout.write("""\n    //end init environment""")
+
+    for env_name, items in ir["global_envs"]:
+        fout.write("""\n\n    //init %s""" % global_env_labels[env_name])
+        for counter, (obj_id, nr) in enumerate(items):
+            fout.write("""\n        pcol->pswarm.%s.items[%d].id = %s;""" % (env_name, counter, c_names[obj_id]))
+            fout.write("""\n        pcol->pswarm.%s.items[%d].nr = %d;""" % (env_name, counter, nr))
+        fout.write("""\n    //end init %s""" % global_env_labels[env_name])
+
+    for agent in ir["agents"]:
+        fout.write("""\n\n    //init agent %s""" % agent["name"])
+        fout.write("""\n\n    initAgent(&pcol->agents[%s], pcol, %d);""" % (agent["c_name"], agent["nr_programs"]))
+
+        fout.write("""\n        //init obj multiset""")
+        counter = 0;
+        for obj_id, nr in agent["obj"]:
+            for i in range(nr):
+                fout.write("""\n        pcol->agents[%s].obj.items[%d] = %s;""" % (agent["c_name"], counter, c_names[obj_id]))
+                counter += 1
+
+        fout.write("""\n\n        //init programs""")
+        for prg_nr, prg in enumerate(agent["programs"]):
+            fout.write("""\n\n            initProgram(&pcol->agents[%s].programs[%d], %d);""" % (agent["c_name"], prg_nr, len(prg["rules"])))
+            fout.write("""\n            //init program %d: < %s >""" % (prg_nr, prg["text"]))
+
+            for rule_index, rule in enumerate(prg["rules"]):
+                fout.write("""\n                //init rule %d: %s""" % (rule["nr"], rule["text"]) )
+                fout.write("""\n                initRule(&pcol->agents[%s].programs[%d].rules[%d], %s);""" % (agent["c_name"], prg_nr, rule_index,
+                    ", ".join(getRuleTableRow(ir, rule))))
+
+            fout.write("""\n            //end init program %d
+            pcol->agents[%s].init_program_nr++;""" % (prg_nr, agent["c_name"]))
+        fout.write("""\n        //end init programs""")
+
+        fout.write("""\n    //end init agent %s""" % agent["name"])
+
+    fout.write("""\n}""")
+# end writeInitStatements()
+
+def isNoOpRule(rule):
+    """Checks whether a rule consists of operand repetitions such as e->e and thus has no effect
+    Note: conditional rules are never considered no-op because it is assumed that they were introduce to check a condition
+
+    :rule: The rule that will be checked
+    :returns: True if the rule can be skipped"""
+
+    return (rule.lhs == rule.rhs and rule.lhs == 'e' and rule.main_type != sim.RuleType.conditional)
+# end isNoOpRule()
+
+def getSmallestUnsignedType(max_value):
+    """Returns the smallest C unsigned integer type that can hold max_value
+
+    :max_value: The largest value that will be stored
+    :returns: One of 'uint8_t', 'uint16_t', 'uint32_t'"""
+
+    if (max_value <= 0xFF):
+        return "uint8_t"
+    if (max_value <= 0xFFFF):
+        return "uint16_t"
+    return "uint32_t"
+# end getSmallestUnsignedType()
+
+# size in bytes and PROGMEM read macro of the C types used in generated tables
+c_type_size = {"uint8_t": 1, "uint16_t": 2, "uint32_t": 4}
+c_type_table_read = {"uint8_t": "LULU_TABLE_READ_U8", "uint16_t": "LULU_TABLE_READ_U16", "uint32_t": "LULU_TABLE_READ_U32"}
+
+def getGlobalEnvItems(pcol, env_name):
+    """Returns the (object, multiplicity) pairs of one of the environments of the parent Pswarm
+
+    :pcol: The pcolony object that was read by lulu_pcol_sim
+    :env_name: One of 'global_env', 'in_global_env', 'out_global_env'
+    :returns: List of (object, multiplicity) pairs, [('e', 1)] if the colony is not part of a swarm or the environment is empty"""
+
+    if (pcol.parentSwarm == None or len(getattr(pcol.parentSwarm, env_name)) == 0):
+        return [('e', 1)]
+    return list(getattr(pcol.parentSwarm, env_name).items())
+# end getGlobalEnvItems()
+
+def getRuleTableRow(ir, rule):
+    """Returns the (type, lhs, rhs, alt_lhs, alt_rhs) quadruple of a rule as C identifiers, as expected by initRule()
+
+    :ir: The P colony compiled by compilePcolony()
+    :rule: The rule (from the IR) that will be converted
+    :returns: List of 5 C identifiers"""
+
+    return [rule["type"]] + [ir["object_c_names"][obj_id] for obj_id in rule["operands"]]
+# end getRuleTableRow()
+
+def writeConstTable(fout, name, c_type, values, comment, row_comments = None, public = False):
+    """Write a static const array that is placed in flash (PROGMEM) on AVR targets
+
+    :fout: The file object of the instance.c that is being written
+    :name: The name of the C array
+    :c_type: The C type of each element
+    :values: List of values (or C identifiers) that make up the array
+    :comment: Comment that is written above the array
+    :row_comments: If given, values is a list of rows and each row is written on a separate line, followed by its comment
+    :public: If True, the table is not static and can be used by the Lulu runtime through an extern declaration
+    :returns: The size of the table in bytes"""
+
+    if (row_comments != None):
+        rows = values
+        values = [val for row in rows for val in row]
+
+    storage = "" if public else "static "
+    fout.write("""\n//%s""" % comment)
+    if (len(values) == 0):
+        # C does not allow empty initializers so we add an unused element
+        fout.write("""\n%sconst %s %s[] LULU_TABLE = {0}; //empty""" % (storage, c_type, name))
+        return c_type_size[c_type]
+
+    if (row_comments == None):
+        fout.write("""\n%sconst %s %s[] LULU_TABLE = {%s};""" % (storage, c_type, name, ", ".join("%s" % val for val in values)))
+    else:
+        fout.write("""\n%sconst %s %s[] LULU_TABLE = {""" % (storage, c_type, name))
+        for row, row_comment in zip(rows, row_comments):
+            fout.write("""\n    %s, //%s""" % (", ".join("%s" % val for val in row), row_comment))
+        fout.write("""\n};""")
+
+    return len(values) * c_type_size[c_type]
+# end writeConstTable()
+
+def writeTableMacros(fout):
+    """Write the macros used for placing constant tables in flash (PROGMEM) on AVR targets and for reading from them
+
+    :fout: The file object of the instance.h that is being written"""
+
+    fout.write("""\n
+//constant tables are placed in flash on AVR targets (Kilobot)
+#ifndef LULU_TABLE
+    #ifdef __AVR__
+        #include <avr/pgmspace.h>
+        #define LULU_TABLE PROGMEM
+        #define LULU_TABLE_READ_U8(addr) pgm_read_byte(addr)
+        #define LULU_TABLE_READ_U16(addr) pgm_read_word(addr)
+        #define LULU_TABLE_READ_U32(addr) pgm_read_dword(addr)
+    #else
+        #define LULU_TABLE
+        #define LULU_TABLE_READ_U8(addr) (*(addr))
+        #define LULU_TABLE_READ_U16(addr) (*(addr))
+        #define LULU_TABLE_READ_U32(addr) (*(addr))
+    #endif
+#endif""")
+# end writeTableMacros()
+
+def getProgramIndex(ir):
+    """Compute the program applicability index of each agent.
+    For each agent, up to 32 key objects are selected from the objects consumed from the agent by its programs
+    (lhs of non conditional rules) and each program receives a mask of the key objects that it requires.
+    A program can only be applicable if all of the key objects from its mask are present in the agent
+
+    :ir: The P colony compiled by compilePcolony()
+    :returns: List of (key object ids, program masks) tuples, one for each agent"""
+
+    index = []
+    for agent in ir["agents"]:
+        required = []
+        for prg in agent["programs"]:
+            required.append(set(rule["operands"][0] for rule in prg["rules"] if not rule["conditional"]))
+
+        # prefer the objects that are required by most programs, because they filter out the most programs
+        counts = collections.Counter(obj for prg_required in required for obj in prg_required)
+        key_objects = sorted(counts, key=lambda obj: (-counts[obj], ir["object_names"][obj]))[:32]
+
+        masks = []
+        for prg_required in required:
+            masks.append(sum(1 << bit for bit, obj in enumerate(key_objects) if obj in prg_required))
+        index.append((key_objects, masks))
+
+    return index
+# end getProgramIndex()
+
+def writeProgramIndex(fout, ir):
+    """Write the program applicability index tables computed by getProgramIndex()
+
+    :fout: The file object of the instance.c that is being written
+    :ir: The P colony compiled by compilePcolony()"""
+
+    index = getProgramIndex(ir)
+    obj_type = getSmallestUnsignedType(ir["max_object_id"])
+    mask_type = getSmallestUnsignedType(max([mask for key_objects, masks in index for mask in masks] + [0]))
+
+    key_objects = []
+    key_offset = [0]
+    masks = []
+    program_offset = [0]
+    mask_comments = []
+    for agent, (agent_key_objects, agent_masks) in zip(ir["agents"], index):
+        key_objects.extend([ir["object_c_names"][obj_id] for obj_id in agent_key_objects])
+        key_offset.append(len(key_objects))
+        for prg, mask in zip(agent["programs"], agent_masks):
+            masks.append(["0x%X" % mask])
+            mask_comments.append("agent %s: < %s >" % (agent["name"], prg["text"]))
+        program_offset.append(len(masks))
+
+    offset_type = getSmallestUnsignedType(max(len(key_objects), len(masks)))
+
+    fout.write("""\n\n//program applicability index (see USING_PROGRAM_INDEX in the header)""")
+    writeConstTable(fout, "program_index_key_objects", obj_type, key_objects, "key objects of each agent", public = True)
+    writeConstTable(fout, "program_index_key_offset", offset_type, key_offset, "start of the key objects of each agent in program_index_key_objects[]", public = True)
+    writeConstTable(fout, "program_index_required_mask", mask_type, masks, "key objects required by each program", mask_comments, public = True)
+    writeConstTable(fout, "program_index_program_offset", offset_type, program_offset, "start of the programs of each agent in program_index_required_mask[]", public = True)
+# end writeProgramIndex()
+
+def writeProgramIndexDeclarations(fout, ir):
+    """Write the declarations of the program applicability index tables in the instance header
+
+    :fout: The file object of the instance.h that is being written
+    :ir: The P colony compiled by compilePcolony()"""
+
+    index = getProgramIndex(ir)
+    mask_type = getSmallestUnsignedType(max([mask for key_objects, masks in index for mask in masks] + [0]))
+    offset_type = getSmallestUnsignedType(max(sum(len(key_objects) for key_objects, masks in index), sum(len(masks) for key_objects, masks in index)))
+
+    fout.write("""\n
+#define USING_PROGRAM_INDEX //this ensures that the program applicability index is used by Lulu_kilobot
+/**
+ * The program applicability index allows skipping programs that can not be applicable without checking their rules
+ * For agent ag, bit k of an agent mask is set if program_index_key_objects[program_index_key_offset[ag] + k] is present in the agent
+ * Program prg of agent ag can only be applicable if LULU_PROGRAM_MAY_BE_APPLICABLE(ag, prg, agent_mask) is true
+ * Tables are read with the LULU_TABLE_READ_* macros
+ */
+typedef %s lulu_program_mask_t;
+extern const lulu_object_id_t program_index_key_objects[];
+extern const %s program_index_key_offset[];
+extern const lulu_program_mask_t program_index_required_mask[];
+extern const %s program_index_program_offset[];
+#define LULU_PROGRAM_MAY_BE_APPLICABLE(ag, prg, agent_mask) \\
+    ((%s(&program_index_required_mask[%s(&program_index_program_offset[ag]) + (prg)]) & ~(agent_mask)) == 0)""" % (
+        mask_type, offset_type, offset_type, c_type_table_read[mask_type], c_type_table_read[offset_type]))
+# end writeProgramIndexDeclarations()
+
+def getProfileLayout(ir):
+    """Compute the layout of the execution counters of --profile: the programs of all agents are numbered consecutively
+    and so are the rules of all programs
+
+    :ir: The P colony compiled by compilePcolony()
+    :returns: (start of the programs of each agent, start of the rules of each program, layout hash) tuple.
+    Both lists have an extra element at the end, that is the total number of program / rule counters"""
+
+    program_offset = [0]
+    rule_offset = [0]
+    for agent in ir["agents"]:
+        for prg in agent["programs"]:
+            rule_offset.append(rule_offset[-1] + len(prg["rules"]))
+        program_offset.append(program_offset[-1] + len(agent["programs"]))
+
+    # the hash identifies the layout (not the text of the rules) so that the dumps of --expand-ids instances can be merged
+    layout = [(agent["name"], [len(prg["rules"]) for prg in agent["programs"]]) for agent in ir["agents"]]
+    layout_hash = hashlib.sha256(json.dumps(layout).encode()).hexdigest()[:8]
+
+    return (program_offset, rule_offset, layout_hash)
+# end getProfileLayout()
+
+def writeProfileDeclarations(fout, ir):
+    """Write the declarations and macros of the execution counters in the instance header
+
+    :fout: The file object of the instance.h that is being written
+    :ir: The P colony compiled by compilePcolony()"""
+
+    program_offset, rule_offset, layout_hash = getProfileLayout(ir)
+    offset_type = getSmallestUnsignedType(max(program_offset[-1], rule_offset[-1]))
+
+    fout.write("""\n
+/**
+ * Execution counters of programs and rules, compiled in only if LULU_PROFILE is defined
+ * The Lulu runtime calls LULU_PROFILE_PROGRAM() for each executed program and LULU_PROFILE_RULE() for each executed rule
+ * lulu_profile_dump() prints the non zero counters as LULU_PROFILE lines that are merged by lulu_profile.py
+ * using the OUTPUT_FILE_NAME.profile.json sidecar file written by lulu_c.py
+ */
+#ifdef LULU_PROFILE
+    #define LULU_PROFILE_LAYOUT "%s" //identifies the layout of the counters in the sidecar file
+    #define LULU_PROFILE_NR_PROGRAMS %d
+    #define LULU_PROFILE_NR_RULES %d
+    extern uint32_t lulu_profile_program_counter[];
+    extern uint32_t lulu_profile_rule_counter[];
+    extern const %s lulu_profile_program_offset[];
+    extern const %s lulu_profile_rule_offset[];
+    #define LULU_PROFILE_PROGRAM_COUNTER(ag, prg) (%s(&lulu_profile_program_offset[ag]) + (prg))
+    #define LULU_PROFILE_PROGRAM(ag, prg) (lulu_profile_program_counter[LULU_PROFILE_PROGRAM_COUNTER(ag, prg)]++)
+    #define LULU_PROFILE_RULE(ag, prg, rule) (lulu_profile_rule_counter[%s(&lulu_profile_rule_offset[LULU_PROFILE_PROGRAM_COUNTER(ag, prg)]) + (rule)]++)
+
+    /**
+     * @brief Prints the non zero execution counters
+     *
+     * @param robot_uid The kilo_uid of the robot, used to tell apart the dumps of different robots
+     */
+    void lulu_profile_dump(uint16_t robot_uid);
+
+    /**
+     * @brief Sets all of the execution counters to 0
+     */
+    void lulu_profile_reset(void);
+#else
+    #define LULU_PROFILE_PROGRAM(ag, prg)
+    #define LULU_PROFILE_RULE(ag, prg, rule)
+#endif""" % (layout_hash, program_offset[-1], rule_offset[-1], offset_type, offset_type,
+        c_type_table_read[offset_type], c_type_table_read[offset_type]))
+# end writeProfileDeclarations()
+
+def writeProfileCounters(fout, ir):
+    """Write the execution counters, their offset tables and the lulu_profile_dump() / lulu_profile_reset() functions
+
+    :fout: The file object of the instance.c that is being written
+    :ir: The P colony compiled by compilePcolony()"""
+
+    program_offset, rule_offset, layout_hash = getProfileLayout(ir)
+    offset_type = getSmallestUnsignedType(max(program_offset[-1], rule_offset[-1]))
+
+    fout.write("""\n\n#ifdef LULU_PROFILE
+#include <stdio.h>
+#include <string.h>
+
+//execution counters (see LULU_PROFILE in the header), C does not allow empty arrays so there is at least one element
+uint32_t lulu_profile_program_counter[%d];
+uint32_t lulu_profile_rule_counter[%d];""" % (max(program_offset[-1], 1), max(rule_offset[-1], 1)))
+    writeConstTable(fout, "lulu_profile_program_offset", offset_type, program_offset[:-1], "start of the program counters of each agent", public = True)
+    writeConstTable(fout, "lulu_profile_rule_offset", offset_type, rule_offset[:-1], "start of the rule counters of each program", public = True)
+
+    fout.write("""\n
+void lulu_profile_dump(uint16_t robot_uid) {
+    //the number of counters can exceed 65535 with --expand-ids on large swarms
+    uint32_t i;
+
+    for (i = 0; i < LULU_PROFILE_NR_PROGRAMS; i++)
+        if (lulu_profile_program_counter[i] > 0)
+            printf("LULU_PROFILE %u " LULU_PROFILE_LAYOUT " P %lu %lu\\n", robot_uid, (unsigned long) i, (unsigned long) lulu_profile_program_counter[i]);
+    for (i = 0; i < LULU_PROFILE_NR_RULES; i++)
+        if (lulu_profile_rule_counter[i] > 0)
+            printf("LULU_PROFILE %u " LULU_PROFILE_LAYOUT " R %lu %lu\\n", robot_uid, (unsigned long) i, (unsigned long) lulu_profile_rule_counter[i]);
+}
+
+void lulu_profile_reset(void) {
+    memset(lulu_profile_program_counter, 0, sizeof(lulu_profile_program_counter));
+    memset(lulu_profile_rule_counter, 0, sizeof(lulu_profile_rule_counter));
+}
+#endif""")
+
+    logging.info("Profiling (LULU_PROFILE) uses %d bytes of RAM for %d program and %d rule counters" % (
+        4 * (program_offset[-1] + rule_offset[-1]), program_offset[-1], rule_offset[-1]))
+# end writeProfileCounters()
+
+def getSourcePrograms(pcol, nr_robots):
+    """Map the programs of the instances expanded by expandPcolonyForRobot() to the programs of the P colony that they were expanded from.
+    The mapping is the same for all of the robots because each program with _W_ALL objects is replaced by nr_robots - 1 programs
+
+    :pcol: The pcolony object (with wildcarded marks already replaced) before the expansion
+    :nr_robots: The number of robots that make up the swarm
+    :returns: Dictionary agent name -> list of (program number, program) of the P colony, for each program of the expanded agent"""
+
+    source_programs = {}
+    for ag_name, agent in pcol.agents.items():
+        source_programs[ag_name] = []
+        for prg_nr, prg in enumerate(agent.programs):
+            has_wild_any = any("_W_ALL" in obj for rule in prg for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs))
+            source_programs[ag_name].extend([(prg_nr, prg)] * (max(nr_robots - 1, 0) if (has_wild_any) else 1))
+
+    return source_programs
+# end getSourcePrograms()
+
+def writeProfileMapping(ir, path, originalFilename, robot_symbolic_id = None, source_programs = None):
+    """Write the sidecar file that maps each execution counter of --profile to the agent, program and rule (as Lulu text)
+    that it counts. The file is read by lulu_profile.py
+
+    :ir: The P colony compiled by compilePcolony()
+    :path: The path of the JSON file that will be written
+    :originalFilename: The name of the Lulu input file
+    :robot_symbolic_id: The symbolic id of the robot of an --expand-ids instance or None
+    :source_programs: For an --expand-ids instance, the programs of the P colony that its programs were expanded from (see getSourcePrograms()).
+    The counters are mapped to these programs, so the sidecar file of any robot can be used for the dumps of all of the robots"""
+
+    program_offset, rule_offset, layout_hash = getProfileLayout(ir)
+    mapping = {"generator_version": generator_version, "input": originalFilename, "robot_symbolic_id": robot_symbolic_id,
+            "layout": layout_hash, "nr_programs": program_offset[-1], "nr_rules": rule_offset[-1], "programs": []}
+
+    for agent, agent_offset in zip(ir["agents"], program_offset):
+        for prg_nr, prg in enumerate(agent["programs"]):
+            counter = agent_offset + prg_nr
+            if (source_programs != None):
+                source_nr, source_prg = source_programs[agent["name"]][prg_nr]
+                mapping["programs"].append({"counter": counter, "agent": agent["name"], "program": source_nr, "text": source_prg.print(),
+                    "rules": [{"counter": rule_offset[counter] + rule_index, "rule": rule["nr"], "text": source_prg[rule["nr"]].print(toString=True)}
+                        for rule_index, rule in enumerate(prg["rules"])]})
+            else:
+                mapping["programs"].append({"counter": counter, "agent": agent["name"], "program": prg_nr, "text": prg["text"],
+                    "rules": [{"counter": rule_offset[counter] + rule_index, "rule": rule["nr"], "text": rule["text"]}
+                        for rule_index, rule in enumerate(prg["rules"])]})
+
+    with openOutputFile(path) as fout:
+        json.dump(mapping, fout, indent=4)
+# end writeProfileMapping()
+
+# version of the binary colony image written by getColonyImage(), checked by lulu_init_from_image()
+image_version = 1
+
+# rule types that can be stored in a colony image, the image stores the index of the rule type in this list
+image_rule_types = ["RULE_TYPE_%s" % name for name in ("EVOLUTION", "COMMUNICATION", "EXTEROCEPTIVE", "IN_EXTEROCEPTIVE", "OUT_EXTEROCEPTIVE")]
+image_rule_types += ["RULE_TYPE_CONDITIONAL_%s_%s" % (rule_type[10:], alt_type[10:]) for rule_type in image_rule_types for alt_type in image_rule_types]
+
+def getColonyImage(ir, smallest_robot_id):
+    """Encode the P colony as a binary image that is loaded at runtime by lulu_init_from_image() (see writeImageLoader()).
+    All integers are little-endian and unaligned. The image is made of:
+
+        header: "LULU", u8 version, u8 size of an object id (1 or 2 bytes), u32 size of the image, u16 number of object ids,
+            u16 alphabet size, u16 number of agents, u16 capacity, u16 smallest kilo_uid, u16 number of robots
+        wildcards: u16 number of _W_ID objects, their ids, u16 number of _W_ALL objects, (id, u8 followed by a _W_ID object) for each
+        environments (env, global_env, in_global_env, out_global_env): u16 number of items, (id, u16 multiplicity) for each item
+        agents: u16 number of programs after wildcard expansion, u16 size of the obj multiset, one id for each object copy,
+            u16 number of programs, for each program: u8 number of rules, (u8 index in image_rule_types, lhs, rhs, alt_lhs, alt_rhs) for each rule
+
+    :ir: The P colony compiled by compilePcolony()
+    :smallest_robot_id: The smallest kilo_uid from the swarm
+    :returns: The image as bytes"""
+
+    obj_format = "<B" if (ir["max_object_id"] < 256) else "<H"
+    image = io.BytesIO()
+    write = lambda fmt, *values: image.write(struct.pack(fmt, *values))
+
+    write("<4sBBI", b"LULU", image_version, struct.calcsize(obj_format), 0)
+    write("<HHHHHH", ir["max_object_id"] + 1, len(ir["alphabet"]), len(ir["agents"]), ir["n"], smallest_robot_id, ir["nr_robots"])
+
+    write("<H", len(ir["obj_with_id"]))
+    for obj_id in ir["obj_with_id"]:
+        write(obj_format, obj_id)
+    write("<H", len(ir["obj_with_any"]))
+    for obj_id, followed_by_id in zip(ir["obj_with_any"], ir["is_obj_with_any_followed_by_id"]):
+        write(obj_format, obj_id)
+        write("<B", followed_by_id)
+
+    for items in [ir["env"]] + [items for env_name, items in ir["global_envs"]]:
+        write("<H", len(items))
+        for obj_id, nr in items:
+            write(obj_format, obj_id)
+            write("<H", nr)
+
+    for agent in ir["agents"]:
+        write("<HH", agent["nr_programs"], sum(nr for obj_id, nr in agent["obj"]))
+        for obj_id, nr in agent["obj"]:
+            for i in range(nr):
+                write(obj_format, obj_id)
+        write("<H", len(agent["programs"]))
+        for prg in agent["programs"]:
+            write("<B", len(prg["rules"]))
+            for rule in prg["rules"]:
+                write("<B", image_rule_types.index(rule["type"]))
+                for obj_id in rule["operands"]:
+                    write(obj_format, obj_id)
+
+    # the size of the image is stored in the header
+    image = bytearray(image.getvalue())
+    struct.pack_into("<I", image, 6, len(image))
+    return bytes(image)
+# end getColonyImage()
+
+def checkColonyImageLimits(ir, smallest_robot_id):
+    """Check that the P colony fits in the fields of the colony image (see getColonyImage()), so that the generation
+    stops (with a ValueError) before any file is written
+
+    :ir: The P colony compiled by compilePcolony()
+    :smallest_robot_id: The smallest kilo_uid from the swarm"""
+
+    u8, u16 = 0xFF, 0xFFFF
+    limits = [("number of object ids", ir["max_object_id"] + 1, u16), ("alphabet size", len(ir["alphabet"]), u16),
+        ("number of agents", len(ir["agents"]), u16), ("capacity", ir["n"], u16), ("smallest kilo_uid", smallest_robot_id, u16),
+        ("number of robots", ir["nr_robots"], u16), ("number of _W_ID objects", len(ir["obj_with_id"]), u16),
+        ("number of _W_ALL objects", len(ir["obj_with_any"]), u16)]
+    for env_name, items in [("env", ir["env"])] + ir["global_envs"]:
+        limits.append(("number of %s items" % env_name, len(items), u16))
+        limits.append(("multiplicity of a %s item" % env_name, max([nr for obj_id, nr in items] + [0]), u16))
+    for agent in ir["agents"]:
+        limits.append(("number of programs of agent %s after wildcard expansion" % agent["name"], agent["nr_programs"], u16))
+        limits.append(("size of the obj multiset of agent %s" % agent["name"], sum(nr for obj_id, nr in agent["obj"]), u16))
+        limits.append(("number of rules of a program of agent %s" % agent["name"], max([len(prg["rules"]) for prg in agent["programs"]] + [0]), u8))
+
+    for name, value, limit in limits:
+        if (value > limit):
+            raise ValueError("The P colony can not be stored as a colony image (--image): the %s is %d, the image can store at most %d" % (name, value, limit))
+# end checkColonyImageLimits()
+
+def writeImageLoaderDeclarations(fout):
+    """Write the declarations of the colony image loader in the instance header
+
+    :fout: The file object of the instance.h that is being written"""
+
+    fout.write("""\n
+#define USING_COLONY_IMAGE //lulu_init_from_image() can be used instead of lulu_init()
+/**
+ * A colony image (OUTPUT_FILE_NAME.lulu.bin, written by lulu_c.py --image) contains the multisets, programs and rules of a P colony
+ * so that it can be loaded at runtime instead of being compiled into lulu_init(). The image is read in place and is never copied
+ * Define LULU_IMAGE_READ_U8(addr) before including this header if the image is not in RAM (for example pgm_read_byte() on AVR)
+ */
+#define LULU_IMAGE_VERSION %d
+#define LULU_IMAGE_OK 0
+#define LULU_IMAGE_ERROR_FORMAT 1 //not a colony image, truncated, of a different size or that does not fit in the allocated multisets
+#define LULU_IMAGE_ERROR_VERSION 2 //written by a different version of lulu_c.py
+#define LULU_IMAGE_ERROR_OBJECT_ID 3 //the object ids do not fit in lulu_object_id_t or are not the object ids of this instance
+#define LULU_IMAGE_ERROR_RULE_TYPE 4 //uses rule types that were not used by the P colony of this instance
+
+/**
+ * @brief Initialises the pcol object and all of it's components from a colony image
+ * The image is checked before pcol is initialized so pcol is left untouched if an error is returned
+ *
+ * @param pcol The P colony that will be initialized
+ * @param image The colony image
+ * @param size The size of the image in bytes
+ * @return LULU_IMAGE_OK or one of the LULU_IMAGE_ERROR_* codes
+ */
+int8_t lulu_init_from_image(Pcolony_t *pcol, const uint8_t *image, uint32_t size);
+
+#ifdef NEEDING_WILDCARD_EXPANSION
+    /**
+     * @brief Same as expand_pcolony() but using the wildcarded objects and swarm parameters from the colony image
+     *
+     * @param pcol The pcolony that was initialized by lulu_init_from_image() from the same image
+     * @param image The colony image
+     * @param my_id The kilo_uid of the robot
+     * @return The symbolic id that corresponds to this robot
+     */
+    uint16_t expand_pcolony_from_image(Pcolony_t *pcol, const uint8_t *image, uint16_t my_id);
+#endif""" % image_version)
+# end writeImageLoaderDeclarations()
+
+def writeImageLoader(fout, ir):
+    """Write the lulu_init_from_image() and expand_pcolony_from_image() functions that read a colony image written by getColonyImage()
+
+    :fout: The file object of the instance.c that is being written
+    :ir: The P colony compiled by compilePcolony()"""
+
+    # the runtime of this instance only supports the rule types used by its P colony
+    used_rule_types = sorted(set(rule["type"] for agent in ir["agents"] for prg in agent["programs"] for rule in prg["rules"]), key=image_rule_types.index)
+    supported_mask = sum(1 << image_rule_types.index(rule_type) for rule_type in used_rule_types)
+
+    fout.write("""\n\n//colony image loader (see USING_COLONY_IMAGE in the header)
+#ifndef LULU_IMAGE_READ_U8
+    #define LULU_IMAGE_READ_U8(addr) (*(addr))
+#endif
+#define LULU_IMAGE_HEADER_SIZE 22
+
+//rule type of each rule type index used in the image and mask of the rule type indexes that are supported by this instance
+static const uint8_t image_rule_types[] = {%s};
+static const uint32_t image_supported_rule_types = 0x%X;
+
+//read position in a colony image
+typedef struct {
+    const uint8_t *pos;
+    const uint8_t *end;
+    uint8_t error;
+} image_reader_t;
+
+//reads a little-endian unsigned integer of size bytes and advances the read position
+static uint32_t image_read(image_reader_t *reader, uint8_t size) {
+    uint32_t value = 0;
+    uint8_t i;
+
+    if (reader->end - reader->pos < size) {
+        reader->error = LULU_IMAGE_ERROR_FORMAT;
+        return 0;
+    }
+    for (i = 0; i < size; i++)
+        value |= (uint32_t) LULU_IMAGE_READ_U8(reader->pos + i) << (8 * i);
+    reader->pos += size;
+    return value;
+}
+
+//walks through the image and, if pcol is not NULL, initializes the P colony
+static int8_t image_load(Pcolony_t *pcol, const uint8_t *image, uint32_t size) {
+    image_reader_t reader = {image, image + size, LULU_IMAGE_OK};
+    Multiset_env_t *envs[4];
+    uint8_t obj_size, nr_rules, rule_type, env;
+    uint16_t i, ag, prg, rule, nr, nr_objects, alphabet_size, nr_agents, capacity, nr_programs, value;
+    lulu_object_id_t operands[4];
+
+    if (size < LULU_IMAGE_HEADER_SIZE || image_read(&reader, 4) != 0x554C554CUL) //LULU
+        return LULU_IMAGE_ERROR_FORMAT;
+    if (image_read(&reader, 1) != LULU_IMAGE_VERSION)
+        return LULU_IMAGE_ERROR_VERSION;
+    obj_size = image_read(&reader, 1);
+    if (obj_size > sizeof(lulu_object_id_t))
+        return LULU_IMAGE_ERROR_OBJECT_ID;
+    if (image_read(&reader, 4) != size)
+        return LULU_IMAGE_ERROR_FORMAT;
+
+    //the object ids and the agents are used by the firmware so they must be the same as in this instance
+    nr_objects = image_read(&reader, 2);
+    if (nr_objects != LULU_NR_OBJECTS)
+        return LULU_IMAGE_ERROR_OBJECT_ID;
+    alphabet_size = image_read(&reader, 2);
+    nr_agents = image_read(&reader, 2);
+    capacity = image_read(&reader, 2);
+    if (alphabet_size >= nr_objects || nr_agents != LULU_NR_AGENTS)
+        return LULU_IMAGE_ERROR_FORMAT;
+    if (pcol != NULL)
+        initPcolony(pcol, alphabet_size, nr_agents, capacity);
+    image_read(&reader, 4); //swarm parameters, used by expand_pcolony_from_image()
+
+    //wildcarded objects, used by expand_pcolony_from_image()
+    nr = image_read(&reader, 2);
+    for (i = 0; i < nr && reader.error == LULU_IMAGE_OK; i++)
+        if (image_read(&reader, obj_size) >= nr_objects)
+            return LULU_IMAGE_ERROR_OBJECT_ID;
+    nr = image_read(&reader, 2);
+    for (i = 0; i < nr && reader.error == LULU_IMAGE_OK; i++) {
+        if (image_read(&reader, obj_size) >= nr_objects)
+            return LULU_IMAGE_ERROR_OBJECT_ID;
+        image_read(&reader, 1);
+    }
+
+    if (pcol != NULL) {
+        envs[0] = &pcol->env;
+        envs[1] = &pcol->pswarm.global_env;
+        envs[2] = &pcol->pswarm.in_global_env;
+        envs[3] = &pcol->pswarm.out_global_env;
+    }
+    for (env = 0; env < 4; env++) {
+        //the environments are allocated for the whole alphabet
+        nr = image_read(&reader, 2);
+        if (nr > alphabet_size)
+            return LULU_IMAGE_ERROR_FORMAT;
+        for (i = 0; i < nr && reader.error == LULU_IMAGE_OK; i++) {
+            operands[0] = image_read(&reader, obj_size);
+            if (operands[0] >= nr_objects)
+                return LULU_IMAGE_ERROR_OBJECT_ID;
+            value = image_read(&reader, 2);
+            if (pcol != NULL) {
+                envs[env]->items[i].id = operands[0];
+                envs[env]->items[i].nr = value;
+            }
+        }
+    }
+
+    for (ag = 0; ag < nr_agents && reader.error == LULU_IMAGE_OK; ag++) {
+        nr_programs = image_read(&reader, 2);
+        if (pcol != NULL)
+            initAgent(&pcol->agents[ag], pcol, nr_programs);
+
+        //init obj multiset, that is allocated for capacity objects
+        nr = image_read(&reader, 2);
+        if (nr > capacity)
+            return LULU_IMAGE_ERROR_FORMAT;
+        for (i = 0; i < nr && reader.error == LULU_IMAGE_OK; i++) {
+            operands[0] = image_read(&reader, obj_size);
+            if (operands[0] >= nr_objects)
+                return LULU_IMAGE_ERROR_OBJECT_ID;
+            if (pcol != NULL)
+                pcol->agents[ag].obj.items[i] = operands[0];
+        }
+
+        //init programs, at most the number of programs allocated for the agent (after wildcard expansion)
+        nr = image_read(&reader, 2);
+        if (nr > nr_programs)
+            return LULU_IMAGE_ERROR_FORMAT;
+        nr_programs = nr;
+        for (prg = 0; prg < nr_programs && reader.error == LULU_IMAGE_OK; prg++) {
+            nr_rules = image_read(&reader, 1);
+            if (pcol != NULL)
+                initProgram(&pcol->agents[ag].programs[prg], nr_rules);
+            for (rule = 0; rule < nr_rules && reader.error == LULU_IMAGE_OK; rule++) {
+                rule_type = image_read(&reader, 1);
+                if (rule_type >= 32 || !(image_supported_rule_types & ((uint32_t) 1 << rule_type)))
+                    return LULU_IMAGE_ERROR_RULE_TYPE;
+                for (i = 0; i < 4; i++) {
+                    operands[i] = image_read(&reader, obj_size);
+                    if (operands[i] >= nr_objects)
+                        return LULU_IMAGE_ERROR_OBJECT_ID;
+                }
+                if (pcol != NULL)
+                    initRule(&pcol->agents[ag].programs[prg].rules[rule], image_rule_types[rule_type],
+                            operands[0], operands[1], operands[2], operands[3]);
+            }
+            if (pcol != NULL)
+                pcol->agents[ag].init_program_nr++;
+        }
+    }
+
+    if (reader.error == LULU_IMAGE_OK && reader.pos != reader.end)
+        return LULU_IMAGE_ERROR_FORMAT;
+    return reader.error;
+}
+
+int8_t lulu_init_from_image(Pcolony_t *pcol, const uint8_t *image, uint32_t size) {
+    int8_t result;
+
+    //the image is checked before allocating the P colony
+    result = image_load(NULL, image, size);
+    if (result != LULU_IMAGE_OK)
+        return result;
+    return image_load(pcol, image, size);
+}""" % (", ".join("[%d] = %s" % (image_rule_types.index(rule_type), rule_type) for rule_type in used_rule_types) if len(used_rule_types) > 0 else "0",
+        supported_mask))
+
+    fout.write("""\n
+#ifdef NEEDING_WILDCARD_EXPANSION
+uint16_t expand_pcolony_from_image(Pcolony_t *pcol, const uint8_t *image, uint16_t my_id) {
+    //the image was checked by lulu_init_from_image()
+    image_reader_t reader = {image + 5, image + LULU_IMAGE_HEADER_SIZE, LULU_IMAGE_OK};
+    uint8_t obj_size;
+    uint32_t size;
+    uint16_t i, nr, smallest_uid, nr_robots, my_symbolic_id;
+    lulu_object_id_t *obj_with_id, *obj_with_any;
+    uint8_t *is_obj_with_any_followed_by_id;
+
+    obj_size = image_read(&reader, 1);
+    size = image_read(&reader, 4);
+    reader.pos += 8;
+    smallest_uid = image_read(&reader, 2);
+    nr_robots = image_read(&reader, 2);
+    my_symbolic_id = my_id - smallest_uid;
+    reader.end = image + size;
+
+    //the wildcard lists are small and are only needed while expanding
+    nr = image_read(&reader, 2);
+    obj_with_id = malloc(nr * sizeof(lulu_object_id_t) + 1);
+    for (i = 0; i < nr; i++)
+        obj_with_id[i] = image_read(&reader, obj_size);
+    replacePcolonyWildID(pcol, obj_with_id, nr, my_symbolic_id);
+    free(obj_with_id);
+
+    nr = image_read(&reader, 2);
+    obj_with_any = malloc(nr * sizeof(lulu_object_id_t) + 1);
+    is_obj_with_any_followed_by_id = malloc(nr + 1);
+    for (i = 0; i < nr; i++) {
+        obj_with_any[i] = image_read(&reader, obj_size);
+        is_obj_with_any_followed_by_id[i] = image_read(&reader, 1);
+    }
+    expandPcolonyWildAny(pcol, obj_with_any, is_obj_with_any_followed_by_id, nr, my_symbolic_id, nr_robots);
+    free(obj_with_any);
+    free(is_obj_with_any_followed_by_id);
+
+    return my_symbolic_id;
+}
+#endif""")
+# end writeImageLoader()
+
+def writeColonyImage(ir, path, smallest_robot_id):
+    """Write the binary colony image of the P colony (see getColonyImage())
+
+    :ir: The P colony compiled by compilePcolony()
+    :path: The path of the image that will be written
+    :smallest_robot_id: The smallest kilo_uid from the swarm"""
+
+    image = getColonyImage(ir, smallest_robot_id)
+    with openOutputFile(path, binary = True) as fout:
+        fout.write(image)
+    logging.info("Colony image %s: %d bytes" % (path, len(image)))
+# end writeColonyImage()
+
+def hasWildcardObjects(pcol):
+    """Checks whether the alphabet of the P colony contains wildcarded objects that are expanded by expand_pcolony() at runtime
+
+    :pcol: The pcolony object that was read by lulu_pcol_sim
+    :returns: True if there is at least one _W_ID or _W_ALL object"""
+
+    for obj in pcol.A:
+        if ("_W_ALL" in obj or "_W_ID" in obj):
+            return True
+    return False
+# end hasWildcardObjects()
+
+def getPackedRuleLayout(ir):
+    """Compute the bit-packed encoding of the rules of the P colony.
+    Each rule is stored as (type index, lhs, rhs, alt_lhs, alt_rhs) fields of the smallest number of bits,
+    packed in 32 bit words so that no field crosses a word boundary. The type index refers to the list of rule types used by the colony
+
+    :ir: The P colony compiled by compilePcolony()
+    :returns: Dictionary with 'rule_types' (list of C identifiers), 'words' (number of 32 bit words per rule)
+    and 'fields' (list of (name, word, shift, bits) tuples)"""
+
+    rule_types = sorted(set(rule["type"] for agent in ir["agents"] for prg in agent["programs"] for rule in prg["rules"]))
+    type_bits = max(len(rule_types) - 1, 1).bit_length()
+    # with --swarm-remap the packed rules hold colony local object ids
+    obj_bits = (len(ir["local_objects"]) - 1 if (ir["local_objects"] != None) else ir["max_object_id"]).bit_length()
+
+    fields = []
+    word = 0
+    shift = 0
+    for name, bits in [("type", type_bits), ("lhs", obj_bits), ("rhs", obj_bits), ("alt_lhs", obj_bits), ("alt_rhs", obj_bits)]:
+        if (shift + bits > 32):
+            word += 1
+            shift = 0
+        fields.append((name, word, shift, bits))
+        shift += bits
+
+    return {"rule_types": rule_types, "words": word + 1, "fields": fields}
+# end getPackedRuleLayout()
+
+def writePackedRuleMacros(fout, ir):
+    """Write the macros that decode the bit-packed rules computed by getPackedRuleLayout()
+
+    :fout: The file object of the instance.h that is being written
+    :ir: The P colony compiled by compilePcolony()"""
+
+    layout = getPackedRuleLayout(ir)
+    fout.write("""\n
+#define USING_PACKED_RULES //rules are stored as LULU_PACKED_RULE_WORDS 32 bit words in the (flash) instance tables, lulu_init() decodes them into Rule_t
+#define LULU_PACKED_RULE_WORDS %d""" % layout["words"])
+    fout.write("""\n//decode a field of a packed rule, words points to the LULU_PACKED_RULE_WORDS words of the rule
+//LULU_PACKED_RULE_TYPE() is an index in packed_rule_types[]""")
+    for name, word, shift, bits in layout["fields"]:
+        fout.write("""\n#define LULU_PACKED_RULE_%s(words) (((words)[%d] >> %d) & 0x%XUL)""" % (name.upper(), word, shift, (1 << bits) - 1))
+    fout.write("""\nextern const uint8_t packed_rule_types[];""")
+# end writePackedRuleMacros()
+
+def getPackedRule(row, layout):
+    """Pack one row of the rule table according to the layout computed by getPackedRuleLayout()
+
+    :row: The (type, lhs, rhs, alt_lhs, alt_rhs) C identifiers of the rule
+    :layout: The packed rule layout
+    :returns: List of C constant expressions, one for each 32 bit word"""
+
+    values = [layout["rule_types"].index(row[0])] + row[1:]
+    words = [[] for i in range(layout["words"])]
+    for value, (name, word, shift, bits) in zip(values, layout["fields"]):
+        if (value == 0 or value == "NO_OBJECT"):
+            continue
+        words[word].append("((uint32_t)%s << %d)" % (value, shift) if shift > 0 else "(uint32_t)%s" % value)
+
+    return [" | ".join(word) if len(word) > 0 else "0" for word in words]
+# end getPackedRule()
+
+def writeInitTables(fout, ir, dedup = False, packed_rules = False):
+    """Write the contents of the P colony as static const tables and a lulu_init() function that loops over them
+
+    :fout: The file object of the instance.c that is being written
+    :ir: The P colony compiled by compilePcolony()
+    :dedup: If True, identical programs are stored only once in the rule table and, if the programs are not expanded at runtime,
+    they also share their rules in RAM. The programs that share the rules of another program are released by release_shared_programs()
+    :packed_rules: If True, the rules are bit-packed according to getPackedRuleLayout()
+    :returns: The size in bytes of all of the tables that were written"""
+
+    share_ram = dedup and not ir["has_wildcards"]
+    c_names = ir["object_c_names"]
+    remap = ir["local_objects"] != None
+    if (remap):
+        # the tables store colony local object ids that are translated to swarm object ids through swarm_object_remap[]
+        local_ids = dict((obj_id, local_id) for local_id, obj_id in enumerate(ir["local_objects"]))
+        table_object = lambda obj_id: local_ids[obj_id]
+        obj_type = getSmallestUnsignedType(len(ir["local_objects"]) - 1)
+        swarm_obj_type = getSmallestUnsignedType(ir["max_object_id"])
+        remapObject = lambda local_id: "%s(&swarm_object_remap[%s])" % (c_type_table_read[swarm_obj_type], local_id)
+    else:
+        table_object = lambda obj_id: c_names[obj_id]
+        obj_type = getSmallestUnsignedType(ir["max_object_id"])
+        remapObject = lambda obj_id: obj_id
+
+    envs = [("env", "pcol->env", ir["env"])]
+    for env_name, items in ir["global_envs"]:
+        envs.append((env_name, "pcol->pswarm.%s" % env_name, items))
+
+    agent_obj = []
+    agent_obj_offset = [0]
+    agent_nr_programs = []
+    agent_program_offset = [0]
+    # unique program index of each program of each agent (only used if dedup)
+    agent_program_table = []
+    # the first (agent, program) that uses each unique program
+    program_owner = []
+    unique_programs = {}
+    program_rule_offset = [0]
+    rule_table = []
+    rule_table_comments = []
+    nr_rules = 0
+    for ag_nr, agent in enumerate(ir["agents"]):
+        for obj_id, nr in agent["obj"]:
+            agent_obj.extend([table_object(obj_id)] * nr)
+        agent_obj_offset.append(len(agent_obj))
+        agent_nr_programs.append(agent["nr_programs"])
+        for prg_nr, prg in enumerate(agent["programs"]):
+            nr_rules += len(prg["rules"])
+            if (dedup and prg["key"] in unique_programs):
+                agent_program_table.append(unique_programs[prg["key"]])
+                continue
+
+            unique_programs[prg["key"]] = len(program_owner)
+            agent_program_table.append(len(program_owner))
+            program_owner.append((ag_nr, prg_nr))
+            for rule in prg["rules"]:
+                rule_table.append([rule["type"]] + [table_object(obj_id) for obj_id in rule["operands"]])
+                rule_table_comments.append("agent %s, program %d: %s" % (agent["name"], prg_nr, rule["text"]))
+            program_rule_offset.append(len(rule_table))
+        agent_program_offset.append(len(agent_program_table))
+
+    index_type = getSmallestUnsignedType(max([len(ir["agents"]), len(agent_obj), len(rule_table), len(agent_program_table) + 1] + [len(items) for _, _, items in envs]))
+    read_obj = c_type_table_read[obj_type]
+    read_index = c_type_table_read[index_type]
+    readObject = lambda table_item: remapObject("%s(&%s)" % (read_obj, table_item))
+
+    table_bytes = 0
+    if (remap):
+        table_bytes += writeConstTable(fout, "swarm_object_remap", swarm_obj_type, [c_names[obj_id] for obj_id in ir["local_objects"]],
+                "swarm object id of each colony local object id")
+        logging.info("Swarm object remap: the tables use %d colony local object ids (%s) instead of %d swarm object ids (%s)" % (
+            len(ir["local_objects"]), obj_type, ir["max_object_id"] + 1, swarm_obj_type))
+    for env_name, _, items in envs:
+        # the objects of dense environments are given by their position
+        if (not ir["dense_envs"]):
+            table_bytes += writeConstTable(fout, "%s_obj_table" % env_name, obj_type,
+                    [table_object(obj_id) for obj_id, nr in items], "%s objects" % env_name)
+        table_bytes += writeConstTable(fout, "%s_nr_table" % env_name, getSmallestUnsignedType(max([nr for obj, nr in items] + [0])),
+                [nr for obj, nr in items], "%s multiplicity of each object" % env_name)
+
+    table_bytes += writeConstTable(fout, "agent_obj_table", obj_type, agent_obj, "obj multiset of all agents, one element for each copy of an object")
+    table_bytes += writeConstTable(fout, "agent_obj_offset", index_type, agent_obj_offset, "start of the obj multiset of each agent in agent_obj_table[]")
+    table_bytes += writeConstTable(fout, "agent_nr_programs", getSmallestUnsignedType(max(agent_nr_programs + [0])), agent_nr_programs,
+            "number of programs of each agent (after wildcard expansion)")
+    if (dedup):
+        table_bytes += writeConstTable(fout, "agent_program_offset", index_type, agent_program_offset, "start of the programs of each agent in agent_program_table[]")
+        table_bytes += writeConstTable(fout, "agent_program_table", index_type, agent_program_table, "unique program used by each program of each agent")
+        if (share_ram):
+            table_bytes += writeConstTable(fout, "program_owner_agent", index_type, [ag_nr for ag_nr, prg_nr in program_owner],
+                    "agent that initializes the rules of each unique program")
+            table_bytes += writeConstTable(fout, "program_owner_program", index_type, [prg_nr for ag_nr, prg_nr in program_owner],
+                    "program (of the owner agent) that initializes the rules of each unique program")
+    else:
+        table_bytes += writeConstTable(fout, "agent_program_offset", index_type, agent_program_offset, "start of the programs of each agent in program_rule_offset[]")
+    table_bytes += writeConstTable(fout, "program_rule_offset", index_type, program_rule_offset, "start of the rules of each program in rule_table[]")
+    if (packed_rules):
+        layout = getPackedRuleLayout(ir)
+        table_bytes += writeConstTable(fout, "packed_rule_types", "uint8_t", layout["rule_types"], "rule types used by the packed rules", public = True)
+        table_bytes += writeConstTable(fout, "rule_table", "uint32_t", [getPackedRule(row, layout) for row in rule_table],
+                "(type, lhs, rhs, alt_lhs, alt_rhs) of each rule, packed in LULU_PACKED_RULE_WORDS words", rule_table_comments)
+        logging.info("Packed rules: %d bits per rule type and %d bits per object id, %d bytes per rule instead of %d (%d bytes instead of %d for all rules) in flash. "
+            "The RAM used by the rules does not change, lulu_init() decodes each rule into a Rule_t" % (
+            layout["fields"][0][3], layout["fields"][1][3], 4 * layout["words"], 5 * c_type_size[obj_type],
+            4 * layout["words"] * len(rule_table), 5 * c_type_size[obj_type] * len(rule_table)))
+    else:
+        table_bytes += writeConstTable(fout, "rule_table", obj_type, rule_table, "(type, lhs, rhs, alt_lhs, alt_rhs) of each rule", rule_table_comments)
+
+    fout.write("""\n\nvoid lulu_init(Pcolony_t *pcol) {
+    %s i, ag, prg, rule, first, unique;""" % index_type)
+    if (packed_rules):
+        fout.write("""\n    uint8_t word;
+    uint32_t words[LULU_PACKED_RULE_WORDS];""")
+    fout.write("""\n\n    //init Pcolony with alphabet size = %d, nr of agents = %d, capacity = %d
+    initPcolony(pcol, %d, %d, %d);""" % (len(ir["alphabet"]), len(ir["agents"]), ir["n"],  len(ir["alphabet"]), len(ir["agents"]), ir["n"]))
+    fout.write("""\n    //Pcolony.alphabet = %s""" % ir["alphabet"])
+
+    for env_name, c_name, items in envs:
+        fout.write("""\n\n    //init %s
+    for (i = 0; i < %d; i++) {
+        %s.items[i].id = %s;
+        %s.items[i].nr = %s(&%s_nr_table[i]);
+    }""" % (env_name, len(items), c_name, "i + 1" if (ir["dense_envs"]) else readObject("%s_obj_table[i]" % env_name),
+            c_name, c_type_table_read[getSmallestUnsignedType(max([nr for obj, nr in items] + [0]))], env_name))
+
+    fout.write("""\n\n    //init agents
+    for (ag = 0; ag < %d; ag++) {
+        initAgent(&pcol->agents[ag], pcol, %s(&agent_nr_programs[ag]));
+
+        //init obj multiset
+        first = %s(&agent_obj_offset[ag]);
+        for (i = first; i < %s(&agent_obj_offset[ag + 1]); i++)
+            pcol->agents[ag].obj.items[i - first] = %s;
+
+        //init programs
+        first = %s(&agent_program_offset[ag]);
+        for (prg = first; prg < %s(&agent_program_offset[ag + 1]); prg++) {""" % (
+        len(ir["agents"]), c_type_table_read[getSmallestUnsignedType(max(agent_nr_programs + [0]))],
+        read_index, read_index, readObject("agent_obj_table[i]"),
+        read_index, read_index))
+
+    if (dedup):
+        fout.write("""\n            unique = %s(&agent_program_table[prg]);""" % read_index)
+    else:
+        fout.write("""\n            unique = prg;""")
+
+    if (share_ram):
+        fout.write("""\n            //this program shares the rules of a previously initialized identical program
+            if (%s(&program_owner_agent[unique]) != ag || %s(&program_owner_program[unique]) != prg - first) {
+                pcol->agents[ag].programs[prg - first] = pcol->agents[%s(&program_owner_agent[unique])].programs[%s(&program_owner_program[unique])];
+                pcol->agents[ag].init_program_nr++;
+                continue;
+            }""" % (read_index, read_index, read_index, read_index))
+
+    fout.write("""\n            initProgram(&pcol->agents[ag].programs[prg - first], %s(&program_rule_offset[unique + 1]) - %s(&program_rule_offset[unique]));
+            for (rule = %s(&program_rule_offset[unique]); rule < %s(&program_rule_offset[unique + 1]); rule++) {
+                i = rule - %s(&program_rule_offset[unique]);""" % (read_index, read_index,
+        read_index, read_index,
+        read_index))
+
+    if (packed_rules):
+        fout.write("""
+                for (word = 0; word < LULU_PACKED_RULE_WORDS; word++)
+                    words[word] = LULU_TABLE_READ_U32(&rule_table[rule * LULU_PACKED_RULE_WORDS + word]);
+                initRule(&pcol->agents[ag].programs[prg - first].rules[i], LULU_TABLE_READ_U8(&packed_rule_types[LULU_PACKED_RULE_TYPE(words)]),
+                        %s, %s, %s, %s);""" % (remapObject("LULU_PACKED_RULE_LHS(words)"), remapObject("LULU_PACKED_RULE_RHS(words)"),
+                            remapObject("LULU_PACKED_RULE_ALT_LHS(words)"), remapObject("LULU_PACKED_RULE_ALT_RHS(words)")))
+    else:
+        fout.write("""
+                initRule(&pcol->agents[ag].programs[prg - first].rules[i], %s(&rule_table[rule * 5]), %s,
+                        %s, %s, %s);""" % (
+            read_obj, readObject("rule_table[rule * 5 + 1]"),
+            readObject("rule_table[rule * 5 + 2]"), readObject("rule_table[rule * 5 + 3]"), readObject("rule_table[rule * 5 + 4]")))
+
+    fout.write("""
+            }
+            pcol->agents[ag].init_program_nr++;
+        }
+    }
+}""")
+
+    if (share_ram):
+        fout.write("""\n
+/**
+ * @brief Detaches the programs that share the rules of another program, so that the rules are only freed once by destroyPcolony()
+ *
+ * @param pcol The P colony that will be destroyed
+ */
+static void release_shared_programs(Pcolony_t *pcol) {
+    %s ag, prg, first, unique;
+
+    for (ag = 0; ag < %d; ag++) {
+        first = %s(&agent_program_offset[ag]);
+        for (prg = first; prg < %s(&agent_program_offset[ag + 1]); prg++) {
+            unique = %s(&agent_program_table[prg]);
+            if (%s(&program_owner_agent[unique]) != ag || %s(&program_owner_program[unique]) != prg - first)
+                pcol->agents[ag].programs[prg - first].rules = NULL;
+        }
+    }
+}""" % (index_type, len(ir["agents"]), read_index, read_index, read_index, read_index, read_index))
+
+    if (dedup):
+        nr_shared_rules = nr_rules - len(rule_table)
+        # the rules in RAM hold lulu_object_id_t ids, that are wider than the table ids with --swarm-remap
+        rule_bytes = 1 + 4 * c_type_size[getSmallestUnsignedType(ir["max_object_id"])]
+        # bytes of each row of rule_table[]
+        rule_flash = 4 * layout["words"] if (packed_rules) else 5 * c_type_size[obj_type]
+        logging.info("Deduplication: %d programs use %d unique programs, %d bytes of rule table saved in flash" % (
+            len(agent_program_table), len(program_owner), nr_shared_rules * rule_flash))
+        if (share_ram):
+            logging.info("Deduplication: %d rules are shared between identical programs, saving %d bytes of RAM" % (nr_shared_rules, nr_shared_rules * rule_bytes))
+        else:
+            logging.info("Deduplication: programs do not share rules in RAM because they are changed at runtime by expand_pcolony()")
+
+    return table_bytes
+# end writeInitTables()
+
+def logInitSizeComparison(ir, table_code, table_bytes):
+    """Log the size of the table-driven lulu_init() compared to the statement-per-item lulu_init()
+
+    :ir: The P colony compiled by compilePcolony()
+    :table_code: The C code written by writeInitTables()
+    :table_bytes: The size in bytes of the tables written by writeInitTables()"""
+
+    statement_code = io.StringIO()
+    writeInitStatements(statement_code, ir)
+    statement_code = statement_code.getvalue()
+
+    logging.info("lulu_init() statement-per-item: %d lines, %d bytes of C source, %d init statements" % (
+        statement_code.count("\n"), len(statement_code), statement_code.count(";")))
+    logging.info("lulu_init() table-driven: %d lines, %d bytes of C source, %d bytes of const table data" % (
+        table_code.count("\n"), len(table_code), table_bytes))
+# end logInitSizeComparison()
+
+# model of the Lulu C runtime used by estimateMemoryUsage(), in bytes, for the Kilobot (AVR): 2 byte pointers, a 2 byte header
+# for each block allocated with malloc() and the approximate code size of the statements and loops of lulu_init()
+memory_model = {"pointer": 2, "size_field": 1, "malloc_header": 2, "init_statement": 10, "init_call": 14, "init_loops": 300}
+
+def estimateMemoryUsage(ir, use_tables = False, dedup = False, packed_rules = False):
+    """Estimate the RAM allocated by initPcolony(), initAgent() and initProgram() (and by expand_pcolony() at runtime) for this P colony
+    and the flash used by lulu_init() and its tables. The Lulu runtime itself is not included.
+    The estimate is based on memory_model: the environments are allocated for the whole alphabet, the obj multiset of each agent
+    for pcol.n objects and each rule holds its type and 4 object ids
+
+    :ir: The P colony compiled by compilePcolony()
+    :use_tables: If True, lulu_init() uses constant tables (see writeInitTables())
+    :dedup: If True (and use_tables), identical programs are stored only once
+    :packed_rules: If True (and use_tables), the rules are stored bit-packed
+    :returns: Dictionary component -> [RAM bytes, flash bytes], the components are the colony, its environments and its agents"""
+
+    model = memory_model
+    id_types = getIdTypes(ir)
+    # the runtime structures use lulu_object_id_t (the swarm object ids with --swarm-objects), even if the tables store local object ids
+    obj_size = c_type_size[id_types["object_id"][0]]
+    rule_size = 1 + 4 * obj_size
+    program_size = model["pointer"] + c_type_size[id_types["rule_nr"][0]]
+    agent_size = (model["pointer"] + model["size_field"]) + model["pointer"] + 2 * c_type_size[id_types["program_nr"][0]] + model["pointer"]
+    env_size = model["pointer"] + model["size_field"]
+    alloc = lambda size: size + model["malloc_header"] if (size > 0) else 0
+
+    # flash used by one item (multiset object or rule) of lulu_init()
+    if (use_tables):
+        table_obj_size = obj_size
+        if (ir["local_objects"] != None):
+            table_obj_size = c_type_size[getSmallestUnsignedType(len(ir["local_objects"]) - 1)]
+        env_item_flash = 1 if (ir["dense_envs"]) else table_obj_size + 1
+        obj_item_flash = table_obj_size
+        rule_flash = 4 * getPackedRuleLayout(ir)["words"] if (packed_rules) else 5 * table_obj_size
+        # offsets of the program in the program tables
+        program_flash = 2 * (2 if (dedup) else 1)
+    else:
+        env_item_flash = 2 * model["init_statement"]
+        obj_item_flash = model["init_statement"]
+        rule_flash = model["init_call"]
+        program_flash = model["init_call"] + model["init_statement"]
+
+    usage = collections.OrderedDict()
+    usage["colony"] = [1 + 4 * env_size + model["pointer"] + 2 + alloc(len(ir["agents"]) * agent_size),
+            model["init_call"] + (model["init_loops"] if (use_tables) else 0)]
+    for env_name, items in [("env", ir["env"])] + ir["global_envs"]:
+        usage[env_name] = [alloc(len(ir["alphabet"]) * (obj_size + 1)), len(items) * env_item_flash]
+
+    share_ram = use_tables and dedup and not ir["has_wildcards"]
+    stored_programs = set()
+    for agent in ir["agents"]:
+        ram = alloc(ir["n"] * obj_size) + alloc(agent["nr_programs"] * program_size)
+        flash = model["init_call"] + sum(nr for obj_id, nr in agent["obj"]) * obj_item_flash
+        for prg in agent["programs"]:
+            # programs with * wildcard objects are copied for each of the other robots by expand_pcolony()
+            copies = 1 + max(ir["nr_robots"] - 1, 0) if (prg["has_wild_any"]) else 1
+            stored = prg["key"] in stored_programs
+            stored_programs.add(prg["key"])
+
+            if (not (share_ram and stored)):
+                ram += copies * alloc(len(prg["rules"]) * rule_size)
+            flash += program_flash
+            if (not (use_tables and dedup and stored)):
+                flash += len(prg["rules"]) * rule_flash
+        usage["agent %s" % agent["name"]] = [ram, flash]
+
+    return usage
+# end estimateMemoryUsage()
+
+def checkMemoryBudget(usage, max_ram = None, max_flash = None):
+    """Log the estimated memory usage and stop the generation (with a ValueError) if it exceeds the given budget,
+    showing the components that use the most memory
+
+    :usage: The estimate computed by estimateMemoryUsage()
+    :max_ram: The RAM budget in bytes (None for no limit)
+    :max_flash: The flash budget in bytes (None for no limit)"""
+
+    total_ram = sum(ram for ram, flash in usage.values())
+    total_flash = sum(flash for ram, flash in usage.values())
+    logging.info("Estimated memory usage of the instance (without the Lulu runtime): %d bytes of RAM, %d bytes of flash" % (total_ram, total_flash))
+    for component, (ram, flash) in usage.items():
+        logging.debug("    %s: %d bytes of RAM, %d bytes of flash" % (component, ram, flash))
+
+    exceeded = []
+    for name, resource, total, budget in [("RAM", 0, total_ram, max_ram), ("flash", 1, total_flash, max_flash)]:
+        if (budget == None or total <= budget):
+            continue
+        exceeded.append("%d bytes of %s (budget %d)" % (total, name, budget))
+        logging.error("The instance needs an estimated %d bytes of %s, which exceeds the budget of %d bytes. The biggest consumers are:" % (total, name, budget))
+        for component in sorted(usage, key=lambda component: -usage[component][resource])[:5]:
+            logging.error("    %s: %d bytes (%.1f %%)" % (component, usage[component][resource], 100.0 * usage[component][resource] / max(total, 1)))
+
+    if (len(exceeded) > 0):
+        raise ValueError("The instance exceeds its memory budget: %s" % ", ".join(exceeded))
+# end checkMemoryBudget()
+
+# agents whose multisets are filled by the robot firmware (sensors), so their programs may consume objects
+# that no rule of the P colony produces
+firmware_input_agents = ["msg_distance", "timer"]
+
+def getRuleRequirements(rule):
+    """Returns the objects that must be present for a rule to be applicable, for the main and for the alternative rule
+
+    :rule: The rule that will be checked
+    :returns: (main requirements, alternative requirements) tuple of sets, the second one is None for non conditional rules"""
+
+    def requirements(rule_type, lhs, rhs):
+        # evolution rules only consume the lhs object from the agent, all others also need the rhs object from an environment
+        if (rule_type == sim.RuleType.evolution):
+            return set([lhs]) - set(['e'])
+        return set([lhs, rhs]) - set(['e'])
+
+    if (rule.main_type != sim.RuleType.conditional):
+        return (requirements(rule.type, rule.lhs, rule.rhs), None)
+    return (requirements(rule.type, rule.lhs, rule.rhs), requirements(rule.alt_type, rule.alt_lhs, rule.alt_rhs))
+# end getRuleRequirements()
+
+def isProgramApplicable(prg, available):
+    """Checks whether a program can become applicable if only the available objects can appear in the P colony
+
+    :prg: The program that will be checked
+    :available: Set of objects that can appear in the P colony
+    :returns: True if all rules (or at least one branch of each conditional rule) only need available objects"""
 
-def getNrOfProgramsAfterExpansion(agent, suffixListSize):
-    """Returns the final number of programs that will result after all programs (within this agent)
-    with * wildcard objects have been expanded
-
-    :agent: The agent whose programs will checked
-    :suffixListSize: The number of programs that result after expanding a program such as < X_* -> e, e->X_* >
-    if suffixListSize = 2 then we obtain 2 new programs, < X_0 - > e ... > and < X_1 -> e ...> that replace the original one
-    :returns: The final number of programs that will result after expansion """
-
-    check_for_any_wild = [x.endswith("_W_ALL") for x in agent.colony.A]
-    any_wild_objects = []
-    for i, val in enumerate(check_for_any_wild):
-        if (val):
-            any_wild_objects.append(agent.colony.A[i])
-
-    counter = 0
-
-    logging.info("wild_ANY objects = %s" % any_wild_objects)
-
-    for program in agent.programs:
-        wild_exists_in_program = False
-        for rule in program:
-            for obj in any_wild_objects:
-                if (obj == rule.lhs or obj == rule.rhs or obj == rule.alt_lhs or obj == rule.alt_rhs):
-                    wild_exists_in_program = True
-                    logging.warning("wild_ANY object %s exists in program %s rule %s" % (obj, program.print(), rule.print(toString=True)))
-                    break;
-        # end for rule in program
-        if (wild_exists_in_program):
-                counter += suffixListSize
-
-    return counter + len(agent.programs)
-# end getNrOfProgramsAfterExpansion()
-
-def getNrOfRulesWithoutRepetitions(prg):
-    """Returns the number of rules from this program that do not consist of operand repetitions such as e->e
-    Note: conditional rules are included without checking because it is assumed that they were introduce to check a condition
-    :returns: Number of rules that have lhs different from rhs"""
-
-    nr_rules = len(prg)
     for rule in prg:
-        if (rule.main_type != sim.RuleType.conditional):
-            if (rule.lhs == rule.rhs and rule.lhs == "e"):
-                nr_rules -= 1
+        main, alt = getRuleRequirements(rule)
+        if (not main.issubset(available) and (alt == None or not alt.issubset(available))):
+            return False
+    return True
+# end isProgramApplicable()
+
+def getExpandedObjectPattern(objects):
+    """Returns a regular expression that matches the objects that result from the expansion of the wildcarded objects
+    (B_W_ID and B_W_ALL both match B_0, B_1, ...)
+
+    :objects: The objects (with wildcarded marks already replaced), only the wildcarded ones are used
+    :returns: The compiled regular expression or None if there are no wildcarded objects"""
+
+    wildcard_patterns = [re.escape(obj).replace("W_ID", r"\d+").replace("W_ALL", r"\d+") for obj in objects if ("_W_ALL" in obj or "_W_ID" in obj)]
+    if (len(wildcard_patterns) == 0):
+        return None
+    return re.compile("^(%s)$" % "|".join(wildcard_patterns))
+# end getExpandedObjectPattern()
+
+def optimizePcolony(pcol):
+    """Optimization pass that removes the components of the P colony that have no effect on its execution:
+        * rules that consist of operand repetitions such as e->e
+        * programs that can never become applicable because they need objects that can never appear in the P colony
+        * objects of the alphabet that are not referenced by any rule or multiset
+    This pass is conservative: wildcarded objects (and the objects that result from their expansion, such as B_0 for B_W_ID), objects received from other robots (through the global environments)
+    and objects consumed by the programs of firmware input agents are considered to always be available
+
+    :pcol: The pcolony object (with wildcarded marks already replaced) that will be modified in place
+    :returns: Dictionary with the removed 'rules' (number), 'programs' (list of (agent, program) strings) and 'objects' (list)"""
+
+    removed = {"rules": 0, "programs": [], "objects": []}
+
+    # remove e->e rules
+    for agent in pcol.agents.values():
+        for prg in agent.programs:
+            nr_rules = len(prg)
+            prg[:] = [rule for rule in prg if not isNoOpRule(rule)]
+            removed["rules"] += nr_rules - len(prg)
+
+    # objects that can appear without being produced by a program of this colony
+    available = set(pcol.env) | set(['e'])
+    for agent in pcol.agents.values():
+        available |= set(agent.obj)
+    if (pcol.parentSwarm != None):
+        for env in [pcol.parentSwarm.global_env, pcol.parentSwarm.in_global_env, pcol.parentSwarm.out_global_env]:
+            available |= set(env)
+    for ag_name, agent in pcol.agents.items():
+        for prg in agent.programs:
+            for rule in prg:
+                for rule_type, lhs, rhs in [(rule.type, rule.lhs, rule.rhs), (rule.alt_type, rule.alt_lhs, rule.alt_rhs)]:
+                    # objects received from other robots
+                    if (rule_type == sim.RuleType.in_exteroceptive or (rule_type == sim.RuleType.exteroceptive and pcol.parentSwarm != None)):
+                        available.add(rhs)
+                    if (ag_name in firmware_input_agents):
+                        available.add(lhs)
+                available |= set(obj for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs) if ("_W_ALL" in obj or "_W_ID" in obj))
+
+    # all of the objects that the programs need, so that the expansions of the available wildcarded objects can be marked as available
+    needed = set(obj for agent in pcol.agents.values() for prg in agent.programs for rule in prg
+            for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs) if obj != '')
+    def addExpandedObjects(available):
+        expanded_object = getExpandedObjectPattern(available)
+        if (expanded_object != None):
+            available |= set(obj for obj in needed if expanded_object.match(obj))
+    addExpandedObjects(available)
+
+    # mark the programs that can become applicable and add the objects that they produce until nothing changes
+    applicable = set()
+    changed = True
+    while (changed):
+        changed = False
+        for agent in pcol.agents.values():
+            for prg in agent.programs:
+                if (id(prg) not in applicable and isProgramApplicable(prg, available)):
+                    applicable.add(id(prg))
+                    available |= set(obj for rule in prg for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs) if obj != '')
+                    addExpandedObjects(available)
+                    changed = True
+
+    for ag_name in pcol.B:
+        agent = pcol.agents[ag_name]
+        for prg in agent.programs:
+            if (id(prg) not in applicable):
+                removed["programs"].append((ag_name, prg.print()))
+        agent.programs = [prg for prg in agent.programs if id(prg) in applicable]
+
+    # objects that are still referenced
+    referenced = set(pcol.env) | set(['e', 'f'])
+    if (pcol.parentSwarm != None):
+        for env in [pcol.parentSwarm.global_env, pcol.parentSwarm.in_global_env, pcol.parentSwarm.out_global_env]:
+            referenced |= set(env)
+    for agent in pcol.agents.values():
+        referenced |= set(agent.obj)
+        for prg in agent.programs:
+            referenced |= set(obj for rule in prg for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs))
+
+    # objects such as B_0 are referenced through B_W_ID or B_W_ALL
+    expanded_object = getExpandedObjectPattern(referenced)
+
+    alphabet = []
+    for obj in pcol.A:
+        if (obj in referenced or (expanded_object != None and expanded_object.match(obj))):
+            alphabet.append(obj)
+        else:
+            removed["objects"].append(obj)
+    pcol.A = alphabet
+
+    logging.info("Optimization removed %d no-op rules, %d programs and %d objects" % (removed["rules"], len(removed["programs"]), len(removed["objects"])))
+    for ag_name, prg_text in removed["programs"]:
+        logging.info("    removed program < %s > of agent %s that can never become applicable" % (prg_text, ag_name))
+    if (len(removed["objects"]) > 0):
+        logging.info("    removed unreferenced objects %s" % removed["objects"])
+
+    return removed
+# end optimizePcolony()
+
+def replaceObjectWildcardMarks(obj):
+    """Returns the object with the wildcarded marks * and %id replaced with W_ALL and W_ID respectively
+
+    :obj: The name of the object
+    :returns: The name of the object without wildcarded marks"""
+
+    return obj.replace("%id", "W_ID").replace("*", "W_ALL")
+# end replaceObjectWildcardMarks()
+
+def replaceWildcardMarks(pcol):
+    """Replace the wildcarded marks * and %id with W_ALL and W_ID respectively
+    in the alphabet, all multisets and programs of the P colony
+
+    :pcol: The pcolony object that will be modified in place"""
+
+    for i, val in enumerate(pcol.A):
+        pcol.A[i] = replaceObjectWildcardMarks(val)
+
+    multisets = [pcol.env] + [pcol.agents[ag_name].obj for ag_name in pcol.B]
+    #if this pcolony is part of swarm
+    if (pcol.parentSwarm != None):
+        multisets.append(pcol.parentSwarm.global_env)
+
+    for multiset in multisets:
+        for key in list(multiset):
+            # if key contains wildcards
+            if ("*" in key or "%id" in key):
+                #copy value at wildcarded key at new $ key
+                multiset[replaceObjectWildcardMarks(key)] = multiset[key];
+                #delete the * key
+                del multiset[key]
+
+    for ag_name in pcol.B:
+        for prg_nr, prg in enumerate(pcol.agents[ag_name].programs):
+            for rule_nr, rule in enumerate(prg):
+                rule.lhs = replaceObjectWildcardMarks(rule.lhs)
+                rule.rhs = replaceObjectWildcardMarks(rule.rhs)
+                rule.alt_lhs = replaceObjectWildcardMarks(rule.alt_lhs)
+                rule.alt_rhs = replaceObjectWildcardMarks(rule.alt_rhs)
+# end replaceWildcardMarks()
+
+def generateInstance(pcol, path, originalFilename, nr_robots, min_robot_id, use_tables = False, expand_ids = False, prune = False,
+        program_index = False, dedup = False, packed_rules = False, max_ram = None, max_flash = None, swarm_objects = False, swarm_remap = False,
+        swarm_alphabet = None, swarm_objects_header = None, compact_names = False, name_prefixes = False, profile = False,
+        image = False, sorted_multisets = False, dense_env_limit = 64):
+    """Generate the C instance (header and source) of a P colony that was read by lulu_pcol_sim
+
+    :pcol: The pcolony object that will be modified in place (wildcarded marks are replaced)
+    :path: The path (without extension) of the files that will be written
+    :originalFilename: The name of the Lulu input file
+    :nr_robots: The number of robots that make up the swarm
+    :min_robot_id: The smallest kilo_uid from the swarm
+    :swarm_alphabet: The alphabet shared by the colonies of the Pswarm, computed by generateAllColonies() if swarm_objects
+    :swarm_objects_header: The name of the header written by createSwarmObjectsHeader() if swarm_objects
+    The rest of the parameters correspond to the command line options, see README.md"""
+
+    if (swarm_objects and swarm_alphabet == None):
+        raise ValueError("Shared swarm object ids (swarm_objects) require generating all of the colonies of a Pswarm")
+    if (not swarm_objects):
+        swarm_alphabet = swarm_objects_header = None
+
+    replaceWildcardMarks(pcol)
+
+    if (prune):
+        optimizePcolony(pcol)
+
+    if (program_index and not expand_ids and hasWildcardObjects(pcol)):
+        logging.warning("The program applicability index is not generated because expand_pcolony() changes the programs at runtime. Use --expand-ids to enable it")
+        program_index = False
+
+    # the counters are sized for the programs of the P colony, but expand_pcolony() adds copies of the programs with _W_ALL objects
+    if (profile and not expand_ids and any("_W_ALL" in obj for agent in pcol.agents.values() for prg in agent.programs for rule in prg
+            for obj in (rule.lhs, rule.rhs, rule.alt_lhs, rule.alt_rhs))):
+        logging.warning("The execution counters are not generated because expand_pcolony() adds programs at runtime. Use --expand-ids to enable them")
+        profile = False
+
+    if (sorted_multisets and not expand_ids and hasWildcardObjects(pcol)):
+        logging.warning("The multisets are not sorted because expand_pcolony() changes their objects at runtime. Use --expand-ids to enable it")
+        sorted_multisets = False
+
+    if (expand_ids):
+        expandAlphabet(pcol, nr_robots)
+
+        def compileRobot(robot_id):
+            ir = compilePcolony(expandPcolonyForRobot(pcol, nr_robots, robot_id), nr_robots, swarm_alphabet, swarm_remap)
+            # the wild_ANY objects that were kept in the multisets are not expanded at runtime either
+            ir["has_wildcards"] = False
+            ir["obj_with_id"], ir["obj_with_any"], ir["is_obj_with_any_followed_by_id"] = [], [], []
+            if (sorted_multisets):
+                sortMultisets(ir, dense_env_limit)
+            return ir
+
+        if (profile):
+            source_programs = getSourcePrograms(pcol, nr_robots)
+
+        # the budget (and the limits of the colony image) of every robot are checked before any file is written
+        has_budget = max_ram != None or max_flash != None
+        if (has_budget or image):
+            for robot_id in range(nr_robots):
+                logging.info("Checking the instance for kilo_uid %d" % (min_robot_id + robot_id))
+                ir = compileRobot(robot_id)
+                if (has_budget):
+                    checkMemoryBudget(estimateMemoryUsage(ir, use_tables, dedup, packed_rules), max_ram, max_flash)
+                if (image):
+                    checkColonyImageLimits(ir, min_robot_id)
+
+        for robot_id in range(nr_robots):
+            robot_path = "%s_%d" % (path, robot_id)
+            ir = compileRobot(robot_id)
+            if (not has_budget):
+                checkMemoryBudget(estimateMemoryUsage(ir, use_tables, dedup, packed_rules))
+            logging.info("Generating the instance header (%s) for kilo_uid %d" % (robot_path + ".h", min_robot_id + robot_id))
+            createInstanceHeader(ir, robot_path + ".h", originalFilename, robot_id, use_tables, program_index, packed_rules,
+                    swarm_objects_header, compact_names, profile, image)
+            logging.info("Generating the instance source (%s) for kilo_uid %d" % (robot_path + ".c", min_robot_id + robot_id))
+            createInstanceSource(ir, robot_path, min_robot_id, use_tables, program_index, dedup, packed_rules, compact_names, name_prefixes,
+                    profile, image)
+            if (profile):
+                writeProfileMapping(ir, robot_path + ".profile.json", originalFilename, robot_id, source_programs)
+            if (image):
+                writeColonyImage(ir, robot_path + ".lulu.bin", min_robot_id)
+    else:
+        ir = compilePcolony(pcol, nr_robots, swarm_alphabet, swarm_remap)
+        if (sorted_multisets):
+            sortMultisets(ir, dense_env_limit)
+        checkMemoryBudget(estimateMemoryUsage(ir, use_tables, dedup, packed_rules), max_ram, max_flash)
+        if (image):
+            checkColonyImageLimits(ir, min_robot_id)
+        logging.info("Generating the instance header (%s)" % (path + ".h"))
+        createInstanceHeader(ir, path + ".h", originalFilename, None, use_tables, program_index, packed_rules, swarm_objects_header,
+                compact_names, profile, image)
+        logging.info("Generating the instance source (%s)" % (path + ".c"))
+        createInstanceSource(ir, path, min_robot_id, use_tables, program_index, dedup, packed_rules, compact_names, name_prefixes, profile,
+                image)
+        if (profile):
+            writeProfileMapping(ir, path + ".profile.json", originalFilename)
+        if (image):
+            writeColonyImage(ir, path + ".lulu.bin", min_robot_id)
+# end generateInstance()
+
+# the Pswarm that is shared by the worker processes of generateAllColonies()
+batch_pswarm = None
+
+def initBatchWorker(pswarm):
+    """Initializer of the worker processes of generateAllColonies()
+
+    :pswarm: The Pswarm that was read (only once) by the parent process"""
+
+    global batch_pswarm
+    batch_pswarm = pswarm
+# end initBatchWorker()
+
+def generateBatchColony(colony_name, path, originalFilename, nr_robots, min_robot_id, options, stamp, pswarm = None):
+    """Generate the instance of one colony of batch_pswarm, in a worker process of generateAllColonies()
+
+    :colony_name: The name of the colony from the Pswarm
+    :path: The path (without extension) of the files of this colony
+    :options: Dictionary of generateInstance() options
+    :stamp: The value of generation_stamp from the parent process
+    :pswarm: The Pswarm, if the worker belongs to a pool that is reused for several versions of the input file (see watchInputFile()).
+    If None, batch_pswarm is used
+    :returns: (wall time in seconds spent generating this colony, list of written files) tuple"""
+
+    global generation_stamp
+    generation_stamp = stamp
+    del output_files[:]
+    if (pswarm == None):
+        pswarm = batch_pswarm
+
+    start = time.perf_counter()
+    generateInstance(pswarm.colonies[colony_name], path, originalFilename, nr_robots, min_robot_id, **options)
+    return (time.perf_counter() - start, list(output_files))
+# end generateBatchColony()
+
+def generateAllColonies(pswarm, path, originalFilename, nr_robots, min_robot_id, nr_jobs, options, colony_names = None, executor = None):
+    """Generate the instances of all of the colonies of a Pswarm in parallel, using a pool of processes
+
+    :pswarm: The Pswarm that was read by lulu_pcol_sim
+    :path: The path prefix of the generated files, each colony is written to PATH_colony.{c,h} and the swarm header to PATH_swarm.h
+    :nr_jobs: The number of worker processes, None to use all of the cores
+    :options: Dictionary of generateInstance() options
+    :colony_names: If not None, only the instances of these colonies are generated (the swarm header lists all of the colonies)
+    :executor: If not None, a ProcessPoolExecutor that is reused instead of starting a new pool (nr_jobs is ignored), the Pswarm is then
+    passed with each colony"""
+
+    start = time.perf_counter()
+    colony_paths = collections.OrderedDict((colony_name, "%s_%s" % (path, colony_name)) for colony_name in pswarm.C)
+    if (colony_names == None):
+        colony_names = pswarm.C
+
+    if (options.get("swarm_objects", False)):
+        swarm_alphabet = getSwarmAlphabet(pswarm, nr_robots)
+        logging.info("Generating the swarm objects header (%s)" % (path + "_swarm_objects.h"))
+        createSwarmObjectsHeader(swarm_alphabet, path + "_swarm_objects.h", originalFilename)
+        options = dict(options, swarm_alphabet = swarm_alphabet, swarm_objects_header = path.split("/")[-1] + "_swarm_objects.h")
+
+    def generateColonies(executor, task_pswarm):
+        futures = collections.OrderedDict()
+        for colony_name in colony_names:
+            colony_path = colony_paths[colony_name]
+            futures[colony_name] = executor.submit(generateBatchColony, colony_name, colony_path, originalFilename, nr_robots, min_robot_id, options,
+                    generation_stamp, task_pswarm)
+
+        for colony_name, future in futures.items():
+            duration, colony_output_files = future.result()
+            output_files.extend(colony_output_files)
+            logging.info("Generated colony %s (%s.{c,h}) in %.3f s" % (colony_name, colony_paths[colony_name], duration))
+        return futures
+
+    if (executor != None):
+        futures = generateColonies(executor, pswarm)
+    else:
+        # the parsed swarm is passed to each worker when it starts, instead of once per colony
+        with concurrent.futures.ProcessPoolExecutor(max_workers = nr_jobs, initializer = initBatchWorker, initargs = (pswarm,)) as executor:
+            futures = generateColonies(executor, None)
+
+    logging.info("Generating the swarm header (%s)" % (path + "_swarm.h"))
+    createSwarmHeader(pswarm, path + "_swarm.h", originalFilename, colony_paths)
+
+    logging.info("Generated %d colonies in %.3f s" % (len(futures), time.perf_counter() - start))
+# end generateAllColonies()
+
+def createSwarmHeader(pswarm, path, originalFilename, colony_paths):
+    """Create the header that is shared by the instances of all of the colonies of a Pswarm
+
+    :pswarm: The Pswarm that was read by lulu_pcol_sim
+    :path: The path to the swarm.h that will be written
+    :originalFilename: The name of the Lulu input file
+    :colony_paths: Dictionary colony name -> path (without extension) of the instance of the colony"""
+
+    with openOutputFile(path) as fout:
+        fout.write("""// vim:filetype=c
+/**
+ * @file lulu_swarm.h
+ * @brief Colonies of the Lulu Pswarm defined in '%s'.
+ * Each colony has its own instance (header and source) that can be used as lulu_instance.h
+ * This file was generated automatically by lulu_c.py %s
+ */
+#ifndef LULU_SWARM_H
+#define LULU_SWARM_H
+""" % (originalFilename, getGenerationStamp()))
+
+        fout.write("""\nenum colonies {""")
+        for colony_name, colony_path in colony_paths.items():
+            fout.write("""\n    COLONY_%s, //instance %s.h""" % (colony_name.upper(), colony_path.split("/")[-1]))
+        fout.write("""\n};
+#define LULU_NR_COLONIES %d""" % len(colony_paths))
+
+        fout.write("""\n\n#ifdef PCOL_SIM
+    static char* colonyNames[] = {""")
+        for colony_name in colony_paths:
+            fout.write("""[COLONY_%s] = "%s", """ % (colony_name.upper(), colony_name))
+        fout.write("""};
+#endif
+#endif""")
+# end createSwarmHeader()
+
+def createSwarmObjectsHeader(swarm_alphabet, path, originalFilename):
+    """Create the header that defines the object ids shared by all of the colonies of a Pswarm (see --swarm-objects)
+
+    :swarm_alphabet: The alphabet shared by the colonies, computed by getSwarmAlphabet()
+    :path: The path to the swarm_objects.h that will be written
+    :originalFilename: The name of the Lulu input file"""
+
+    object_c_names = ["NO_OBJECT", "OBJECT_ID_E", "OBJECT_ID_F"] + ["OBJECT_ID_%s" % obj.upper() for obj in swarm_alphabet if obj not in ('e', 'f')]
+
+    with openOutputFile(path) as fout:
+        fout.write("""// vim:filetype=c
+/**
+ * @file lulu_swarm_objects.h
+ * @brief Object ids shared by all of the colonies of the Lulu Pswarm defined in '%s'.
+ * Objects exchanged through the global environments have the same id on all of the robots so they are copied without translation
+ * This file is included by the instance header of each colony, after lulu.h
+ * This file was generated automatically by lulu_c.py %s
+ */
+#ifndef LULU_SWARM_OBJECTS_H
+#define LULU_SWARM_OBJECTS_H
+""" % (originalFilename, getGenerationStamp()))
+
+        writeObjectsEnum(fout, object_c_names)
+        fout.write("""\n#define LULU_SWARM_NR_OBJECTS %d
+#endif""" % len(object_c_names))
+# end createSwarmObjectsHeader()
+
+def getColonyFingerprint(pcol):
+    """Returns a hash of the components of a P colony (and of the environments of its parent Pswarm) that are used by the generator,
+    so that a colony is only regenerated by watchInputFile() if one of them changed
+
+    :pcol: The pcolony object that was read by lulu_pcol_sim
+    :returns: Hex string of the hash"""
+
+    components = [sorted(pcol.A), pcol.B, pcol.n, sorted(pcol.env.items())]
+    if (pcol.parentSwarm != None):
+        for env in [pcol.parentSwarm.global_env, pcol.parentSwarm.in_global_env, pcol.parentSwarm.out_global_env]:
+            components.append(sorted(env.items()))
+    for ag_name in pcol.B:
+        agent = pcol.agents[ag_name]
+        components.append(sorted(agent.obj.items()))
+        components.append([[(rule.main_type, rule.type, rule.lhs, rule.rhs, rule.alt_type, rule.alt_lhs, rule.alt_rhs) for rule in prg]
+            for prg in agent.programs])
+
+    return hashlib.sha256(repr(components).encode()).hexdigest()
+# end getColonyFingerprint()
+
+def generateParsedInput(pObj, path, originalFilename, nr_robots, min_robot_id, colony_name = None, all_colonies = False, nr_jobs = None,
+        colony_names = None, options = {}, executor = None):
+    """Generate the C instances of a Pcolony or of the colonies of a Pswarm. The passed object is modified in place
+
+    :pObj: The Pcolony or Pswarm object that was read by lulu_pcol_sim
+    :path: The path (without extension) of the files that will be written
+    :originalFilename: The name of the Lulu input file
+    :nr_robots: The number of robots that make up the swarm
+    :min_robot_id: The smallest kilo_uid from the swarm
+    :colony_name: The name of the colony that is generated if pObj is a Pswarm and all_colonies is False
+    :all_colonies: If True, all of the colonies of the Pswarm are generated (see generateAllColonies())
+    :nr_jobs: The number of worker processes used if all_colonies is True, None to use all of the cores
+    :colony_names: If all_colonies is True, only these colonies are generated (None for all of the colonies)
+    :options: Dictionary of generateInstance() options
+    :executor: If all_colonies is True, the pool of processes that is reused (see generateAllColonies()) or None
+    :returns: The list of written files"""
+
+    if (options.get("expand_ids", False) and nr_robots < 1):
+        raise ValueError("Ahead-of-time wildcard expansion (expand_ids) requires the number of robots to be at least 1")
+
+    first_output = len(output_files)
+    if (type(pObj) == sim.Pswarm):
+        if (all_colonies):
+            generateAllColonies(pObj, path, originalFilename, nr_robots, min_robot_id, nr_jobs, options, colony_names, executor)
+        else:
+            if (colony_name not in pObj.C):
+                raise ValueError("Expected the name of a Pcolony, valid Pcolony names are: %s" % pObj.C)
+            generateInstance(pObj.colonies[colony_name], path, originalFilename, nr_robots, min_robot_id, **options)
+    else:
+        if (all_colonies):
+            raise ValueError("Generating all colonies requires a Pswarm")
+        generateInstance(pObj, path, originalFilename, nr_robots, min_robot_id, **options)
+
+    return output_files[first_output:]
+# end generateParsedInput()
+
+# options of generateInstance() that can be passed to generate() and their default values (see README.md)
+generation_options = collections.OrderedDict([("use_tables", False), ("expand_ids", False), ("prune", False), ("program_index", False),
+    ("dedup", False), ("packed_rules", False), ("max_ram", None), ("max_flash", None), ("swarm_objects", False), ("swarm_remap", False),
+    ("compact_names", False), ("name_prefixes", False), ("profile", False), ("image", False), ("sorted_multisets", False),
+    ("dense_env_limit", 64)])
+
+# options that are enabled by other options: deduplication, packed rules and the remap are stored in the constant tables,
+# the remap translates to swarm object ids and the shared prefixes are stored in the compact string blob
+option_implications = collections.OrderedDict([("dedup", ["use_tables"]), ("packed_rules", ["use_tables"]),
+    ("swarm_remap", ["swarm_objects", "use_tables"]), ("name_prefixes", ["compact_names"])])
+
+def getGenerationOptions(options):
+    """Check the names of the generation options and enable the options that are implied by them (see option_implications)
+
+    :options: Dictionary of generateInstance() options
+    :returns: Copy of the options with the implied options enabled"""
+
+    unknown = [name for name in options if name not in generation_options]
+    if (len(unknown) > 0):
+        raise ValueError("Unknown options %s, valid options are: %s" % (", ".join(unknown), ", ".join(generation_options)))
+
+    options = dict(options)
+    for name, implied in option_implications.items():
+        if (options.get(name, False)):
+            for implied_name in implied:
+                options[implied_name] = True
+    return options
+# end getGenerationOptions()
+
+def generate(pcol_or_path, path, nr_robots, min_robot_id = 0, colony_name = None, all_colonies = False, nr_jobs = None, originalFilename = None, **options):
+    """Generate the C instance (header and source) of a P colony. This is the entry point for using lulu_c.py from Python,
+    the passed Pcolony or Pswarm object is not modified so it can be generated again with different options
+
+    :pcol_or_path: A Pcolony or Pswarm object that was read by lulu_pcol_sim or the path to a Lulu input file
+    :path: The path (without extension) of the files that will be written
+    :nr_robots: The number of robots that make up the swarm
+    :min_robot_id: The smallest kilo_uid from the swarm
+    :colony_name: The name of the colony that is generated from a Pswarm (if all_colonies is False)
+    :all_colonies: If True, all of the colonies of a Pswarm are generated in parallel (see generateAllColonies())
+    :nr_jobs: The number of worker processes used if all_colonies is True, None to use all of the cores
+    :originalFilename: The name of the Lulu input file that is mentioned in the generated files (default: taken from pcol_or_path)
+    :options: generateInstance() options, see generation_options. The options implied by other options are enabled as on the command line
+    :returns: The list of written files. Errors (invalid input file or options, exceeded memory budget) raise a ValueError"""
+
+    options = getGenerationOptions(options)
+    if (isinstance(pcol_or_path, str)):
+        pObj = sim.readInputFile(pcol_or_path)
+        if (pObj == None):
+            raise ValueError("Could not read the Lulu input file %s" % pcol_or_path)
+        if (originalFilename == None):
+            originalFilename = os.path.basename(pcol_or_path)
+    else:
+        # the generator replaces the wildcarded marks and extends the alphabet in place so it works on a copy
+        pObj = copy.deepcopy(pcol_or_path)
+        if (originalFilename == None):
+            originalFilename = "(%s object)" % type(pObj).__name__
+
+    return generateParsedInput(pObj, path, originalFilename, nr_robots, min_robot_id, colony_name, all_colonies, nr_jobs, options = options)
+# end generate()
+
+def watchInputFile(input_path, path, nr_robots, min_robot_id, colony_name = None, all_colonies = False, nr_jobs = None, options = {}, interval = 0.5):
+    """Keep watching a Lulu input file and regenerate the instances of the colonies that changed each time the file is saved.
+    The colonies are compared using getColonyFingerprint() so an edit only regenerates the affected colonies. Runs until interrupted (Ctrl+C).
+    With all_colonies, the pool of worker processes is started once and reused for each regeneration
+
+    :input_path: The path of the Lulu input file
+    :interval: Time (in seconds) between two checks of the modification time of the file
+    The rest of the parameters are the same as for generateParsedInput()"""
+
+    if (all_colonies):
+        with concurrent.futures.ProcessPoolExecutor(max_workers = nr_jobs) as executor:
+            watchInputFileLoop(input_path, path, nr_robots, min_robot_id, colony_name, all_colonies, nr_jobs, options, interval, executor)
+    else:
+        watchInputFileLoop(input_path, path, nr_robots, min_robot_id, colony_name, all_colonies, nr_jobs, options, interval, None)
+# end watchInputFile()
+
+def watchInputFileLoop(input_path, path, nr_robots, min_robot_id, colony_name, all_colonies, nr_jobs, options, interval, executor):
+    """The loop of watchInputFile(), that regenerates the changed colonies using the given pool of processes (or None)"""
+
+    fingerprints = {}
+    mtime = None
+    logging.info("Watching %s for changes (press Ctrl+C to stop)" % input_path)
+    while (True):
+        try:
+            current_mtime = os.stat(input_path).st_mtime
+        except OSError:
+            # the file is being replaced by the editor
+            current_mtime = None
+
+        if (current_mtime != None and current_mtime != mtime):
+            mtime = current_mtime
+            start = time.perf_counter()
+            try:
+                pObj = sim.readInputFile(input_path)
+                if (pObj == None):
+                    raise ValueError("Could not read the Lulu input file %s" % input_path)
+
+                if (type(pObj) == sim.Pswarm):
+                    colonies = collections.OrderedDict((name, pObj.colonies[name]) for name in pObj.C if (all_colonies or name == colony_name))
+                else:
+                    colonies = collections.OrderedDict([(None, pObj)])
+                # with shared swarm object ids, adding an object to a colony changes the ids used by all of the colonies
+                swarm_fingerprint = ""
+                if (options.get("swarm_objects", False) and type(pObj) == sim.Pswarm):
+                    swarm_fingerprint = hashlib.sha256(repr(getSwarmAlphabet(pObj, nr_robots)).encode()).hexdigest()
+                new_fingerprints = dict((name, getColonyFingerprint(pcol) + swarm_fingerprint) for name, pcol in colonies.items())
+                changed = [name for name in colonies if fingerprints.get(name) != new_fingerprints[name]]
+
+                if (len(changed) == 0):
+                    logging.info("%s was saved but none of the generated colonies changed" % input_path)
+                else:
+                    if (all_colonies):
+                        logging.info("Regenerating colonies %s" % changed)
+                    # regenerating everything after a colony was removed from the Pswarm keeps the swarm header consistent
+                    generateParsedInput(pObj, path, os.path.basename(input_path), nr_robots, min_robot_id, colony_name, all_colonies, nr_jobs,
+                            changed if (set(fingerprints) <= set(new_fingerprints)) else None, options, executor)
+                    logging.info("Regenerated %d colonies in %.3f s" % (len(changed), time.perf_counter() - start))
+                fingerprints = new_fingerprints
+
+            # errors are reported and the file is watched further, waiting for a fix
+            except ValueError as e:
+                logging.error("Generation failed: %s" % e)
 
-    return nr_rules
-# end getNrOfRulesWithoutRepetitions()
+        time.sleep(interval)
+# end watchInputFileLoop()
 
 #   MAIN
 if (__name__ == "__main__"):
     logLevel = logging.INFO
+    options = dict(generation_options)
+    all_colonies = False
+    nr_jobs = None
+    incremental = False
+    depfile = None
+    watch = False
 
     if ('--debug' in sys.argv):
         logLevel = logging.DEBUG
 
+    if ('--tables' in sys.argv):
+        options["use_tables"] = True
+
+    if ('--expand-ids' in sys.argv):
+        options["expand_ids"] = True
+
+    if ('--prune' in sys.argv):
+        options["prune"] = True
+
+    if ('--program-index' in sys.argv):
+        options["program_index"] = True
+
+    if ('--dedup' in sys.argv):
+        options["dedup"] = True
+
+    if ('--packed-rules' in sys.argv):
+        options["packed_rules"] = True
+
+    if ('--all-colonies' in sys.argv):
+        all_colonies = True
+
+    if ('--swarm-objects' in sys.argv):
+        options["swarm_objects"] = True
+
+    if ('--swarm-remap' in sys.argv):
+        options["swarm_remap"] = True
+
+    if ('--compact-names' in sys.argv):
+        options["compact_names"] = True
+
+    if ('--name-prefixes' in sys.argv):
+        options["name_prefixes"] = True
+
+    if ('--profile' in sys.argv):
+        options["profile"] = True
+
+    if ('--image' in sys.argv):
+        options["image"] = True
+
+    if ('--sorted-multisets' in sys.argv):
+        options["sorted_multisets"] = True
+
+    if ('--incremental' in sys.argv):
+        incremental = True
+
+    if ('--watch' in sys.argv):
+        watch = True
+
+    for arg in sys.argv:
+        if (arg.startswith("--jobs=")):
+            nr_jobs = int(arg.split("=", 1)[1])
+        if (arg.startswith("--depfile=")):
+            depfile = arg.split("=", 1)[1]
+        if (arg.startswith("--max-ram=")):
+            options["max_ram"] = int(arg.split("=", 1)[1])
+        if (arg.startswith("--max-flash=")):
+            options["max_flash"] = int(arg.split("=", 1)[1])
+        if (arg.startswith("--dense-env-limit=")):
+            options["dense_env_limit"] = int(arg.split("=", 1)[1])
+    options = getGenerationOptions(options)
+
+    # positional arguments
+    args = [arg for arg in sys.argv if not arg.startswith("--")]
+
     try:
         import colorlog # colors log output
 
@@ -413,95 +2672,111 @@ if (__name__ == "__main__"):
     # colorlog not available
     except ImportError:
         logging.basicConfig(format='%(levelname)s:%(message)s', level = logLevel)
-    if (len(sys.argv) < 2):
+    if (len(args) < 2):
         logging.error("Expected input file path as parameter")
         exit(1)
 
-    if (len(sys.argv) < 3):
+    if (len(args) < 3):
         logging.error("Expected the path to the file (without extensions) that will be generated")
         exit(1)
 
-    if (len(sys.argv) < 4):
+    if (len(args) < 4):
         logging.error("Expected the number of robots that make up the swarm")
         exit(1)
 
-    if (len(sys.argv) < 5):
+    if (len(args) < 5):
         logging.error("Expected the minimum robot id (kilo_uid) as the last parameter")
         exit(1)
 
 
 
+    if (watch):
+        if (all_colonies):
+            path, colony_name, nr_robots, min_robot_id = args[4], None, int(args[2]), int(args[3])
+        # the input file can be a Pswarm, in which case the colony name is the first parameter after it
+        elif (len(args) > 5):
+            path, colony_name, nr_robots, min_robot_id = args[5], args[2], int(args[3]), int(args[4])
+        else:
+            path, colony_name, nr_robots, min_robot_id = args[4], None, int(args[2]), int(args[3])
+        try:
+            watchInputFile(args[1], path, nr_robots, min_robot_id, colony_name, all_colonies, nr_jobs, options)
+        except KeyboardInterrupt:
+            logging.info("Stopped watching %s" % args[1])
+        exit(0)
+
+    # the output path is always the last positional parameter
+    stamp_path = args[-1] + ".stamp"
+    if (incremental):
+        generation_stamp = computeGenerationHash(args[1], sys.argv[1:])
+        outputs = readGenerationStampFile(stamp_path, generation_stamp)
+        if (outputs != None):
+            logging.info("The generated files are up to date (inputs hash %s), nothing to do" % generation_stamp)
+            if (depfile != None):
+                writeDepfile(depfile, outputs, args[1])
+            exit(0)
+
     # read Pcolony from file
-    pObj = sim.readInputFile(sys.argv[1])
+    pObj = sim.readInputFile(args[1])
     pcol = None
+    # generate all of the colonies of a Pswarm
+    if (all_colonies):
+        if (type(pObj) != sim.Pswarm):
+            logging.error("--all-colonies requires a Pswarm input file")
+            exit(1)
+
+        nr_robots = int(args[2])
+        min_robot_id = int(args[3])
+        path = args[4]
+
     # if the p object read from the input file is a Pswarm
-    if (type(pObj) == sim.Pswarm):
-        if (len(sys.argv) < 3):
+    elif (type(pObj) == sim.Pswarm):
+        if (len(args) < 3):
             logging.error("Expected the name of a Pcolony as parameter")
             exit(1)
-        if (sys.argv[2] not in pObj.C):
+        if (args[2] not in pObj.C):
             logging.error("Expected the name of a Pcolony as parameter")
             logging.info("Valid Pcolony names for this file are: %s" % pObj.C)
             exit(1)
 
-        if (len(sys.argv) < 4):
+        if (len(args) < 4):
             logging.error("Expected the path to the header (that will be generated) as the last parameter")
             exit(1)
 
-        pcol = pObj.colonies[sys.argv[2]]
-        nr_robots = int(sys.argv[3])
-        min_robot_id = int(sys.argv[4])
-        path = sys.argv[5]
+        pcol = pObj.colonies[args[2]]
+        nr_robots = int(args[3])
+        min_robot_id = int(args[4])
+        path = args[5]
 
     else:
         pcol = pObj
 
-        nr_robots = int(sys.argv[2])
-        min_robot_id = int(sys.argv[3])
-        path = sys.argv[4]
+        nr_robots = int(args[2])
+        min_robot_id = int(args[3])
+        path = args[4]
 
-    #replacing wildcarded marks * and %id with $ and $id respectively
-    #in alphabet, all multisets and programs
-    for i, val in enumerate(pcol.A):
-        pcol.A[i] = val.replace("%id", "W_ID").replace("*", "W_ALL")
+    if (options["expand_ids"] and nr_robots < 1):
+        logging.error("Ahead-of-time wildcard expansion (--expand-ids) requires the number of robots to be at least 1")
+        exit(1)
 
-    for key in pcol.env:
-        # if key contains wildcards
-        if ("*" in key or "%id" in key):
-            #copy value at wildcarded key at new $ key
-            pcol.env[key.replace("%id", "W_ID").replace("*", "W_ALL")] = pcol.env[key];
-            #delete the * key
-            del pcol.env[key]
+    if (options["swarm_objects"] and not all_colonies):
+        logging.error("Shared swarm object ids (--swarm-objects, --swarm-remap) require --all-colonies")
+        exit(1)
 
-    #if this pcolony is part of swarm
-    if (pcol.parentSwarm != None):
-        for key in pcol.parentSwarm.global_env:
-            # if key contains wildcards
-            if ("*" in key or "%id" in key):
-                #copy value at wildcarded key at new $ key
-                pcol.parentSwarm.global_env[key.replace("%id", "W_ID").replace("*", "W_ALL")] = pcol.parentSwarm.global_env[key];
-                #delete the * key
-                del pcol.parentSwarm.global_env[key]
+    try:
+        if (all_colonies):
+            generateParsedInput(pObj, path, args[1].split("/")[-1], nr_robots, min_robot_id, all_colonies = True, nr_jobs = nr_jobs, options = options)
+        else:
+            generateParsedInput(pcol, path, args[1].split("/")[-1], nr_robots, min_robot_id, options = options)
+    except ValueError as e:
+        logging.error(e)
+        exit(1)
 
-    for ag_name in pcol.B:
-        for key in pcol.agents[ag_name].obj:
-            # if key contains wildcards
-            if ("*" in key or "%id" in key):
-                #copy value at wildcarded key at new $ key
-                pcol.agents[ag_name].obj[key.replace("%id", "W_ID").replace("*", "W_ALL")] = pcol.agents[ag_name].obj[key];
-                #delete the * key
-                del pcol.agents[ag_name].obj[key]
-        # end for key in obj
-        for prg_nr, prg in enumerate(pcol.agents[ag_name].programs):
-            for rule_nr, rule in enumerate(prg):
-                rule.lhs = rule.lhs.replace("%id", "W_ID").replace("*", "W_ALL")
-                rule.rhs = rule.rhs.replace("%id", "W_ID").replace("*", "W_ALL")
-                rule.alt_lhs = rule.alt_lhs.replace("%id", "W_ID").replace("*", "W_ALL")
-                rule.alt_rhs = rule.alt_rhs.replace("%id", "W_ID").replace("*", "W_ALL")
+    if (not all_colonies):
+        pcol.print_colony_components()
 
-    logging.info("Generating the instance header (%s)" % (path + ".h"))
-    createInstanceHeader(pcol, path + ".h", sys.argv[1].split("/")[-1], nr_robots)
-    logging.info("Generating the instance source (%s)" % (path + ".c"))
-    createInstanceSource(pcol, path, nr_robots, min_robot_id)
+    if (incremental):
+        with open(stamp_path, "w") as fout:
+            json.dump({"hash": generation_stamp, "outputs": output_files}, fout, indent=4)
 
-    pcol.print_colony_components()
+    if (depfile != None):
+        writeDepfile(depfile, output_files, args[1])
@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+import logging
+from lulu_pcol_sim import sim
+import lulu_c
+import collections # for Counter
+import json # for the results file
+import os # for path.getsize()
+import random # for the synthetic P colonies
+import shutil # for rmtree()
+import sys # for argv
+import tempfile # for mkdtemp()
+import time # for perf_counter(), strftime()
+import tracemalloc # for the peak memory of each stage
+
+# synthetic P colonies used by benchmarkScenario(), from small to large
+benchmark_scenarios = [
+    {"name": "small", "nr_objects": 20, "nr_wildcards": 2, "nr_agents": 2, "nr_programs": 5, "nr_rules": 2,
+        "wildcard_density": 0.1, "nr_robots": 10, "nr_colonies": 1, "options": {}},
+    {"name": "medium", "nr_objects": 200, "nr_wildcards": 10, "nr_agents": 5, "nr_programs": 20, "nr_rules": 3,
+        "wildcard_density": 0.1, "nr_robots": 100, "nr_colonies": 1, "options": {}},
+    {"name": "medium_tables", "nr_objects": 200, "nr_wildcards": 10, "nr_agents": 5, "nr_programs": 20, "nr_rules": 3,
+        "wildcard_density": 0.1, "nr_robots": 100, "nr_colonies": 1, "options": {"use_tables": True, "dedup": True}},
+    {"name": "large", "nr_objects": 1000, "nr_wildcards": 20, "nr_agents": 10, "nr_programs": 50, "nr_rules": 4,
+        "wildcard_density": 0.05, "nr_robots": 1000, "nr_colonies": 1, "options": {}},
+    {"name": "swarm", "nr_objects": 100, "nr_wildcards": 5, "nr_agents": 4, "nr_programs": 10, "nr_rules": 2,
+        "wildcard_density": 0.1, "nr_robots": 50, "nr_colonies": 4, "options": {}},
+]
+
+def createSyntheticRule(rule_type, lhs, rhs):
+    """Create a (non conditional) rule without going through the parser of lulu_pcol_sim
+
+    :rule_type: The sim.RuleType of the rule
+    :lhs: The left hand side object
+    :rhs: The right hand side object
+    :returns: The rule object"""
+
+    rule = sim.Rule.__new__(sim.Rule)
+    rule.type = rule.main_type = rule_type
+    rule.lhs, rule.rhs = lhs, rhs
+    rule.alt_type, rule.alt_lhs, rule.alt_rhs = 0, '', ''
+
+    return rule
+# end createSyntheticRule()
+
+def createSyntheticPcolony(nr_objects, nr_wildcards, nr_agents = 0, nr_programs = 0, nr_rules = 0, wildcard_density = 0.0, seed = 0):
+    """Create a P colony with controllable sizes, used for benchmarking.
+    Wildcarded objects use the %id and * marks, as they are read from a Lulu input file
+
+    :nr_objects: The number of plain (not wildcarded) objects
+    :nr_wildcards: The number of wildcarded objects, each of them present as both X_%id and X_*
+    :nr_agents: The number of agents
+    :nr_programs: The number of programs of each agent
+    :nr_rules: The number of rules of each program (and the capacity of the agents)
+    :wildcard_density: The probability that an operand of a rule is a wildcarded object
+    :seed: The seed used for selecting the rules, so that the same P colony is created on each call
+    :returns: The pcolony object"""
+
+    rng = random.Random(seed)
+
+    # only the components used by lulu_c.py are set, the constructor is not needed
+    pcol = sim.Pcolony.__new__(sim.Pcolony)
+    pcol.n = nr_rules
+    pcol.parentSwarm = None
+    pcol.A = ["e", "f"]
+    pcol.A.extend(["obj_%d" % i for i in range(nr_objects)])
+    wildcards = []
+    for i in range(nr_wildcards):
+        wildcards.extend(["wild_%d_%%id" % i, "wild_%d_*" % i])
+    pcol.A.extend(wildcards)
+    plain = pcol.A[:2 + nr_objects]
+
+    pcol.env = collections.Counter()
+    for obj in plain[2:2 + min(nr_objects, 5)]:
+        pcol.env[obj] = rng.randint(1, 3)
+
+    pcol.B = ["agent_%d" % i for i in range(nr_agents)]
+    pcol.agents = {}
+    operand = lambda: rng.choice(wildcards) if (len(wildcards) > 0 and rng.random() < wildcard_density) else rng.choice(plain)
+    for ag_name in pcol.B:
+        agent = sim.Agent.__new__(sim.Agent)
+        agent.colony = pcol
+        agent.obj = collections.Counter({"e": nr_rules})
+        agent.programs = []
+        for prg_nr in range(nr_programs):
+            prg = sim.Program()
+            for rule_nr in range(nr_rules):
+                prg.append(createSyntheticRule(rng.choice([sim.RuleType.evolution, sim.RuleType.communication]), operand(), operand()))
+            agent.programs.append(prg)
+        pcol.agents[ag_name] = agent
+
+    return pcol
+# end createSyntheticPcolony()
+
+def createSyntheticPswarm(nr_colonies, **colony_sizes):
+    """Create a P swarm of synthetic P colonies that share a global environment
+
+    :nr_colonies: The number of colonies
+    :colony_sizes: The parameters of createSyntheticPcolony(), each colony is created with a different seed
+    :returns: The pswarm object"""
+
+    pswarm = sim.Pswarm.__new__(sim.Pswarm)
+    pswarm.C = ["colony_%d" % i for i in range(nr_colonies)]
+    pswarm.colonies = {}
+    pswarm.global_env = collections.Counter({"obj_0": 1})
+    pswarm.in_global_env = collections.Counter()
+    pswarm.out_global_env = collections.Counter()
+    for seed, colony_name in enumerate(pswarm.C):
+        pcol = createSyntheticPcolony(seed = seed, **colony_sizes)
+        pcol.parentSwarm = pswarm
+        pswarm.colonies[colony_name] = pcol
+
+    return pswarm
+# end createSyntheticPswarm()
+
+def measure(prepare, run):
+    """Measure the wall time and the peak memory allocated by a function.
+    The memory is measured in a second call because tracemalloc slows down the measured code
+
+    :prepare: Function that returns the (fresh) list of arguments of run, it is not measured
+    :run: The function that is measured
+    :returns: Dictionary with 'seconds' and 'peak_bytes'"""
+
+    args = prepare()
+    start = time.perf_counter()
+    run(*args)
+    duration = time.perf_counter() - start
+
+    args = prepare()
+    tracemalloc.start()
+    run(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {"seconds": duration, "peak_bytes": peak}
+# end measure()
+
+def benchmarkAlphabetExpansion(nr_robots_list, nr_objects, nr_wildcards):
+    """Time expandAlphabet() for an increasing number of robots
+
+    :nr_robots_list: List of swarm sizes that will be benchmarked
+    :nr_objects: The number of plain objects of the synthetic alphabet
+    :nr_wildcards: The number of wildcarded objects of the synthetic alphabet
+    :returns: List of dictionaries with 'nr_robots', 'alphabet_size' (after expansion) and 'seconds'"""
+
+    results = []
+    for nr_robots in nr_robots_list:
+        pcol = createSyntheticPcolony(nr_objects, nr_wildcards)
+        lulu_c.replaceWildcardMarks(pcol)
+        start = time.perf_counter()
+        lulu_c.expandAlphabet(pcol, nr_robots)
+        duration = time.perf_counter() - start
+        results.append({"nr_robots": nr_robots, "alphabet_size": len(pcol.A), "seconds": duration})
+        logging.info("expandAlphabet(): nr_robots = %6d, alphabet size = %7d, time = %8.3f s (%.2f us / object)" % (
+            nr_robots, len(pcol.A), duration, duration * 1e6 / len(pcol.A)))
+
+    return results
+# end benchmarkAlphabetExpansion()
+
+def benchmarkScenario(scenario, path):
+    """Time and memory-profile each stage of the generation of a synthetic P colony (or P swarm)
+
+    :scenario: One of the benchmark_scenarios
+    :path: Directory where the generated files are written
+    :returns: Dictionary with the 'name' and 'parameters' of the scenario, the 'stages' (see measure())
+    and the size of the generated 'output' ('files', 'lines', 'bytes')"""
+
+    sizes = dict((key, scenario[key]) for key in ("nr_objects", "nr_wildcards", "nr_agents", "nr_programs", "nr_rules", "wildcard_density"))
+    nr_robots = scenario["nr_robots"]
+    options = scenario["options"]
+    base = os.path.join(path, scenario["name"])
+
+    def createColony():
+        if (scenario["nr_colonies"] > 1):
+            pcol = createSyntheticPswarm(scenario["nr_colonies"], **sizes).colonies["colony_0"]
+        else:
+            pcol = createSyntheticPcolony(**sizes)
+        lulu_c.replaceWildcardMarks(pcol)
+        return pcol
+
+    def generateAll(colonies):
+        for colony_name, pcol in colonies:
+            lulu_c.generateInstance(pcol, "%s_%s" % (base, colony_name), "synthetic.lulu", nr_robots, 0, **options)
+
+    def prepareAll():
+        if (scenario["nr_colonies"] > 1):
+            pswarm = createSyntheticPswarm(scenario["nr_colonies"], **sizes)
+            return [[(colony_name, pswarm.colonies[colony_name]) for colony_name in pswarm.C]]
+        return [[("colony", createSyntheticPcolony(**sizes))]]
+
+    stages = collections.OrderedDict()
+    stages["expand_alphabet"] = measure(lambda: [createColony(), nr_robots], lulu_c.expandAlphabet)
+    stages["compile"] = measure(lambda: [createColony(), nr_robots], lulu_c.compilePcolony)
+    stages["instance_header"] = measure(lambda: [lulu_c.compilePcolony(createColony(), nr_robots), base + ".h", "synthetic.lulu", None,
+        options.get("use_tables", False)], lulu_c.createInstanceHeader)
+    stages["instance_source"] = measure(lambda: [lulu_c.compilePcolony(createColony(), nr_robots), base, 0,
+        options.get("use_tables", False), False, options.get("dedup", False)], lulu_c.createInstanceSource)
+    stages["end_to_end"] = measure(prepareAll, generateAll)
+
+    # the files written by the last end to end generation
+    del lulu_c.output_files[:]
+    generateAll(*prepareAll())
+    output = {"files": len(lulu_c.output_files), "lines": 0, "bytes": 0}
+    for output_path in lulu_c.output_files:
+        with open(output_path, "r") as fin:
+            output["lines"] += fin.read().count("\n")
+        output["bytes"] += os.path.getsize(output_path)
+
+    return {"name": scenario["name"], "parameters": dict(sizes, nr_robots = nr_robots, nr_colonies = scenario["nr_colonies"], options = options),
+            "stages": stages, "output": output}
+# end benchmarkScenario()
+
+def compareResults(old, new):
+    """Log the relative change of each stage and of the output size between two benchmark results
+
+    :old: The results of the reference version, as written in the JSON file
+    :new: The results of the current version"""
+
+    old_scenarios = dict((scenario["name"], scenario) for scenario in old["scenarios"])
+    for scenario in new["scenarios"]:
+        if (scenario["name"] not in old_scenarios):
+            logging.info("%s: not present in the reference results" % scenario["name"])
+            continue
+
+        old_scenario = old_scenarios[scenario["name"]]
+        if (old_scenario["parameters"] != scenario["parameters"]):
+            logging.warning("%s: the parameters of the scenario changed, the results are not comparable" % scenario["name"])
+        for stage, result in scenario["stages"].items():
+            if (stage not in old_scenario["stages"]):
+                continue
+            old_result = old_scenario["stages"][stage]
+            logging.info("%s: %-16s time %+7.1f %%, peak memory %+7.1f %%" % (scenario["name"], stage,
+                100.0 * (result["seconds"] - old_result["seconds"]) / max(old_result["seconds"], 1e-9),
+                100.0 * (result["peak_bytes"] - old_result["peak_bytes"]) / max(old_result["peak_bytes"], 1)))
+        logging.info("%s: output %+d lines, %+d bytes" % (scenario["name"],
+            scenario["output"]["lines"] - old_scenario["output"]["lines"], scenario["output"]["bytes"] - old_scenario["output"]["bytes"]))
+# end compareResults()
+
+#   MAIN
+if (__name__ == "__main__"):
+    logging.basicConfig(format='%(levelname)s:%(message)s', level = logging.INFO)
+
+    json_path = None
+    compare_path = None
+    scenario_names = [scenario["name"] for scenario in benchmark_scenarios]
+    for arg in sys.argv:
+        if (arg.startswith("--json=")):
+            json_path = arg.split("=", 1)[1]
+        if (arg.startswith("--compare=")):
+            compare_path = arg.split("=", 1)[1]
+        if (arg.startswith("--scenarios=")):
+            scenario_names = arg.split("=", 1)[1].split(",")
+    args = [arg for arg in sys.argv if not arg.startswith("--")]
+
+    nr_robots_list = [100, 1000, 10000]
+    if (len(args) > 1):
+        nr_robots_list = [int(val) for val in args[1].split(",")]
+
+    results = {"generator_version": lulu_c.generator_version, "python": sys.version.split()[0], "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "alphabet_expansion": benchmarkAlphabetExpansion(nr_robots_list, nr_objects = 200, nr_wildcards = 10), "scenarios": []}
+
+    path = tempfile.mkdtemp(prefix = "lulu_c_bench_")
+    try:
+        for scenario in benchmark_scenarios:
+            if (scenario["name"] not in scenario_names):
+                continue
+            # the generator logs every file that it writes and warns about the large synthetic alphabets
+            logging.disable(logging.WARNING)
+            result = benchmarkScenario(scenario, path)
+            logging.disable(logging.NOTSET)
+            results["scenarios"].append(result)
+
+            for stage, stage_result in result["stages"].items():
+                logging.info("%s: %-16s %8.3f s, peak memory %10d bytes" % (scenario["name"], stage, stage_result["seconds"], stage_result["peak_bytes"]))
+            logging.info("%s: output of %d files, %d lines, %d bytes" % (scenario["name"], result["output"]["files"], result["output"]["lines"], result["output"]["bytes"]))
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(path)
+
+    if (compare_path != None):
+        with open(compare_path, "r") as fin:
+            compareResults(json.load(fin), results)
+
+    if (json_path != None):
+        with open(json_path, "w") as fout:
+            json.dump(results, fout, indent=4)
+        logging.info("Results written to %s" % json_path)
@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+import logging
+import collections # for defaultdict
+import json # for the mapping and results files
+import re # for parsing the dumps
+import sys # for argv
+
+# LULU_PROFILE <robot_uid> <layout> <P|R> <counter> <count>, as printed by lulu_profile_dump(), possibly after a prefix added by the serial logger
+dump_line_pattern = re.compile(r"LULU_PROFILE (\d+) (\w+) ([PR]) (\d+) (\d+)")
+
+def readProfileDumps(paths, layout):
+    """Read the counters printed by lulu_profile_dump() on one or more robots.
+    The counters are cumulative so, if a robot dumped the same counter more than once, its last value is kept
+
+    :paths: The paths of the log files that contain LULU_PROFILE lines
+    :layout: The layout hash from the sidecar file, dumps of instances with a different layout are ignored
+    :returns: Dictionary robot_uid -> {(P|R, counter): count}"""
+
+    dumps = collections.defaultdict(dict)
+    ignored = 0
+    for path in paths:
+        with open(path, "r", errors="replace") as fin:
+            for line in fin:
+                match = dump_line_pattern.search(line)
+                if (match == None):
+                    continue
+                robot_uid, dump_layout, kind, counter, count = match.groups()
+                if (dump_layout != layout):
+                    ignored += 1
+                    continue
+                dumps[int(robot_uid)][(kind, int(counter))] = int(count)
+
+    if (ignored > 0):
+        logging.warning("Ignored %d counters that were dumped by instances with a different layout than %s (generated from another version of the input file?)" % (ignored, layout))
+
+    return dumps
+# end readProfileDumps()
+
+def mergeProfile(mapping, dumps):
+    """Merge the counters of all robots and map them to the programs and rules of the Lulu input file.
+    The counters of the copies of a program (made by the wildcard expansion of --expand-ids) are added to the program that they were copied from
+
+    :mapping: The sidecar file written by lulu_c.py --profile
+    :dumps: The counters of each robot, read by readProfileDumps()
+    :returns: List of programs (agent, program, text, count, robots, rules[rule, text, count]) sorted from the most executed"""
+
+    programs = collections.OrderedDict()
+    robot_counts = collections.defaultdict(lambda: collections.defaultdict(int))
+    for prg in mapping["programs"]:
+        key = (prg["agent"], prg["program"])
+        if (key not in programs):
+            programs[key] = {"agent": prg["agent"], "program": prg["program"], "text": prg["text"], "count": 0, "robots": 0,
+                "rules": collections.OrderedDict()}
+        merged = programs[key]
+        for robot_uid, robot_dump in dumps.items():
+            count = robot_dump.get(("P", prg["counter"]), 0)
+            merged["count"] += count
+            robot_counts[key][robot_uid] += count
+        for rule in prg["rules"]:
+            if (rule["rule"] not in merged["rules"]):
+                merged["rules"][rule["rule"]] = {"rule": rule["rule"], "text": rule["text"], "count": 0}
+            merged["rules"][rule["rule"]]["count"] += sum(robot_dump.get(("R", rule["counter"]), 0) for robot_dump in dumps.values())
+
+    for key, merged in programs.items():
+        merged["robots"] = sum(1 for count in robot_counts[key].values() if count > 0)
+        merged["rules"] = list(merged["rules"].values())
+
+    programs = list(programs.values())
+    programs.sort(key=lambda prg: prg["count"], reverse=True)
+    return programs
+# end mergeProfile()
+
+def reportProfile(programs, nr_robots, top):
+    """Log the most executed programs and their rules
+
+    :programs: The merged programs, from mergeProfile()
+    :nr_robots: The number of robots whose counters were merged
+    :top: The number of programs that are reported"""
+
+    total = sum(prg["count"] for prg in programs)
+    logging.info("%d program executions on %d robots" % (total, nr_robots))
+    if (total == 0):
+        return
+
+    for prg in programs[:top]:
+        if (prg["count"] == 0):
+            break
+        logging.info("%10d (%5.1f%%) on %d robots, agent %s program %d: < %s >" % (prg["count"], 100.0 * prg["count"] / total, prg["robots"],
+            prg["agent"], prg["program"], prg["text"]))
+        for rule in prg["rules"]:
+            logging.debug("    %10d rule %d: %s" % (rule["count"], rule["rule"], rule["text"]))
+
+    never_executed = [prg for prg in programs if prg["count"] == 0]
+    if (len(never_executed) > 0):
+        logging.info("%d programs were never executed" % len(never_executed))
+        for prg in never_executed:
+            logging.debug("    agent %s program %d: < %s >" % (prg["agent"], prg["program"], prg["text"]))
+# end reportProfile()
+
+if (__name__ == "__main__"):
+    logLevel = logging.INFO
+    if ('--debug' in sys.argv):
+        logLevel = logging.DEBUG
+    logging.basicConfig(format='%(levelname)s:%(message)s', level = logLevel)
+
+    top = 10
+    json_path = None
+    for arg in sys.argv:
+        if (arg.startswith("--top=")):
+            top = int(arg.split("=", 1)[1])
+        if (arg.startswith("--json=")):
+            json_path = arg.split("=", 1)[1]
+    args = [arg for arg in sys.argv if not arg.startswith("--")]
+
+    if (len(args) < 2):
+        logging.error("Expected the path to the .profile.json file written by lulu_c.py --profile")
+        exit(1)
+
+    if (len(args) < 3):
+        logging.error("Expected the path to at least one file with the output of lulu_profile_dump()")
+        exit(1)
+
+    with open(args[1], "r") as fin:
+        mapping = json.load(fin)
+
+    dumps = readProfileDumps(args[2:], mapping["layout"])
+    programs = mergeProfile(mapping, dumps)
+    reportProfile(programs, len(dumps), top)
+
+    if (json_path != None):
+        with open(json_path, "w") as fout:
+            json.dump({"input": mapping["input"], "robots": sorted(dumps), "programs": programs}, fout, indent=4)
+        logging.info("Results written to %s" % json_path)
@@ -0,0 +1,606 @@
+#!/usr/bin/python3
+import logging
+import copy # for deepcopy()
+import itertools # for product()
+import lulu_c
+import numpy as np
+import sys # for argv
+import time # for perf_counter()
+
+# rule kinds, in the order of lulu_c.image_rule_types: evolution, communication, exteroceptive, in_exteroceptive, out_exteroceptive
+# for a rule lhs ? rhs, lhs leaves the agent for the environment dst_of_kind[kind] and rhs enters the agent from src_of_kind[kind]
+# (-1 for evolution rules, that rewrite lhs into rhs inside the agent)
+ENV, GLOBAL_ENV, IN_GLOBAL_ENV, OUT_GLOBAL_ENV = range(4)
+src_of_kind = np.array([-1, ENV, GLOBAL_ENV, IN_GLOBAL_ENV, ENV])
+dst_of_kind = np.array([-1, ENV, GLOBAL_ENV, ENV, OUT_GLOBAL_ENV])
+
+# object id of e, that is available in unlimited quantity in all of the environments
+E = 1
+
+# the diff against lulu_pcol_sim gives up on a step if more combinations of programs than this can explain it
+max_diff_combinations = 4096
+
+def getRuleKinds(rule_type):
+    """Split the C rule type of a rule from the IR (see lulu_c.compilePcolony()) into the kinds of its main and alternative rules
+
+    :rule_type: The C rule type (RULE_TYPE_*)
+    :returns: (main kind, alternative kind or -1) tuple"""
+
+    index = lulu_c.image_rule_types.index(rule_type)
+    if (index < 5):
+        return (index, -1)
+    return ((index - 5) // 5, (index - 5) % 5)
+# end getRuleKinds()
+
+def compileSwarm(pcol, nr_robots):
+    """Compile the expanded instances of a P colony for all of the robots of the swarm into NumPy arrays.
+    The objects, programs and rules are numbered like the instances written by lulu_c.py --expand-ids: the object ids are the ones of the
+    expanded alphabet and each program with _W_ALL objects is replaced by nr_robots - 1 programs (see lulu_c.expandPcolonyForRobot()).
+    Only the wildcarded objects are resolved for each robot so the colony is compiled once instead of once per robot.
+    The copies of a program with _W_ALL objects are not stored: they share the operands of the program of the input file and the
+    objects of the other robot of each copy are looked up when stepping (see getOperands() and getRuleIndexes())
+
+    :pcol: The pcolony object that was read by lulu_pcol_sim (it is not modified)
+    :nr_robots: The number of robots that make up the swarm
+    :returns: (model, initial state, prepared pcolony) tuple. The model has the 'object_names', 'object_ids' and, for each of the 'agents':
+        'name', 'main_kind' and 'alt_kind' (programs of the input file x rules, -1 for missing rules),
+        'ops' (robots x programs of the input file x rules x (lhs, rhs, alt_lhs, alt_rhs), 0 for the operands with _W_ALL objects),
+        'wild_operands' (list of (program, rule, operand, expanded object id of each other robot or (robot, other robot) pair) tuples),
+        'program' (the program of the input file that each expanded program was expanded from), 'copy' (the copy of each expanded program),
+        'first' (the first expanded program of each program of the input file), 'nr_copies', 'robot_ids' (the symbolic id of each robot)
+        and 'program_texts'.
+        The state has 'obj' (agents x robots x objects) and 'envs' (env, global_env, in_global_env, out_global_env x robots x objects) counts.
+        The prepared pcolony (wildcarded marks replaced and alphabet extended) is the input of lulu_c.expandPcolonyForRobot()"""
+
+    pcol = copy.deepcopy(pcol)
+    lulu_c.replaceWildcardMarks(pcol)
+    template = lulu_c.compilePcolony(pcol, nr_robots)
+    expanded = lulu_c.compilePcolony(lulu_c.expandPcolonyForRobot(pcol, nr_robots, 0), nr_robots)
+    object_ids = expanded["object_ids"]
+
+    tables = {}
+    def getTable(name):
+        """Returns the expanded object ids of a template object for each robot (_W_ID), other robot (_W_ALL) or (robot, other robot) pair"""
+
+        if (name not in tables):
+            if ("_W_ID" in name and "_W_ALL" in name):
+                tables[name] = np.array([[object_ids.get(name.replace("_W_ID", "_%d" % r).replace("_W_ALL", "_%d" % i), -1)
+                    for i in range(nr_robots)] for r in range(nr_robots)], dtype=np.int32)
+            elif ("_W_ID" in name):
+                tables[name] = np.array([object_ids.get(name.replace("_W_ID", "_%d" % r), -1) for r in range(nr_robots)], dtype=np.int32)
+            elif ("_W_ALL" in name):
+                tables[name] = np.array([object_ids.get(name.replace("_W_ALL", "_%d" % i), -1) for i in range(nr_robots)], dtype=np.int32)
+            else:
+                tables[name] = np.int32(object_ids.get(name, -1))
+        return tables[name]
+
+    def resolve(obj_id, robot, other):
+        """Returns the expanded object ids of a template object for each (robot, other robot) index pair (arrays of the same shape)"""
+
+        name = template["object_names"][obj_id]
+        if (obj_id == 0):
+            return np.zeros(robot.shape, dtype=np.int32)
+        getTable(name)
+        if ("_W_ID" in name and "_W_ALL" in name):
+            ids = tables[name][robot, other]
+        elif ("_W_ID" in name):
+            ids = tables[name][robot]
+        elif ("_W_ALL" in name):
+            ids = tables[name][other]
+        else:
+            ids = np.full(robot.shape, tables[name], dtype=np.int32)
+        if ((ids < 0).any()):
+            raise ValueError("Object %s does not have an expanded object in the alphabet" % name)
+        return ids
+
+    def resolveOther(obj_id):
+        """Returns the expanded object ids of a template object with _W_ALL for each other robot (or each (robot, other robot) pair)"""
+
+        name = template["object_names"][obj_id]
+        table = getTable(name)
+        # a robot is never its own other robot
+        used = table[~np.eye(nr_robots, dtype=bool)] if (table.ndim == 2) else table
+        if (nr_robots > 1 and (used < 0).any()):
+            raise ValueError("Object %s does not have an expanded object in the alphabet" % name)
+        return table
+
+    def resolveInitial(obj_id):
+        """Returns the expanded object ids of an object of an initial multiset for each robot. Like lulu_c.expandPcolonyForRobot(),
+        the _W_ALL objects of the multisets are not expanded"""
+
+        name = template["object_names"][obj_id]
+        if ("_W_ALL" not in name):
+            return resolve(obj_id, robots, robots)
+        ids = np.array([object_ids.get(name.replace("_W_ID", "_%d" % r), -1) for r in range(nr_robots)], dtype=np.int32)
+        if ((ids < 0).any()):
+            raise ValueError("Object %s does not have an expanded object in the alphabet" % name)
+        return ids
+
+    robots = np.arange(nr_robots)
+    model = {"object_names": expanded["object_names"], "object_ids": object_ids, "nr_robots": nr_robots, "agents": []}
+    state = {"obj": np.zeros((len(template["agents"]), nr_robots, len(expanded["object_names"])), dtype=np.int32),
+            "envs": np.zeros((4, nr_robots, len(expanded["object_names"])), dtype=np.int32)}
+
+    for ag_nr, agent in enumerate(template["agents"]):
+        nr_programs = len(agent["programs"])
+        nr_rules = max([len(prg["rules"]) for prg in agent["programs"]] + [0])
+        # a program with _W_ALL objects is expanded for all of the other robots
+        nr_copies = max(nr_robots - 1, 0) if (any(prg["has_wild_any"] for prg in agent["programs"])) else 0
+        program = np.repeat(np.arange(nr_programs, dtype=np.int32), [nr_copies if (prg["has_wild_any"]) else 1 for prg in agent["programs"]])
+        first = np.searchsorted(program, np.arange(nr_programs)).astype(np.int32)
+
+        main_kind = np.full((nr_programs, nr_rules), -1, dtype=np.int8)
+        alt_kind = np.full((nr_programs, nr_rules), -1, dtype=np.int8)
+        ops = np.zeros((nr_robots, nr_programs, nr_rules, 4), dtype=np.int32)
+        wild_operands = []
+        for prg_nr, prg in enumerate(agent["programs"]):
+            for rule_nr, rule in enumerate(prg["rules"]):
+                main_kind[prg_nr, rule_nr], alt_kind[prg_nr, rule_nr] = getRuleKinds(rule["type"])
+                for op_nr, obj_id in enumerate(rule["operands"]):
+                    if (prg["has_wild_any"] and "_W_ALL" in template["object_names"][obj_id]):
+                        wild_operands.append((prg_nr, rule_nr, op_nr, resolveOther(obj_id)))
+                    else:
+                        ops[:, prg_nr, rule_nr, op_nr] = resolve(obj_id, robots, robots)
+
+        model["agents"].append({"name": agent["name"], "main_kind": main_kind, "alt_kind": alt_kind, "ops": ops, "wild_operands": wild_operands,
+            "program": program, "copy": np.arange(len(program), dtype=np.int32) - first[program], "first": first, "nr_copies": nr_copies,
+            "robot_ids": robots, "program_texts": [prg["text"] for prg in agent["programs"]]})
+        indexRules(model["agents"][-1], len(expanded["object_names"]))
+
+        for obj_id, nr in agent["obj"]:
+            np.add.at(state["obj"][ag_nr], (robots, resolveInitial(obj_id)), nr)
+
+    for env_nr, items in enumerate([template["env"]] + [items for env_name, items in template["global_envs"]]):
+        for obj_id, nr in items:
+            np.add.at(state["envs"][env_nr], (robots, resolveInitial(obj_id)), nr)
+
+    return (model, state, pcol)
+# end compileSwarm()
+
+def selectRobots(model, state, robots):
+    """Select a subset of the robots of a compiled swarm
+
+    :model: The model from compileSwarm()
+    :state: The state of all of the robots
+    :robots: The indexes of the selected robots
+    :returns: (model, state) tuple that only contain the selected robots"""
+
+    model = dict(model, agents=[dict(agent, ops=agent["ops"][robots], robot_ids=agent["robot_ids"][robots]) for agent in model["agents"]])
+    for agent in model["agents"]:
+        indexRules(agent, len(model["object_names"]))
+    state = {"obj": state["obj"][:, robots].copy(), "envs": state["envs"][:, robots].copy()}
+    return (model, state)
+# end selectRobots()
+
+def getOtherRobots(robot_ids, copies):
+    """Get the other robot that the copies of a program with _W_ALL objects were expanded for
+    (copy j of robot r is expanded for robot j if j < r and for robot j + 1 otherwise)
+
+    :robot_ids: The symbolic ids of the robots
+    :copies: The copies of the programs (broadcast against robot_ids)
+    :returns: The symbolic ids of the other robots"""
+
+    return copies + (copies >= robot_ids)
+# end getOtherRobots()
+
+def getOperands(agent, rows, programs):
+    """Get the operands of the rules of expanded programs, with the objects of the other robot for the copies of the programs with _W_ALL objects
+
+    :agent: An agent of the model from compileSwarm()
+    :rows: The robots
+    :programs: The expanded program of each robot
+    :returns: The operands (robots x rules x (lhs, rhs, alt_lhs, alt_rhs))"""
+
+    templates = agent["program"][programs]
+    ops = agent["ops"][rows, templates]
+    if (len(agent["wild_operands"]) > 0):
+        robot_ids = agent["robot_ids"][rows]
+        others = getOtherRobots(robot_ids, agent["copy"][programs])
+        for prg_nr, rule_nr, op_nr, table in agent["wild_operands"]:
+            selected = templates == prg_nr
+            ops[selected, rule_nr, op_nr] = table[robot_ids[selected], others[selected]] if (table.ndim == 2) else table[others[selected]]
+    return ops
+# end getOperands()
+
+def indexRules(agent, nr_objects):
+    """Compute the positions of the objects consumed by the rules of an agent in the flattened multisets of the robots,
+    so that getApplicablePrograms() reads them with a single lookup
+
+    :agent: An agent of the model from compileSwarm(), 'lhs_index' and 'src_index' (rules x (main, alternative) rule x robots x programs of the
+    input file) are added to it. 'src_index' is -1 if the rule does not consume objects from an environment. The positions of the operands
+    with _W_ALL objects are added as 'wild_index', a list of (rule, (main, alternative) rule, True for src_index, program, position of the
+    first object of each robot, expanded object ids from 'wild_operands') tuples
+    :nr_objects: The number of objects of the expanded alphabet"""
+
+    nr_robots = agent["ops"].shape[0]
+    index_type = np.int32 if (4 * nr_robots * nr_objects < 2 ** 31) else np.int64
+    rows = (np.arange(nr_robots, dtype=index_type) * nr_objects)[:, None, None, None]
+    kinds = np.stack([agent["main_kind"], agent["alt_kind"]], axis=-1)
+    lhs = agent["ops"][..., [0, 2]]
+    rhs = agent["ops"][..., [1, 3]]
+    src = np.where((kinds >= 0) & (rhs != E), src_of_kind[np.maximum(kinds, 0)], -1)
+
+    # the rules are the outer dimensions so that each rule is read from contiguous memory
+    agent["lhs_index"] = np.ascontiguousarray((rows + lhs).transpose(2, 3, 0, 1))
+    agent["src_index"] = np.ascontiguousarray(np.where(src >= 0, src * (nr_robots * nr_objects) + rows + rhs, -1).astype(index_type).transpose(2, 3, 0, 1))
+
+    agent["wild_index"] = []
+    for prg_nr, rule_nr, op_nr, table in agent["wild_operands"]:
+        branch, is_src = op_nr // 2, op_nr % 2 == 1
+        base = rows[:, 0, 0, 0]
+        if (is_src):
+            env = src_of_kind[kinds[prg_nr, rule_nr, branch]]
+            if (env < 0):
+                continue
+            base = base + env * (nr_robots * nr_objects)
+        agent["wild_index"].append((rule_nr, branch, is_src, prg_nr, base, table))
+# end indexRules()
+
+def getRuleIndexes(agent, rule_nr, branch):
+    """Get the positions of the objects consumed by a rule of all of the expanded programs of an agent (see indexRules())
+
+    :agent: An agent of the model from compileSwarm()
+    :rule_nr: The number of the rule in the programs
+    :branch: 0 for the main rule, 1 for the alternative rule
+    :returns: (lhs_index, src_index) tuple (robots x expanded programs)"""
+
+    lhs = agent["lhs_index"][rule_nr, branch]
+    src = agent["src_index"][rule_nr, branch]
+    if (len(agent["wild_operands"]) == 0):
+        return (lhs, src)
+
+    lhs = lhs[:, agent["program"]]
+    src = src[:, agent["program"]]
+    robot_ids = agent["robot_ids"][:, None]
+    others = getOtherRobots(robot_ids, np.arange(agent["nr_copies"])[None, :])
+    for index_rule_nr, index_branch, is_src, prg_nr, base, table in agent["wild_index"]:
+        if (index_rule_nr == rule_nr and index_branch == branch):
+            ids = table[robot_ids, others] if (table.ndim == 2) else table[others]
+            first = agent["first"][prg_nr]
+            (src if (is_src) else lhs)[:, first:first + agent["nr_copies"]] = base[:, None] + ids
+    return (lhs, src)
+# end getRuleIndexes()
+
+def getApplicablePrograms(agent, obj, envs):
+    """Check which programs of an agent are applicable on each robot. Conditional rules use their main rule if it is applicable
+    and the alternative rule otherwise. The rules of a program consume their objects together so a program that needs two copies
+    of an object is only applicable if both are available
+
+    :agent: An agent of the model from compileSwarm()
+    :obj: The obj multisets of the agent (robots x objects)
+    :envs: The environments (4 x robots x objects), without the objects already consumed by other agents during this step
+    :returns: (applicable (robots x programs), use main rule (robots x programs x rules)) tuple of boolean arrays"""
+
+    nr_robots = obj.shape[0]
+    nr_programs, nr_rules = len(agent["program"]), agent["main_kind"].shape[1]
+    main_kind = agent["main_kind"][agent["program"]]
+    alt_kind = agent["alt_kind"][agent["program"]]
+    obj = obj.ravel()
+    envs = envs.ravel()
+    applicable = np.ones((nr_robots, nr_programs), dtype=bool)
+    use_main = np.zeros((nr_robots, nr_programs, nr_rules), dtype=bool)
+    # objects consumed from the agent and from the environments by the previous rules of each program
+    consumed = []
+
+    for rule_nr in range(nr_rules):
+        branches = []
+        for branch, kind in enumerate((main_kind[:, rule_nr], alt_kind[:, rule_nr])):
+            if (not (kind >= 0).any()):
+                branches.append((np.zeros((nr_robots, nr_programs), dtype=bool), -1, -1))
+                continue
+            lhs, src = getRuleIndexes(agent, rule_nr, branch)
+            lhs_needed = 1 + sum((prev_lhs == lhs) for prev_lhs, prev_src in consumed)
+            ok = (kind >= 0) & (obj[lhs] >= lhs_needed)
+            if ((src >= 0).any()):
+                src_needed = 1 + sum((prev_src == src) for prev_lhs, prev_src in consumed)
+                ok &= (src < 0) | (envs[np.maximum(src, 0)] >= src_needed)
+            branches.append((ok, lhs, src))
+
+        (main_ok, main_lhs, main_src), (alt_ok, alt_lhs, alt_src) = branches
+        applicable &= main_ok | alt_ok | (main_kind[:, rule_nr] < 0)
+        use_main[:, :, rule_nr] = main_ok
+        consumed.append((np.where(main_ok, main_lhs, np.where(alt_ok, alt_lhs, -1)), np.where(main_ok, main_src, np.where(alt_ok, alt_src, -1))))
+
+    return (applicable, use_main)
+# end getApplicablePrograms()
+
+def executePrograms(agent, obj, envs, chosen, use_main, produced):
+    """Execute the chosen program of an agent on each robot. The objects are consumed immediately, so that they are not available
+    to the agents that choose their programs later in the same step, and the objects sent to the environments are added to produced
+
+    :agent: An agent of the model from compileSwarm()
+    :obj: The obj multisets of the agent (robots x objects), modified in place
+    :envs: The environments (4 x robots x objects), modified in place
+    :chosen: The chosen program of each robot, -1 for none
+    :use_main: The branch of each conditional rule, from getApplicablePrograms()
+    :produced: List of (environment, robot, object) arrays of the objects sent to the environments during this step"""
+
+    rows = np.nonzero(chosen >= 0)[0]
+    programs = chosen[rows]
+    templates = agent["program"][programs]
+    ops = getOperands(agent, rows, programs)
+    for rule_nr in range(agent["main_kind"].shape[1]):
+        main = use_main[rows, programs, rule_nr]
+        kind = np.where(main, agent["main_kind"][templates, rule_nr], agent["alt_kind"][templates, rule_nr])
+        lhs = np.where(main, ops[:, rule_nr, 0], ops[:, rule_nr, 2])
+        rhs = np.where(main, ops[:, rule_nr, 1], ops[:, rule_nr, 3])
+        valid = kind >= 0
+        np.subtract.at(obj, (rows[valid], lhs[valid]), 1)
+        np.add.at(obj, (rows[valid], rhs[valid]), 1)
+
+        src = np.where(valid & (rhs != E), src_of_kind[np.maximum(kind, 0)], -1)
+        np.subtract.at(envs, (src[src >= 0], rows[src >= 0], rhs[src >= 0]), 1)
+        dst = np.where(valid & (lhs != E), dst_of_kind[np.maximum(kind, 0)], -1)
+        produced.append((dst[dst >= 0], rows[dst >= 0], lhs[dst >= 0]))
+# end executePrograms()
+
+def runStep(model, state, rng = None, choices = None):
+    """Run one simulation step on all of the robots: each agent chooses one of its applicable programs at random
+    (the agents choose in order and each one sees the environments without the objects consumed by the previous agents)
+    and all of the chosen programs are executed
+
+    :model: The model from compileSwarm()
+    :state: The state of the robots, modified in place
+    :rng: numpy.random.Generator used for choosing the programs
+    :choices: If given, the program of each agent on each robot (agents x robots, -1 for none) instead of random choices
+    :returns: (chosen program of each agent on each robot (-1 for none), True for the robots on which all of the given choices were applicable) tuple"""
+
+    nr_robots = state["obj"].shape[1]
+    chosen_all = np.full((len(model["agents"]), nr_robots), -1, dtype=np.int32)
+    feasible = np.ones(nr_robots, dtype=bool)
+    produced = []
+
+    for ag_nr, agent in enumerate(model["agents"]):
+        applicable, use_main = getApplicablePrograms(agent, state["obj"][ag_nr], state["envs"])
+        if (applicable.shape[1] == 0):
+            chosen = np.full(nr_robots, -1, dtype=np.int32)
+        elif (choices is None):
+            keys = np.where(applicable, rng.random(applicable.shape), -1.0)
+            chosen = np.where(applicable.any(axis=1), keys.argmax(axis=1), -1).astype(np.int32)
+        else:
+            chosen = np.asarray(choices[ag_nr], dtype=np.int32)
+            ok = (chosen < 0) | applicable[np.arange(nr_robots), np.maximum(chosen, 0)]
+            feasible &= ok
+            chosen = np.where(ok, chosen, -1).astype(np.int32)
+
+        executePrograms(agent, state["obj"][ag_nr], state["envs"], chosen, use_main, produced)
+        chosen_all[ag_nr] = chosen
+
+    for env, rows, objects in produced:
+        np.add.at(state["envs"], (env, rows, objects), 1)
+
+    return (chosen_all, feasible)
+# end runStep()
+
+def simulate(pcol, nr_robots, nr_steps, seed = None):
+    """Simulate a swarm of robots that run the expanded instances of a P colony in lock-step
+
+    :pcol: The pcolony object that was read by lulu_pcol_sim (it is not modified)
+    :nr_robots: The number of robots that make up the swarm
+    :nr_steps: The number of simulation steps
+    :seed: The seed of the random choices of programs
+    :returns: (model, final state, number of executions of each program of each agent (list of arrays), number of steps in which
+    each robot had no applicable program, True for the robots that had no applicable program in the last step) tuple"""
+
+    model, state, pcol = compileSwarm(pcol, nr_robots)
+    rng = np.random.default_rng(seed)
+    executions = [np.zeros(len(agent["program"]), dtype=np.int64) for agent in model["agents"]]
+    idle_steps = np.zeros(nr_robots, dtype=np.int64)
+    idle = np.zeros(nr_robots, dtype=bool)
+
+    for step in range(nr_steps):
+        chosen, feasible = runStep(model, state, rng)
+        for ag_nr, agent_chosen in enumerate(chosen):
+            executions[ag_nr] += np.bincount(agent_chosen[agent_chosen >= 0], minlength=len(executions[ag_nr]))
+        idle = (chosen < 0).all(axis=0)
+        idle_steps += idle
+
+    return (model, state, executions, idle_steps, idle)
+# end simulate()
+
+def getSimState(model, pcol):
+    """Read the multisets of a P colony from lulu_pcol_sim into the arrays of a single robot state
+
+    :model: The model from compileSwarm()
+    :pcol: The (expanded) pcolony object that is simulated by lulu_pcol_sim
+    :returns: The state of the robot"""
+
+    nr_objects = len(model["object_names"])
+    state = {"obj": np.zeros((len(model["agents"]), 1, nr_objects), dtype=np.int32), "envs": np.zeros((4, 1, nr_objects), dtype=np.int32)}
+    multisets = [(state["obj"][ag_nr, 0], pcol.agents[agent["name"]].obj) for ag_nr, agent in enumerate(model["agents"])]
+    multisets.append((state["envs"][ENV, 0], pcol.env))
+    if (pcol.parentSwarm != None):
+        multisets.extend([(state["envs"][GLOBAL_ENV, 0], pcol.parentSwarm.global_env), (state["envs"][IN_GLOBAL_ENV, 0], pcol.parentSwarm.in_global_env),
+            (state["envs"][OUT_GLOBAL_ENV, 0], pcol.parentSwarm.out_global_env)])
+
+    for counts, multiset in multisets:
+        for obj, nr in multiset.items():
+            if (obj not in model["object_ids"]):
+                raise ValueError("Object %s from lulu_pcol_sim is not part of the alphabet" % obj)
+            counts[model["object_ids"][obj]] += nr
+
+    return state
+# end getSimState()
+
+def getStateDifferences(model, state, other):
+    """Describe the differences between two single robot states. The number of e objects in the environments is not compared
+    because it is unlimited
+
+    :model: The model from compileSwarm()
+    :state: The first state
+    :other: The second state
+    :returns: List of 'multiset: object first != second' strings"""
+
+    differences = []
+    multisets = [("agent %s" % agent["name"], True, state["obj"][ag_nr, 0], other["obj"][ag_nr, 0]) for ag_nr, agent in enumerate(model["agents"])]
+    multisets.extend((env_name, False, state["envs"][env_nr, 0], other["envs"][env_nr, 0]) for env_nr, env_name in enumerate(["env"] + list(lulu_c.global_env_labels)))
+    for label, is_agent, counts, other_counts in multisets:
+        for obj_id in np.nonzero(counts != other_counts)[0]:
+            if (is_agent or obj_id != E):
+                differences.append("%s: %s %d != %d" % (label, model["object_names"][obj_id], counts[obj_id], other_counts[obj_id]))
+    return differences
+# end getStateDifferences()
+
+def diffAgainstSim(pcol, nr_robots, nr_steps, robots, seed = None):
+    """Run lulu_pcol_sim on the expanded P colony of some of the robots and check, after each step, that there is a choice of programs
+    for which runStep() gives the same multisets. lulu_pcol_sim chooses programs at random so the check is done for all of the choices
+    that lead to the obj multisets computed by lulu_pcol_sim
+
+    :pcol: The pcolony object that was read by lulu_pcol_sim (it is not modified)
+    :nr_robots: The number of robots that make up the swarm
+    :nr_steps: The maximum number of steps compared for each robot
+    :robots: The symbolic ids of the robots that are compared
+    :seed: The seed of the random module used by lulu_pcol_sim
+    :returns: Dictionary robot -> (number of matching steps, description of the first difference or None, True if the comparison stopped
+    because more than max_diff_combinations choices of programs had to be tried) tuple"""
+
+    import random
+    random.seed(seed)
+
+    full_model, full_state, prepared = compileSwarm(pcol, nr_robots)
+    results = {}
+    for robot in robots:
+        model, state = selectRobots(full_model, full_state, [robot])
+        sim_pcol = lulu_c.expandPcolonyForRobot(prepared, nr_robots, robot)
+        differences = getStateDifferences(model, state, getSimState(model, sim_pcol))
+        if (len(differences) > 0):
+            results[robot] = (0, "initial multisets differ: %s" % ", ".join(differences), False)
+            continue
+
+        results[robot] = (0, None, False)
+        for step in range(nr_steps):
+            before = {"obj": state["obj"].copy(), "envs": state["envs"].copy()}
+            sim_pcol.runSimulationStep()
+            after = getSimState(model, sim_pcol)
+
+            # candidate programs of each agent: the applicable programs that lead to the obj multiset computed by lulu_pcol_sim
+            candidates = []
+            for ag_nr, agent in enumerate(model["agents"]):
+                applicable, use_main = getApplicablePrograms(agent, before["obj"][ag_nr], before["envs"])
+                agent_candidates = [-1] if ((after["obj"][ag_nr] == before["obj"][ag_nr]).all()) else []
+                for prg_nr in np.nonzero(applicable[0])[0]:
+                    trial = {"obj": before["obj"][ag_nr:ag_nr + 1].copy(), "envs": before["envs"].copy()}
+                    executePrograms(agent, trial["obj"][0], trial["envs"], np.array([prg_nr]), use_main, [])
+                    if ((trial["obj"] == after["obj"][ag_nr:ag_nr + 1]).all()):
+                        agent_candidates.append(prg_nr)
+                candidates.append(agent_candidates)
+
+            matched = False
+            for combination in itertools.islice(itertools.product(*candidates), max_diff_combinations):
+                trial = {"obj": before["obj"].copy(), "envs": before["envs"].copy()}
+                chosen, feasible = runStep(model, trial, choices=np.array(combination, dtype=np.int32)[:, None])
+                if (feasible[0] and len(getStateDifferences(model, trial, after)) == 0):
+                    matched = True
+                    break
+
+            nr_combinations = int(np.prod([len(agent_candidates) for agent_candidates in candidates]))
+            if (not matched and nr_combinations > max_diff_combinations):
+                results[robot] = (step, "step %d: gave up after %d of the %d choices of programs" % (step, max_diff_combinations, nr_combinations), True)
+                break
+            if (not matched):
+                results[robot] = (step, "step %d: no choice of programs gives the multisets of lulu_pcol_sim (before != after the step: %s)" % (step,
+                    ", ".join(getStateDifferences(model, before, after)) or "unchanged"), False)
+                break
+
+            state = trial
+            results[robot] = (step + 1, None, False)
+            # lulu_pcol_sim stops when no agent has an executable program
+            if (all(combination_program < 0 for combination_program in combination)):
+                break
+
+    return results
+# end diffAgainstSim()
+
+def reportSimulation(model, state, executions, idle_steps, idle, nr_steps, seconds, top):
+    """Log the speed of the simulation, the most executed programs and the robots that stopped
+
+    :model: The model from compileSwarm()
+    :state: The final state
+    :executions: The number of executions of each program of each agent, from simulate()
+    :idle_steps: The number of steps in which each robot had no applicable program
+    :idle: True for the robots that had no applicable program in the last step
+    :nr_steps: The number of simulation steps
+    :seconds: The duration of the simulation
+    :top: The number of programs that are reported"""
+
+    nr_robots = state["obj"].shape[1]
+    logging.info("Simulated %d robots for %d steps in %.3f s (%.0f robot steps per second)" % (nr_robots, nr_steps, seconds,
+        nr_robots * nr_steps / seconds if seconds > 0 else 0))
+    logging.info("%d robots had no applicable program in at least one step, %d in the last step" % ((idle_steps > 0).sum(), idle.sum()))
+
+    # the executions of the programs expanded from the same program of the input file are added up
+    programs = []
+    for agent, agent_executions in zip(model["agents"], executions):
+        totals = np.bincount(agent["program"], weights=agent_executions, minlength=len(agent["program_texts"]))
+        programs.extend((int(total), agent["name"], prg_nr, agent["program_texts"][prg_nr]) for prg_nr, total in enumerate(totals))
+    programs.sort(reverse=True)
+    for total, ag_name, prg_nr, text in programs[:top]:
+        if (total > 0):
+            logging.info("%10d executions of agent %s program %d: < %s >" % (total, ag_name, prg_nr, text))
+
+    env_totals = state["envs"][ENV].sum(axis=0)
+    for obj_id in np.argsort(-env_totals)[:top]:
+        if (env_totals[obj_id] > 0 and obj_id != E):
+            logging.debug("env of all robots: %d x %s" % (env_totals[obj_id], model["object_names"][obj_id]))
+# end reportSimulation()
+
+if (__name__ == "__main__"):
+    logLevel = logging.INFO
+    if ('--debug' in sys.argv):
+        logLevel = logging.DEBUG
+    logging.basicConfig(format='%(levelname)s:%(message)s', level = logLevel)
+
+    nr_steps = 100
+    seed = None
+    nr_diff_robots = 0
+    top = 10
+    for arg in sys.argv:
+        if (arg.startswith("--steps=")):
+            nr_steps = int(arg.split("=", 1)[1])
+        if (arg.startswith("--seed=")):
+            seed = int(arg.split("=", 1)[1])
+        if (arg.startswith("--diff=")):
+            nr_diff_robots = int(arg.split("=", 1)[1])
+        if (arg.startswith("--top=")):
+            top = int(arg.split("=", 1)[1])
+    args = [arg for arg in sys.argv if not arg.startswith("--")]
+
+    if (len(args) < 2):
+        logging.error("Expected input file path as parameter")
+        exit(1)
+
+    if (len(args) < 3):
+        logging.error("Expected the number of robots that make up the swarm")
+        exit(1)
+
+    pObj = lulu_c.sim.readInputFile(args[1])
+    if (pObj == None):
+        logging.error("Could not read the Lulu input file %s" % args[1])
+        exit(1)
+    nr_robots = int(args[2])
+
+    if (type(pObj) == lulu_c.sim.Pswarm):
+        if (len(args) < 4 or args[3] not in pObj.colonies):
+            logging.error("Expected the name of a colony from the Pswarm: %s" % ", ".join(pObj.C))
+            exit(1)
+        pObj = pObj.colonies[args[3]]
+
+    start = time.perf_counter()
+    try:
+        model, state, executions, idle_steps, idle = simulate(pObj, nr_robots, nr_steps, seed)
+    except ValueError as e:
+        logging.error(e)
+        exit(1)
+    reportSimulation(model, state, executions, idle_steps, idle, nr_steps, time.perf_counter() - start, top)
+
+    if (nr_diff_robots > 0):
+        results = diffAgainstSim(pObj, nr_robots, nr_steps, range(min(nr_diff_robots, nr_robots)), seed)
+        for robot, (nr_matching, difference, gave_up) in sorted(results.items()):
+            if (difference == None):
+                logging.info("Robot %d: %d steps match lulu_pcol_sim" % (robot, nr_matching))
+            elif (gave_up):
+                logging.warning("Robot %d: %d steps match lulu_pcol_sim, the comparison %s" % (robot, nr_matching, difference))
+            else:
+                logging.error("Robot %d: %s" % (robot, difference))
+        if (any(difference != None and not gave_up for nr_matching, difference, gave_up in results.values())):
+            exit(1)